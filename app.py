@@ -4,6 +4,8 @@ import numpy as np
 import plotly.graph_objects as go
 import plotly.express as px
 import warnings
+import os
+import time
 
 # 将来の警告を無視する設定
 warnings.simplefilter(action='ignore', category=FutureWarning)
@@ -12,8 +14,13 @@ warnings.simplefilter(action='ignore', category=FutureWarning)
 # 🔗 モジュール読み込みチェック
 # =========================================================
 try:
-    from simulation_engine import MarketDataEngine, PortfolioAnalyzer, PortfolioDiagnosticEngine
+    from simulation_engine import MarketDataEngine, PortfolioAnalyzer, ParameterSweepEngine, SufficientStatistics, FactorSimulationEngine
     from pdf_generator import create_pdf_report
+    from chart_data import downsample_series, histogram_bar, report_figures, COLORS
+    from job_server import AnalysisClient, compute_analysis, SIM_YEARS, INITIAL_INVESTMENT
+    from ticker_index import TICKER_INDEX
+    from snapshot_store import SNAPSHOTS, unpack_snapshot
+    from prefetch import WarmupScheduler, USAGE_STATS, WARMUP_ENABLED
 except ImportError as e:
     st.error(f"❌ 重要ファイルが見つかりません: {e}")
     st.info("app.py と同じフォルダに 'simulation_engine.py' と 'pdf_generator.py' があるか確認してください。")
@@ -23,19 +30,11 @@ except ImportError as e:
 # ⚙️ 定数・設定
 # =========================================================
 
-# 🎨 カラーパレット
-COLORS = {
-    'main': '#00FFFF',      # Neon Cyan
-    'benchmark': '#FF69B4', # Hot Pink
-    'principal': '#FFFFFF', # White
-    'median': '#32CD32',    # Lime Green
-    'mean': '#FFD700',      # Gold
-    'p10': '#FF6347',       # Pessimistic
-    'p90': '#00BFFF',       # Optimistic
-    'hist_bar': '#42A5F5',  # Mid Blue
-    'cost_net': '#FF6347',  # Tomato Red
-    'bg_fill': 'rgba(0, 255, 255, 0.1)'
-}
+@st.cache_resource
+def get_warmup_scheduler():
+    # プロセスで1つだけ起動 (全セッション共有のキャッシュを裏で温める)
+    return WarmupScheduler().start() if WARMUP_ENABLED else None
+
 
 st.set_page_config(page_title="Factor Simulator V17.2", layout="wide", page_icon="🧬")
 
@@ -69,6 +68,12 @@ if 'payload' not in st.session_state:
     st.session_state.payload = None
 if 'figs' not in st.session_state:
     st.session_state.figs = {}
+if 'tables' not in st.session_state:
+    st.session_state.tables = {}
+if 'from_snapshot' not in st.session_state:
+    st.session_state.from_snapshot = False
+if 'server_job' not in st.session_state:
+    st.session_state.server_job = None
 
 # =========================================================
 # 🏗️ サイドバー: ポートフォリオ設定
@@ -101,12 +106,10 @@ with st.sidebar:
     st.markdown("### 2. Analysis Model & Benchmark")
     target_region = st.selectbox("Analysis Region", ["US (United States)", "Japan", "Global"], index=0)
     region_code = target_region.split()[0]
+    auto_factor_model = st.checkbox("Auto-select Factor Model", value=True,
+                                    help="Fits US / Japan / Global 3- and 5-factor models side by side and uses the best adjusted R².")
     
-    bench_options = {
-        'US': {'S&P 500 (^GSPC)': '^GSPC', 'NASDAQ 100 (^NDX)': '^NDX'},
-        'Japan': {'TOPIX (1306 ETF)': '1306.T', 'Nikkei 225 (^N225)': '^N225'},
-        'Global': {'VT (Total World)': 'VT', 'MSCI ACWI (Index)': 'ACWI'}
-    }
+    bench_options = MarketDataEngine.BENCHMARK_OPTIONS
     selected_bench_label = st.selectbox("Benchmark", list(bench_options[region_code].keys()) + ["Custom"])
 
     if selected_bench_label == "Custom":
@@ -117,7 +120,31 @@ with st.sidebar:
     st.markdown("### 3. Cost Settings")
     cost_tier = st.select_slider("Management Cost", options=["Low", "Medium", "High"], value="Medium")
 
-    st.markdown("### 4. Advisor's Note")
+    st.markdown("### 4. Simulation Model")
+    vol_model_labels = {
+        "Constant Volatility": "constant",
+        "GARCH(1,1) Clustering": "garch",
+        "Regime Switching (2-State)": "regime",
+    }
+    vol_model_label = st.selectbox("Volatility Model", list(vol_model_labels.keys()), index=0,
+                                   help="GARCH and regime models reproduce volatility clustering in bad years.")
+    n_sims = st.select_slider("Simulation Paths", options=[7500, 25000, 100000], value=7500)
+    with st.expander("🎯 Variance Reduction"):
+        sampling_labels = {"Pseudo-random": "pseudo", "Antithetic Variates": "antithetic", "Sobol Quasi-random": "sobol"}
+        sampling_label = st.selectbox("Sampling", list(sampling_labels.keys()), index=0)
+        use_control_variate = st.checkbox("Control Variates", value=False)
+        adaptive_mc = st.checkbox("Adaptive (stop at target precision)", value=False,
+                                  help="Adds batches until P10/P50/P90 reach the target error. 'Simulation Paths' becomes the upper limit.")
+        target_rel_err = st.slider("Target Relative Error (%)", 0.1, 2.0, 0.5, 0.1)
+
+    st.markdown("### 5. Cash Flow Plan")
+    monthly_contrib = st.number_input("Monthly Contribution (JPY)", min_value=0, value=0, step=10000)
+    contrib_years = st.number_input("Contribution Period (Years)", min_value=0, max_value=50, value=10)
+    annual_withdrawal = st.number_input("Annual Withdrawal (JPY)", min_value=0, value=0, step=100000)
+    withdrawal_start = st.number_input("Withdrawals Start After (Years)", min_value=0, max_value=50, value=10)
+    goal_amount = st.number_input("Goal Amount (JPY, 0 = none)", min_value=0, value=0, step=1000000)
+
+    st.markdown("### 6. Advisor's Note")
     st.caption("✍️ Add your personal message. This appears at the top of the PDF.")
     
     default_note = "Based on our strategy session, I recommend maintaining this allocation to balance growth and stability."
@@ -128,13 +155,61 @@ with st.sidebar:
     st.markdown("---")
     analyze_btn = st.button("🚀 Start Analysis", type="primary", use_container_width=True)
 
+    warmup = get_warmup_scheduler()
+    if warmup is not None:
+        warm_status = warmup.status()
+        if warm_status['last_cycle_at'] is None:
+            st.caption("🔥 Warming benchmark, FX and factor caches...")
+        else:
+            warm_age = (time.time() - warm_status['last_cycle_at']) / 60
+            st.caption(f"🔥 Warm cache refreshed {warm_age:,.0f} min ago "
+                       f"({warm_status['ok']}/{warm_status['total']} ok)")
+
+    with st.expander("🧠 Data Cache Status"):
+        cache_stats = MarketDataEngine.cache_stats()
+        st.caption(f"Memory: {cache_stats['bytes'] / 1024**2:,.1f} / {cache_stats['max_bytes'] / 1024**2:,.0f} MB "
+                   f"| Entries: {cache_stats['entries']}/{cache_stats['max_entries']}")
+        st.caption(f"Hits: {cache_stats['hits']} | Misses: {cache_stats['misses']} "
+                   f"| Evictions: {cache_stats['evictions']} | Expired: {cache_stats['expirations']}")
+        st.caption(f"Ticker index: {len(TICKER_INDEX)} symbols (validation and currency lookups are local)")
+
+    with st.expander("📂 Saved Analyses"):
+        loaded_snapshot = None
+        snapshot_clients = SNAPSHOTS.clients()
+        if snapshot_clients:
+            snap_client = st.selectbox("Client", snapshot_clients)
+            snap_list = SNAPSHOTS.list(snap_client)
+            snap_id = st.selectbox("Snapshot", list(snap_list.index),
+                                   format_func=lambda i: f"{snap_list.loc[i, 'created']} | {snap_list.loc[i, 'label']}")
+            if st.button("📂 Load Snapshot", use_container_width=True):
+                loaded_snapshot = SNAPSHOTS.read_bytes(snap_id)
+        else:
+            st.caption("No saved analyses yet.")
+        snap_file = st.file_uploader("Or open a snapshot file", type=['zip'])
+        if snap_file is not None and st.button("📂 Open File", use_container_width=True):
+            loaded_snapshot = snap_file.getvalue()
+
+        if loaded_snapshot is not None:
+            try:
+                snap_data, snap_payload, snap_figs, snap_tables, snap_meta = unpack_snapshot(loaded_snapshot)
+                st.session_state.portfolio_data = snap_data
+                st.session_state.payload = snap_payload
+                st.session_state.figs = snap_figs
+                st.session_state.tables = snap_tables
+                st.session_state.from_snapshot = True
+                st.session_state.server_job = None
+                st.session_state.pdf_bytes = None
+                st.success(f"✅ Loaded: {snap_meta['label']}")
+            except Exception as e:
+                st.error(f"Snapshot Error: {e}")
+
 
 # =========================================================
 # 🚀 メインロジック (計算実行)
 # =========================================================
 
 if analyze_btn:
-    with st.spinner("⏳ Fetching data & running 7,500 simulations..."):
+    with st.spinner(f"⏳ Fetching data & running {n_sims:,} simulations..."):
         try:
             # 1. 入力解析
             raw_items = [item.strip() for item in input_text.split(',')]
@@ -147,42 +222,63 @@ if analyze_btn:
 
             if not parsed_dict: st.stop()
 
-            # 🚀 Engine 呼び出し
-            engine = MarketDataEngine()
-            valid_assets, _ = engine.validate_tickers(parsed_dict)
-            if not valid_assets:
-                st.error("有効なティッカーが見つかりませんでした。")
-                st.stop()
-
-            tickers = list(valid_assets.keys())
-            hist_returns = engine.fetch_historical_prices(tickers)
-
-            if hist_returns.empty:
-                 st.error("価格データの取得に失敗しました。")
-                 st.stop()
-
-            weights_clean = {k: v['weight'] for k, v in valid_assets.items()}
-            port_series, final_weights = PortfolioAnalyzer.create_synthetic_history(hist_returns, weights_clean)
-
-            # 2. ベンチマーク取得
-            is_jpy_bench = True if bench_ticker in ['^TPX', '^N225', '1306.T'] or bench_ticker.endswith('.T') else False
-            bench_series = engine.fetch_benchmark_data(bench_ticker, is_jpy_asset=is_jpy_bench)
-
-            # 3. ファクター取得
-            french_factors = engine.fetch_french_factors(region_code)
-
-            # データ保存
-            st.session_state.portfolio_data = {
-                'returns': port_series,
-                'benchmark': bench_series,
-                'components': hist_returns,
-                'weights': final_weights,
-                'factors': french_factors,
-                'asset_info': valid_assets,
+            settings = {
                 'cost_tier': cost_tier,
+                'vol_model': vol_model_labels[vol_model_label],
+                'n_sims': n_sims,
+                'cash_plan': {
+                    'monthly_contribution': float(monthly_contrib),
+                    'contribution_months': int(contrib_years) * 12,
+                    'annual_withdrawal': float(annual_withdrawal),
+                    'withdrawal_start_month': int(withdrawal_start) * 12,
+                    'goal_amount': float(goal_amount),
+                },
+                'mc_options': {
+                    'sampling': sampling_labels[sampling_label],
+                    'control_variate': use_control_variate,
+                    'adaptive': adaptive_mc,
+                    'target_rel_error': target_rel_err / 100,
+                },
                 'bench_name': selected_bench_label,
+                'bench_ticker': bench_ticker,
             }
-            
+
+            server_url = os.environ.get("ANALYSIS_SERVER_URL")
+            if server_url:
+                # 🛰️ ジョブサーバーへ投入し、進捗をポーリング (重い処理はワーカープロセス側)
+                client = AnalysisClient(server_url)
+                job_id = client.submit({'weights': parsed_dict, 'bench_ticker': bench_ticker, 'region': region_code,
+                                        'auto_factor_model': auto_factor_model, 'settings': settings,
+                                        'advisor_note': advisor_note})
+                job_bar = st.progress(0.0, text="Queued...")
+                job_status = client.wait(job_id, on_progress=lambda s: job_bar.progress(min(float(s['progress']), 1.0), text=s['stage']))
+                job_bar.empty()
+                if job_status['status'] != 'done':
+                    st.error(f"データ取得エラー: {job_status['error']}")
+                    st.stop()
+                job_result = client.result(job_id)
+                inputs = job_result['portfolio_data']
+                job_payload, job_tables = job_result['payload'], job_result['tables']
+                server_job = {'id': job_id, 'advisor_note': advisor_note}
+            else:
+                # 🚀 Engine 呼び出し
+                engine = MarketDataEngine()
+                inputs, load_error = engine.load_portfolio_inputs(parsed_dict, bench_ticker, region_code, auto_factor_model)
+                if inputs is None:
+                    st.error(f"データ取得エラー: {load_error}")
+                    st.stop()
+                # 分析はダッシュボード描画時に1回だけ実行する
+                job_payload, job_tables, server_job = None, {}, None
+                # サーバーモードではワーカー側で記録済み
+                USAGE_STATS.record(list(inputs['asset_info'].keys()), bench_ticker)
+
+            # データ保存
+            st.session_state.portfolio_data = {**inputs, **settings}
+            st.session_state.payload = job_payload
+            st.session_state.tables = job_tables
+            st.session_state.from_snapshot = False
+            st.session_state.server_job = server_job
+
             # 再計算時にキャッシュをクリア
             st.session_state.pdf_bytes = None
             st.session_state.analysis_done = False
@@ -192,6 +288,65 @@ if analyze_btn:
             st.stop()
 
 
+# =========================================================
+# ⚡ What-If ウェイト (十分統計量から即時計算)
+# =========================================================
+
+@st.fragment
+def render_what_if_weights(suff_stats, base_weights, bench_name):
+    # スライダー操作ではこのフラグメントだけが再実行される (履歴の再走査なし)
+    st.markdown("### ⚡ What-If Weights")
+    st.caption(f"Live metrics from cached statistics ({suff_stats.n} months). Weights are re-normalized.")
+    trial = {}
+    for t in suff_stats.tickers:
+        trial[t] = st.slider(t, 0, 100, int(round(base_weights.get(t, 0.0) * 100)), 1, key=f"whatif_{t}")
+    if sum(trial.values()) <= 0:
+        st.warning("Set at least one weight above 0.")
+        return
+
+    m = suff_stats.portfolio_metrics(trial, risk_free=0.02)
+    base = suff_stats.portfolio_metrics(base_weights, risk_free=0.02)
+    c1, c2 = st.columns(2)
+    c1.metric("Volatility", f"{m['volatility']:.2%}", f"{m['volatility'] - base['volatility']:+.2%}", delta_color="inverse")
+    c2.metric("Sharpe (arith.)", f"{m['sharpe']:.2f}", f"{m['sharpe'] - base['sharpe']:+.2f}")
+    if 'tracking_error' in m:
+        c1, c2 = st.columns(2)
+        c1.metric("Tracking Error", f"{m['tracking_error']:.2%}", f"{m['tracking_error'] - base['tracking_error']:+.2%}", delta_color="inverse")
+        c2.metric("Info Ratio", f"{m['information_ratio']:.2f}", f"{m['information_ratio'] - base['information_ratio']:+.2f}")
+        st.caption(f"vs {bench_name}")
+    if 'betas' in m:
+        betas = m['betas'].drop('const')
+        st.caption(" | ".join(f"β {k}: {v:.2f}" for k, v in betas.items()) + f" | R²: {m['r_squared']:.2f}")
+
+
+@st.fragment
+def render_correlation_explorer(components):
+    # 手法切替・日付スライダーはこのフラグメントだけを再実行
+    c1, c2 = st.columns(2)
+    corr_mode = c1.radio("Method", ["Rolling 36M", "EWMA (Half-life 12M)"], horizontal=True)
+    method = 'ewma' if corr_mode.startswith("EWMA") else 'rolling'
+    dates, corr_stack = PortfolioAnalyzer.dynamic_correlation(components, window=36, method=method, halflife=12)
+    if len(dates) == 0:
+        st.info("Need at least 2 assets and 36 months of overlapping history.")
+        return
+
+    avg_corr = downsample_series(pd.Series(PortfolioAnalyzer.average_pairwise_correlation(corr_stack), index=dates))
+    fig_avg = go.Figure(go.Scatter(x=avg_corr.index, y=avg_corr, mode='lines', line=dict(color=COLORS['main'], width=2),
+                                   name='Avg. Pairwise Correlation'))
+    fig_avg.update_layout(title="Average Pairwise Correlation", height=250, template="plotly_dark",
+                          yaxis_range=[-1, 1], margin=dict(t=40, b=20))
+
+    labels = [d.strftime('%Y-%m') for d in dates]
+    pick = c2.select_slider("Month", options=labels, value=labels[-1])
+    fig_avg.add_vline(x=dates[labels.index(pick)], line_dash='dot', line_color=COLORS['principal'])
+    st.plotly_chart(fig_avg, use_container_width=True)
+
+    fig_dyn = px.imshow(pd.DataFrame(corr_stack[labels.index(pick)], index=components.columns, columns=components.columns),
+                        text_auto='.2f', aspect="auto", color_continuous_scale='RdBu_r', zmin=-1, zmax=1)
+    fig_dyn.update_layout(title=f"Correlation as of {pick}", height=380)
+    st.plotly_chart(fig_dyn, use_container_width=True)
+
+
 # =========================================================
 # 📊 ダッシュボード表示 & PDF用データ準備
 # =========================================================
@@ -200,106 +355,66 @@ if st.session_state.portfolio_data:
     data = st.session_state.portfolio_data
     analyzer = PortfolioAnalyzer()
     port_ret = data['returns']
-    bench_ret = data['benchmark']
-
-    # --- 1. 基本指標 ---
-    total_ret_cum = (1 + port_ret).cumprod()
-    cagr = (total_ret_cum.iloc[-1])**(12/len(port_ret)) - 1
-    vol = port_ret.std() * np.sqrt(12)
-    max_dd = (total_ret_cum / total_ret_cum.cummax() - 1).min()
-    calmar = analyzer.calculate_calmar_ratio(port_ret)
-    omega = analyzer.calculate_omega_ratio(port_ret, threshold=0.0) 
-    info_ratio, track_err = analyzer.calculate_information_ratio(port_ret, bench_ret)
-    sharpe_ratio = (cagr - 0.02) / vol # Simplified Sharpe
-
-    # --- 2. 高度計算 ---
-    params, r_sq = analyzer.perform_factor_regression(port_ret, data['factors'])
-    if params is not None:
-        factor_comment = PortfolioDiagnosticEngine.generate_factor_report(params)
-    else:
-        factor_comment = "No factor data available."
-
-    # モンテカルロ
-    sim_years = 20
-    init_inv = 1000000
-    df_stats, final_values = analyzer.run_monte_carlo_simulation(port_ret, n_years=sim_years, n_simulations=7500, initial_investment=init_inv)
-    
-    final_median = np.median(final_values)
-    final_p10 = np.percentile(final_values, 10)
-    final_p90 = np.percentile(final_values, 90)
-    
-    # 相関行列
-    corr_matrix = analyzer.calculate_correlation_matrix(data['components'])
-    fig_corr_report = None
-    if not corr_matrix.empty:
-        fig_corr_report = px.imshow(corr_matrix, text_auto='.2f', aspect="auto", color_continuous_scale='RdBu_r', zmin=-1, zmax=1)
-
-    # AI診断
-    pca_ratio, _ = analyzer.perform_pca(data['components'])
-    report = PortfolioDiagnosticEngine.generate_report(data['weights'], pca_ratio, port_ret)
-
-    # ▼▼▼ 詳細レビュー生成 ▼▼▼
-    detailed_review = []
-    
-    # 効率性評価
-    if sharpe_ratio > 1.0:
-        detailed_review.append(f"✅ Efficiency: The portfolio demonstrates excellent risk-adjusted returns (Sharpe: {sharpe_ratio:.2f}). You are getting well-compensated for the risk taken.")
-    elif sharpe_ratio > 0.6:
-        detailed_review.append(f"ℹ️ Efficiency: The portfolio has a balanced risk/return profile (Sharpe: {sharpe_ratio:.2f}), typical for a diversified equity strategy.")
-    else:
-        detailed_review.append(f"⚠️ Efficiency: Risk-adjusted returns are lower than ideal (Sharpe: {sharpe_ratio:.2f}). Consider increasing diversification or reducing volatile assets.")
-
-    # ボラティリティ評価
-    if vol < 0.12:
-        detailed_review.append(f"🛡️ Stability: Volatility is low ({vol:.2%}), suggesting a defensive posture suitable for capital preservation.")
-    elif vol < 0.18:
-        detailed_review.append(f"⚖️ Stability: Volatility is moderate ({vol:.2%}), aligning with standard market fluctuations.")
-    else:
-        detailed_review.append(f"🔥 Stability: Volatility is high ({vol:.2%}). Ensure your risk tolerance matches this potential variance.")
-
-    # ドローダウン評価
-    detailed_review.append(f"📉 Stress Test: The historical maximum drawdown was {max_dd:.2%}. In future bear markets, expect temporary declines of similar magnitude.")
-
-    detailed_review_str = "\n".join(detailed_review)
-
-    # --- 3. Payload 作成 ---
-    analysis_payload = {
-        'metrics': {
-            'CAGR': f"{cagr:.2%}",
-            'Volatility': f"{vol:.2%}",
-            'Max Drawdown': f"{max_dd:.2%}",
-            'Sharpe Ratio': f"{sharpe_ratio:.2f}",
-            'Calmar Ratio': f"{calmar:.2f}",
-            'Information Ratio': f"{info_ratio:.2f}" if not np.isnan(info_ratio) else "N/A"
-        },
-        'factor_comment': factor_comment,
-        'ai_diagnosis': {
-            'status': report['diversification_comment'],
-            'risk': report['risk_comment'],
-            'action': report['action_plan']
-        },
-        'detailed_review': detailed_review_str,
-        'mc_stats': f"Median Outlook: {final_median:,.0f} JPY | "
-                    f"Pessimistic (10%): {final_p10:,.0f} JPY | "
-                    f"Optimistic (90%): {final_p90:,.0f} JPY\n\n"
-    }
+    server_mode = bool(os.environ.get("ANALYSIS_SERVER_URL"))
+
+    # --- 1. 計算 (結果が無い時だけ。ジョブサーバー/スナップショットの結果はそのまま描画) ---
+    if not st.session_state.tables or 'summary' not in (st.session_state.payload or {}):
+        if st.session_state.from_snapshot:
+            st.info("ℹ️ This snapshot predates stored results; analytics were recomputed from its inputs.")
+        with st.spinner("⏳ Running analytics..."):
+            st.session_state.payload, st.session_state.tables = compute_analysis(data)
+    payload, tables = st.session_state.payload, st.session_state.tables
+    summary = payload['summary']
+
+    sim_years = SIM_YEARS
+    init_inv = INITIAL_INVESTMENT
+    n_paths = summary['n_paths']
+    vol_model, requested_vol_model = summary['vol_model'], summary['vol_model_requested']
+    mc_opts = data.get('mc_options', {})
+    sampling = mc_opts.get('sampling', 'pseudo')
+    use_cv = mc_opts.get('control_variate', False)
+    cash_plan = data.get('cash_plan', {})
+    factor_model_label = summary['factor_model']
+    factor_df = (data.get('factor_sets') or {}).get(factor_model_label, data['factors'])
+    factor_models = tables['factor_models']
+    params = tables['factor_params'] if len(tables['factor_params']) else None
+    df_stats, stress_df = tables['mc_stats'], tables['stress_test']
+    final_p10, final_median, final_p90 = df_stats[['p10', 'p50', 'p90']].iloc[-1]
+    info_ratio = summary['information_ratio']
+
+    # 整列済みパネル (What-If とファクターシミュレーション用、軽量)
+    panel = analyzer.build_panel(port_ret, data['components'], data['benchmark'], factor_df)
+    # バスケット単位の十分統計量: 新しい月だけを加算し、ウェイト変更は行列積のみで再計算
+    # ラベルは一意でない ("Custom"、各地域の 3F は同じ列名) ため、ティッカーとモデル名で識別
+    basket_key = (tuple(panel.component_names), data.get('bench_ticker', data['bench_name']), factor_model_label)
+    suff_stats = SufficientStatistics.for_basket(basket_key, panel)
+    if suff_stats.n >= 2:
+        with st.sidebar:
+            st.markdown("---")
+            render_what_if_weights(suff_stats, data['weights'], data['bench_name'])
 
-    figs_for_report = {}
-    if fig_corr_report:
-        figs_for_report['correlation'] = fig_corr_report
+    # レポート用の図はワーカーと同じビルダーで作る (PDF と画面が一致する)
+    figs_for_report = report_figures(tables, data['weights'], data['bench_name'])
 
-    # --- 4. ビジュアライゼーション表示 ---
+    # --- 2. ビジュアライゼーション表示 ---
     st.markdown("---")
 
     c1, c2, c3, c4, c5 = st.columns(5)
-    c1.metric("CAGR", f"{cagr:.2%}")
-    c2.metric("Vol (Risk)", f"{vol:.2%}")
-    c3.metric("Max DD", f"{max_dd:.2%}", delta_color="inverse")
-    c4.metric("Sharpe Ratio", f"{sharpe_ratio:.2f}")
-    c5.metric("Omega Ratio", f"{omega:.2f}")
+    c1.metric("CAGR", f"{summary['cagr']:.2%}")
+    c2.metric("Vol (Risk)", f"{summary['volatility']:.2%}")
+    c3.metric("Max DD", f"{summary['max_drawdown']:.2%}", delta_color="inverse")
+    c4.metric("Sharpe Ratio", f"{summary['sharpe']:.2f}")
+    c5.metric("Omega Ratio", f"{summary['omega']:.2f}")
+
+    c1, c2, c3, c4, c5 = st.columns(5)
+    c1.metric("Sortino Ratio", f"{summary['sortino']:.2f}")
+    c2.metric("Calmar Ratio", f"{summary['calmar']:.2f}")
+    c3.metric("VaR 95% (1M)", f"{summary['var']:.2%}")
+    c4.metric("CVaR 95% (1M)", f"{summary['cvar']:.2%}")
+    c5.metric("Max DD Duration", f"{summary['max_dd_duration']} mo")
 
     if not np.isnan(info_ratio):
-        st.caption(f"📊 vs {data['bench_name']} | Information Ratio: **{info_ratio:.2f}** (Tracking Error: {track_err:.2%})")
+        st.caption(f"📊 vs {data['bench_name']} | Information Ratio: **{info_ratio:.2f}** (Tracking Error: {summary['tracking_error']:.2%})")
 
     tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["🧬 DNA", "🌊 Factors", "⏳ History", "💸 Cost", "🏆 Attribution", "🔮 Future"])
 
@@ -308,7 +423,7 @@ if st.session_state.portfolio_data:
         with c1:
             st.subheader("Diversification Quality")
             fig_gauge = go.Figure(go.Indicator(
-                mode = "gauge+number", value = pca_ratio * 100, 
+                mode = "gauge+number", value = summary['pca_ratio'] * 100,
                 title = {'text': "1st PCA Component Dominance (%)"},
                 gauge = {'axis': {'range': [0, 100]}, 'bar': {'color': COLORS['main']},
                          'steps': [{'range': [0, 60], 'color': "#333"}, {'range': [60, 100], 'color': "#555"}],
@@ -317,88 +432,116 @@ if st.session_state.portfolio_data:
             st.plotly_chart(fig_gauge, use_container_width=True)
 
             st.subheader("Asset Allocation")
-            fig_pie = px.pie(values=list(data['weights'].values()), names=list(data['weights'].keys()), hole=0.4, color_discrete_sequence=px.colors.sequential.RdBu)
-            st.plotly_chart(fig_pie, use_container_width=True)
-            figs_for_report['pie'] = fig_pie
+            st.plotly_chart(figs_for_report['pie'], use_container_width=True)
 
         with c2:
             st.subheader("🩺 Portfolio Diagnosis")
+            diagnosis = payload['ai_diagnosis']
             st.markdown(f"""
             <div class="report-box">
-                <h3 style="color: #00FFFF; margin-bottom:0px;">{report['type']}</h3>
+                <h3 style="color: #00FFFF; margin-bottom:0px;">{summary['portfolio_type']}</h3>
                 <hr style="margin-top:5px; margin-bottom:10px; border-color: #555;">
-                <p><b>🧐 Status:</b><br>{report['diversification_comment']}</p>
-                <p><b>⚠️ Risk Alert:</b><br>{report['risk_comment']}</p>
-                <p><b>💡 Action Plan:</b><br>{report['action_plan']}</p>
+                <p><b>🧐 Status:</b><br>{diagnosis['status']}</p>
+                <p><b>⚠️ Risk Alert:</b><br>{diagnosis['risk']}</p>
+                <p><b>💡 Action Plan:</b><br>{diagnosis['action']}</p>
             </div>
             """, unsafe_allow_html=True)
-            
-            st.info(f"🤖 **AI Analysis:**\n\n{detailed_review_str}")
+
+            st.info(f"🤖 **AI Analysis:**\n\n{payload['detailed_review']}")
 
             st.markdown("---")
             st.subheader("🔥 Correlation Heatmap")
-            if fig_corr_report:
-                st.plotly_chart(fig_corr_report, use_container_width=True)
+            if 'correlation' in figs_for_report:
+                st.plotly_chart(figs_for_report['correlation'], use_container_width=True)
+            # 大規模ポートフォリオは上位保有銘柄のみ表示 (N x N は描画しない)
+            heatmap_assets = list(tables['correlation'].columns)
+            if len(heatmap_assets) < len(data['weights']):
+                st.caption(f"Showing the {len(heatmap_assets)} largest holdings of {len(data['weights'])}.")
+
+        st.markdown("---")
+        st.subheader("🌡️ Dynamic Correlation (Crisis Spikes)")
+        # T x N x N のスタックを避けるためヒートマップと同じ銘柄に限定
+        render_correlation_explorer(data['components'][heatmap_assets])
 
     with tab2:
-        if data['factors'].empty:
+        if factor_df.empty:
             st.error("🚫 Failed to fetch factor data.")
         else:
             st.subheader("📊 Style Analysis (Regression)")
+            st.caption(f"Factor model: **{factor_model_label}**" + (" (auto-selected by adjusted R²)" if summary['factor_model_auto'] else ""))
             if params is not None:
                 c1, c2 = st.columns([1, 1])
                 with c1:
-                    beta_df = params.drop('const') if 'const' in params else params
-                    colors = ['#00CC96' if x > 0 else '#FF4B4B' for x in beta_df.values]
-                    fig_beta = go.Figure(go.Bar(
-                        x=beta_df.values, y=beta_df.index, orientation='h', 
-                        marker_color=colors, text=[f"{x:.2f}" for x in beta_df.values], textposition='auto'
-                    ))
-                    fig_beta.update_layout(title="Factor Beta Sensitivity", xaxis_title="Sensitivity", height=300)
-                    st.plotly_chart(fig_beta, use_container_width=True)
+                    st.plotly_chart(figs_for_report['factor_beta'], use_container_width=True)
+                    r_sq = summary['r_squared']
                     st.caption(f"R-Squared (R²): {r_sq:.2%} (Model explains {r_sq*100:.0f}% of movement)")
-                    figs_for_report['factor_beta'] = fig_beta
-                
+
                 with c2:
                     st.markdown(f"""
                     <div class="factor-box">
                         <h4 style="color: #FF69B4; margin-bottom:10px;">🧠 AI Style Analysis</h4>
-                        <div style="white-space: pre-wrap;">{factor_comment}</div>
+                        <div style="white-space: pre-wrap;">{payload['factor_comment']}</div>
                     </div>
                     """, unsafe_allow_html=True)
-            
+
             st.markdown("---")
             st.subheader("📈 Rolling Beta Analysis")
-            rolling_betas = analyzer.rolling_beta_analysis(port_ret, data['factors'])
+            rolling_betas = tables['rolling_betas']
             if not rolling_betas.empty:
                 fig_roll = go.Figure()
-                if 'Mkt-RF' in rolling_betas.columns: fig_roll.add_trace(go.Scatter(x=rolling_betas.index, y=rolling_betas['Mkt-RF'], name='Market (Beta)', line=dict(width=3, color=COLORS['main'])))
-                if 'SMB' in rolling_betas.columns: fig_roll.add_trace(go.Scatter(x=rolling_betas.index, y=rolling_betas['SMB'], name='Size (SMB)', line=dict(dash='dot', color='orange')))
-                if 'HML' in rolling_betas.columns: fig_roll.add_trace(go.Scatter(x=rolling_betas.index, y=rolling_betas['HML'], name='Value (HML)', line=dict(dash='dot', color='yellow')))
+                roll_lines = [('Mkt-RF', 'Market (Beta)', dict(width=3, color=COLORS['main'])),
+                              ('SMB', 'Size (SMB)', dict(dash='dot', color='orange')),
+                              ('HML', 'Value (HML)', dict(dash='dot', color='yellow')),
+                              ('RMW', 'Profitability (RMW)', dict(dash='dash', color='violet')),
+                              ('CMA', 'Investment (CMA)', dict(dash='dash', color='lightgreen'))]
+                for col, label, line_style in roll_lines:
+                    if col in rolling_betas.columns:
+                        s_roll = downsample_series(rolling_betas[col])
+                        fig_roll.add_trace(go.Scatter(x=s_roll.index, y=s_roll, name=label, line=line_style))
                 st.plotly_chart(fig_roll, use_container_width=True)
 
+            if not factor_models.empty:
+                st.markdown("---")
+                st.subheader("🌐 Factor Model Comparison")
+                st.caption(f"All models fitted on the same {int(factor_models['n_months'].iloc[0])} months. Alpha is annualized.")
+                beta_cols = [c for c in factor_models.columns if c not in ('n_months', 'r_squared', 'adj_r_squared', 'alpha')]
+                st.dataframe(factor_models.drop(columns='n_months').style
+                             .format({'r_squared': '{:.1%}', 'adj_r_squared': '{:.1%}', 'alpha': '{:.2%}',
+                                      **{c: '{:.2f}' for c in beta_cols}}, na_rep='-')
+                             .highlight_max(subset=['adj_r_squared'], color='#1f6f5c'),
+                             use_container_width=True)
+
     with tab3:
         st.subheader("Historical Stress Test")
-        cum_ret = (1 + port_ret).cumprod() * 10000
-        fig_hist = go.Figure()
-        fig_hist.add_trace(go.Scatter(x=cum_ret.index, y=[10000]*len(cum_ret), mode='lines', name='Principal (10,000)', line=dict(color=COLORS['principal'], width=1, dash='dot')))
-
-        if not bench_ret.empty:
-            bench_cum = (1 + bench_ret).cumprod()
-            common_idx = cum_ret.index.intersection(bench_cum.index)
-            bench_cum = bench_cum.loc[common_idx]
-            bench_cum = bench_cum / bench_cum.iloc[0] * 10000
-            fig_hist.add_trace(go.Scatter(x=bench_cum.index, y=bench_cum, mode='lines', name=f"Benchmark ({data['bench_name']})", line=dict(color=COLORS['benchmark'], width=1.5)))
+        st.plotly_chart(figs_for_report['history'], use_container_width=True)
+        if not tables['benchmark_wealth'].empty:
+            hist_index = tables['wealth'].index
+            st.caption(f"Portfolio and benchmark over their common months ({hist_index[0]:%Y-%m} to {hist_index[-1]:%Y-%m}).")
 
-        fig_hist.add_trace(go.Scatter(x=cum_ret.index, y=cum_ret, fill='tozeroy', fillcolor=COLORS['bg_fill'], mode='lines', name='My Portfolio', line=dict(color=COLORS['main'], width=2.5)))
-        st.plotly_chart(fig_hist, use_container_width=True)
-        figs_for_report['history'] = fig_hist
+        st.markdown("---")
+        st.subheader("🌪️ Crisis Scenario Replay")
+        if not stress_df.empty:
+            st.plotly_chart(figs_for_report['stress'], use_container_width=True)
+
+            asset_cols = [c for c in stress_df.columns if c not in ['Return', 'Max Drawdown', 'Recovery (Months)', 'Coverage', 'Kind']]
+            st.dataframe(stress_df.style.format({c: '{:.2%}' for c in ['Return', 'Max Drawdown'] + asset_cols}
+                                                | {'Recovery (Months)': '{:.0f}', 'Coverage': '{:.0%}'}, na_rep='-'), use_container_width=True)
+            st.caption("Asset columns show each holding's contribution to the scenario return. "
+                       "Proxy scenarios replay index history (local currency) mapped onto JP / other holdings; "
+                       "without that history they fall back to a hypothetical shock, which has no recovery (-).")
+            partial = stress_df.index[stress_df['Coverage'] < 1]
+            if len(partial):
+                # 履歴が危機期間の一部しかカバーしない場合は明示する
+                st.warning("⚠️ Partial replay (history does not cover the full window): "
+                           + ", ".join(f"{n} ({stress_df.loc[n, 'Coverage']:.0%})" for n in partial))
+        else:
+            st.info("No scenario windows overlap the available history.")
 
         st.markdown("---")
         st.subheader("📊 Return Distribution")
         mu, std = port_ret.mean(), port_ret.std()
         fig_dist = go.Figure()
-        fig_dist.add_trace(go.Histogram(x=port_ret, histnorm='probability density', name='Actual', marker_color=COLORS['hist_bar'], opacity=0.8, nbinsx=50))
+        fig_dist.add_trace(histogram_bar(port_ret, bins=50, density=True, name='Actual', marker_color=COLORS['hist_bar'], opacity=0.8))
         x_range = np.linspace(port_ret.min(), port_ret.max(), 100)
         y_norm = (1 / (np.sqrt(2 * np.pi) * std)) * np.exp(-0.5 * ((x_range - mu) / std) ** 2)
         fig_dist.add_trace(go.Scatter(x=x_range, y=y_norm, mode='lines', name='Normal Dist (Theory)', line=dict(color='white', dash='dash', width=2)))
@@ -407,14 +550,15 @@ if st.session_state.portfolio_data:
 
     with tab4:
         st.subheader("Cost Drag Analysis")
-        gross, net, loss, cost_pct = analyzer.cost_drag_simulation(port_ret, data['cost_tier'])
-        loss_amount = 1000000 * loss
+        gross, net = tables['cost_drag']['gross'], tables['cost_drag']['net']
+        loss_amount = 1000000 * summary['cost_loss']
         final_amount_net = 1000000 * net.iloc[-1]
         c1, c2 = st.columns([2, 1])
         with c1:
             fig_cost = go.Figure()
-            fig_cost.add_trace(go.Scatter(x=gross.index, y=gross, name='Gross (Ideal)', line=dict(color='gray', dash='dot')))
-            fig_cost.add_trace(go.Scatter(x=net.index, y=net, name=f'Net (Actual)', fill='tonexty', line=dict(color=COLORS['cost_net'])))
+            gross_plot, net_plot = downsample_series(gross), downsample_series(net)
+            fig_cost.add_trace(go.Scatter(x=gross_plot.index, y=gross_plot, name='Gross (Ideal)', line=dict(color='gray', dash='dot')))
+            fig_cost.add_trace(go.Scatter(x=net_plot.index, y=net_plot, name=f'Net (Actual)', fill='tonexty', line=dict(color=COLORS['cost_net'])))
             st.plotly_chart(fig_cost, use_container_width=True)
         with c2:
             st.error(f"💸 Lost Value: ▲{loss_amount:,.0f} JPY")
@@ -422,19 +566,16 @@ if st.session_state.portfolio_data:
 
     with tab5:
         st.subheader("Strict Attribution Analysis")
-        attrib = analyzer.calculate_strict_attribution(data['components'], data['weights'])
+        attrib = tables['attribution']
         if not attrib.empty:
-            colors = ['#FF4B4B' if x < 0 else '#00CC96' for x in attrib.values]
-            fig_attr = go.Figure(go.Bar(
-                x=attrib.values, y=attrib.index, orientation='h', marker_color=colors,
-                text=[f"{x:.2%}" for x in attrib.values], textposition='auto'
-            ))
-            fig_attr.update_layout(xaxis_title="Contribution", yaxis_title="Asset")
-            st.plotly_chart(fig_attr, use_container_width=True)
-            figs_for_report['attribution'] = fig_attr
+            st.plotly_chart(figs_for_report['attribution'], use_container_width=True)
 
     with tab6:
-        st.subheader("🎲 Monte Carlo Simulation (7,500 runs / Fat-Tail)")
+        vol_model_names = {'constant': 'Constant Vol', 'garch': 'GARCH(1,1)', 'regime': 'Regime Switching'}
+        st.subheader(f"🎲 Monte Carlo Simulation ({n_paths:,} runs / Fat-Tail / {vol_model_names[vol_model]})")
+        if vol_model != requested_vol_model:
+            st.warning(f"⚠️ {vol_model_names[requested_vol_model]} fit did not converge on this history; "
+                       "simulated with constant volatility instead.")
         if df_stats is not None:
             fig_mc = go.Figure()
             fig_mc.add_trace(go.Scatter(x=df_stats.index, y=df_stats['p50'], mode='lines', name='Median', line=dict(color=COLORS['median'], width=3)))
@@ -447,37 +588,163 @@ if st.session_state.portfolio_data:
             mc1, mc2, mc3, mc4 = st.columns(4)
             mc1.metric("P10 (Bear)", f"{final_p10:,.0f}", delta_color="inverse")
             mc2.metric("Median", f"{final_median:,.0f}")
-            mc3.metric("Mean", f"{np.mean(final_values):,.0f}")
+            mc3.metric("Mean", f"{summary['mc_mean']:,.0f}")
             mc4.metric("P90 (Bull)", f"{final_p90:,.0f}")
+            if summary['mc_precision']:
+                st.caption(f"🎯 Estimate precision (±1 std. error): {summary['mc_precision']}")
+            if summary['mc_batches']:
+                status = "converged" if summary['mc_converged'] else "stopped at path limit"
+                st.caption(f"Adaptive run: {summary['mc_batches']} batches, {n_paths:,} paths ({status}).")
 
-            fig_mc_hist = go.Figure()
-            counts, _ = np.histogram(final_values, bins=100)
-            y_max_freq = counts.max()
-            x_max_view = np.percentile(final_values, 98)
+            # 98パーセンタイルまでを計算側で集計済み (ビンの高さだけを受け取る)
+            st.plotly_chart(figs_for_report['mc'], use_container_width=True)
+            st.success(f"✅ Simulation Complete: **{n_paths:,} scenarios** generated.")
 
-            fig_mc_hist.add_trace(go.Histogram(
-                x=final_values, nbinsx=100, name='Freq', 
-                marker_color=COLORS['hist_bar'], opacity=0.85
-            ))
-            lines_config = [
-                (final_p10, COLORS['p10'], "P10", 1.05, "dash", 2),
-                (final_median, COLORS['median'], "Median", 1.15, "solid", 3),
-                (final_p90, COLORS['p90'], "P90", 1.05, "dash", 2),
-            ]
-            for val, color, label, h_rate, dash, width in lines_config:
-                fig_mc_hist.add_vline(x=val, line_width=width, line_dash=dash, line_color=color)
-
-            fig_mc_hist.update_layout(
-                xaxis_title="Final Value (JPY)", yaxis_title="Count", showlegend=False,
-                xaxis=dict(range=[0, x_max_view]), yaxis=dict(range=[0, y_max_freq * 1.4])
-            )
-            st.plotly_chart(fig_mc_hist, use_container_width=True)
-            figs_for_report['mc'] = fig_mc_hist
-            st.success(f"✅ Simulation Complete: **7,500 scenarios** generated.")
+        if 'goal_stats' in tables:
+            st.markdown("---")
+            st.subheader("🎯 Goal-Based Plan (Contributions & Withdrawals)")
+            g1, g2, g3, g4 = st.columns(4)
+            g1.metric("Probability of Ruin", f"{summary['ruin_probability']:.1%}", delta_color="inverse")
+            g2.metric("Goal Probability", f"{summary['goal_probability']:.1%}" if summary['goal_probability'] is not None else "-")
+            g3.metric("Median Time to Goal", summary['median_time_to_goal'] or "-")
+            g4.metric("Safe Withdrawal Rate", summary['swr_text'] or "-")
+
+            c1, c2 = st.columns([2, 1])
+            with c1:
+                gs = tables['goal_stats']
+                fig_goal = go.Figure()
+                fig_goal.add_trace(go.Scatter(x=gs.index, y=gs['p50'], mode='lines', name='Median', line=dict(color=COLORS['median'], width=3)))
+                fig_goal.add_trace(go.Scatter(x=gs.index, y=gs['p10'], mode='lines', name='Bottom 10%', line=dict(color=COLORS['p10'], width=1, dash='dot')))
+                fig_goal.add_trace(go.Scatter(x=gs.index, y=gs['p90'], mode='lines', name='Top 10%', line=dict(color=COLORS['p90'], width=1, dash='dot')))
+                if cash_plan.get('goal_amount'):
+                    fig_goal.add_hline(y=cash_plan['goal_amount'], line_dash='dash', line_color=COLORS['principal'])
+                fig_goal.update_layout(title="Wealth with Cash Flows", yaxis_title="Value (JPY)", height=400)
+                st.plotly_chart(fig_goal, use_container_width=True)
+            with c2:
+                ruin_by_rate = tables['swr_curve']
+                if ruin_by_rate.empty:
+                    st.info("No withdrawals planned: set an annual withdrawal to estimate a safe withdrawal rate.")
+                else:
+                    fig_swr = go.Figure(go.Scatter(x=ruin_by_rate.index, y=ruin_by_rate.values, mode='lines', line=dict(color=COLORS['cost_net'])))
+                    fig_swr.add_hline(y=0.10, line_dash='dot', line_color='white')
+                    fig_swr.update_layout(title="Ruin Probability by Withdrawal Rate", xaxis_tickformat='.1%', yaxis_tickformat='.0%', height=400)
+                    st.plotly_chart(fig_swr, use_container_width=True)
+            if not ruin_by_rate.empty:
+                st.caption(f"Withdrawal rate = annual withdrawal as % of the initial {init_inv:,} JPY, starting after "
+                           f"{cash_plan.get('withdrawal_start_month', 0) // 12} years. All plans share one set of simulated returns.")
 
-    # --- 5. データ保存 ---
-    st.session_state.payload = analysis_payload
-    st.session_state.figs = figs_for_report
+        st.markdown("---")
+        st.subheader("🧩 Factor-Model Simulation")
+        if server_mode:
+            st.info("Interactive simulations run in local mode only (the job server computed the results above).")
+        elif panel.factors is None:
+            st.info("Factor data unavailable for this region.")
+        elif st.checkbox("Run factor-model simulation", value=False,
+                         help="Simulates only the Fama-French factors plus idiosyncratic noise, so large portfolios stay fast."):
+            factor_engine = FactorSimulationEngine().fit(data['components'], factor_df, panel=panel)
+            if factor_engine is None:
+                st.info("Not enough overlapping months to fit factor loadings.")
+            else:
+                fm_stats, fm_finals, fm_contrib = factor_engine.simulate(data['weights'], n_years=sim_years, n_simulations=n_paths,
+                                                                         initial_investment=init_inv, last_date=port_ret.index[-1])
+                # 比較対象は同じ条件の直接シミュレーション (定数ボラ・単位分散t・疑似乱数・同じパス数)
+                if vol_model == 'constant' and sampling == 'pseudo' and not use_cv and not mc_opts.get('adaptive'):
+                    ref_stats = df_stats
+                else:
+                    ref_stats, _ = analyzer.run_monte_carlo_simulation(port_ret, n_years=sim_years, n_simulations=n_paths,
+                                                                       initial_investment=init_inv)
+                ref_p10, ref_p50, ref_p90 = ref_stats[['p10', 'p50', 'p90']].iloc[-1]
+                c1, c2, c3 = st.columns(3)
+                c1.metric("P10 (Factor Model)", f"{fm_stats['p10'].iloc[-1]:,.0f}", f"{fm_stats['p10'].iloc[-1] - ref_p10:+,.0f} vs direct")
+                c2.metric("Median (Factor Model)", f"{fm_stats['p50'].iloc[-1]:,.0f}", f"{fm_stats['p50'].iloc[-1] - ref_p50:+,.0f} vs direct")
+                c3.metric("P90 (Factor Model)", f"{fm_stats['p90'].iloc[-1]:,.0f}", f"{fm_stats['p90'].iloc[-1] - ref_p90:+,.0f} vs direct")
+                st.caption("Deltas are against a direct constant-volatility simulation with the same unit-variance "
+                           "t(6) innovations and path count, so they reflect the factor structure only.")
+
+                decomp = factor_engine.decomposition(data['weights'])
+                c1, c2 = st.columns([1, 1])
+                with c1:
+                    fig_fm = px.bar(decomp.reset_index(), x='index', y='risk_share', color='index',
+                                    title="Risk Share by Source", labels={'index': 'Source', 'risk_share': 'Share of Variance'})
+                    fig_fm.update_layout(showlegend=False, yaxis_tickformat='.0%', height=320, template="plotly_dark")
+                    st.plotly_chart(fig_fm, use_container_width=True)
+                with c2:
+                    st.dataframe(decomp.style.format({'exposure': '{:.2f}', 'ann_return': '{:.2%}', 'risk_share': '{:.1%}'}, na_rep='-'),
+                                 use_container_width=True)
+                    spread = np.percentile(fm_contrib, [10, 90], axis=0)
+                    st.caption(" | ".join(f"{name}: P10 {lo:+.0%} / P90 {hi:+.0%}"
+                                          for name, lo, hi in zip(factor_engine.factor_names, spread[0], spread[1]))
+                               + f" (cumulative log contribution over {sim_years}Y)")
+                with st.expander("📋 Per-asset loadings"):
+                    st.dataframe(factor_engine.asset_table().style.format('{:.2f}'), use_container_width=True)
+
+        st.markdown("---")
+        st.subheader("🔀 What-If Sweep (Horizon × Cost × Weights)")
+        if not server_mode and st.checkbox("Run what-if sweep", value=False, help="All cells share one set of random draws, so differences are noise-free."):
+            c1, c2 = st.columns(2)
+            sweep_ticker = c1.selectbox("Shift weight into / out of", list(data['weights'].keys()))
+            sweep_delta = c2.slider("Weight shift (%)", 5, 30, 10, 5) / 100
+            tweaks = {
+                'Current': data['weights'],
+                f"{sweep_ticker} +{sweep_delta:.0%}": ParameterSweepEngine.tweak_weights(data['weights'], sweep_ticker, sweep_delta),
+                f"{sweep_ticker} -{sweep_delta:.0%}": ParameterSweepEngine.tweak_weights(data['weights'], sweep_ticker, -sweep_delta),
+            }
+            sweep_df = ParameterSweepEngine.run_sweep(data['components'], data['weights'], horizons=(10, 15, 20),
+                                                      weight_tweaks=tweaks, initial_investment=init_inv,
+                                                      volatility_model=vol_model, sampling=sampling)
+            if not sweep_df.empty:
+                view_tweak = st.radio("Portfolio", list(tweaks.keys()), horizontal=True)
+                sweep_metric = st.radio("Outcome", ['p10', 'p50', 'p90'], index=1, horizontal=True)
+                heat = sweep_df[sweep_df['tweak'] == view_tweak].pivot(index='cost_tier', columns='horizon_years', values=sweep_metric)
+                heat = heat.reindex(['Low', 'Medium', 'High'])
+                fig_sweep = px.imshow(heat, text_auto=',.0f', aspect='auto', color_continuous_scale='Viridis',
+                                      labels=dict(x="Horizon (Years)", y="Cost Tier", color="JPY"))
+                st.plotly_chart(fig_sweep, use_container_width=True)
+                with st.expander("📋 Full sweep table"):
+                    st.dataframe(sweep_df.style.format({'p10': '{:,.0f}', 'p50': '{:,.0f}', 'p90': '{:,.0f}',
+                                                        'hist_net_growth': '{:.2f}x', 'hist_cost_drag': '{:.2f}'}),
+                                 use_container_width=True)
+
+        st.markdown("---")
+        st.subheader("🧪 Walk-Forward Calibration (Backtest)")
+        if not server_mode and st.checkbox("Run calibration backtest", value=False,
+                       help="Refits the constant-volatility model on trailing data at every month and checks where the realized outcome fell."):
+            c1, c2 = st.columns(2)
+            wf_horizon = c1.select_slider("Forecast Horizon (Months)", options=[1, 3, 6, 12, 24, 36], value=12)
+            wf_window = c2.select_slider("Fitting Window (Months)", options=[36, 60, 120], value=60)
+            wf = analyzer.walk_forward_calibration(port_ret, horizon=wf_horizon, window=wf_window)
+            if wf is None:
+                st.info("Not enough history for this horizon / window.")
+            else:
+                cov = wf['coverage']
+                c1, c2 = st.columns([1, 1])
+                with c1:
+                    st.dataframe(cov.style.format({'nominal': '{:.0%}', 'observed': '{:.1%}', 'below': '{:.1%}', 'above': '{:.1%}'}),
+                                 use_container_width=True)
+                    st.caption(f"{cov.attrs['n_origins']} origins | KS vs Uniform: {wf['ks_stat']:.3f} "
+                               f"(p={wf['ks_pvalue']:.2f}, optimistic for overlapping horizons)")
+                with c2:
+                    fig_pit = go.Figure(histogram_bar(wf['pit'], bins=10, value_range=(0, 1), density=True,
+                                                      marker_color=COLORS['hist_bar'], name='PIT'))
+                    fig_pit.add_hline(y=1.0, line_dash="dash", line_color=COLORS['principal'], annotation_text="Ideal")
+                    fig_pit.update_layout(title="PIT Histogram (flat = calibrated)", height=300, template="plotly_dark",
+                                          xaxis_title="PIT", yaxis_title="Density", margin=dict(t=40, b=30))
+                    st.plotly_chart(fig_pit, use_container_width=True)
+
+                wf_df = wf['origins']
+                fig_wf = go.Figure()
+                fig_wf.add_trace(go.Scatter(x=wf_df.index, y=wf_df['p90'], mode='lines', line=dict(width=0), showlegend=False))
+                fig_wf.add_trace(go.Scatter(x=wf_df.index, y=wf_df['p10'], mode='lines', fill='tonexty', fillcolor=COLORS['bg_fill'],
+                                            line=dict(width=0), name='Forecast P10-P90'))
+                fig_wf.add_trace(go.Scatter(x=wf_df.index, y=wf_df['p50'], mode='lines', name='Forecast Median', line=dict(color=COLORS['median'], dash='dot')))
+                fig_wf.add_trace(go.Scatter(x=wf_df.index, y=wf_df['realized'], mode='lines', name='Realized', line=dict(color=COLORS['main'])))
+                fig_wf.update_layout(title=f"{wf_horizon}-Month Growth: Forecast Band vs Realized (by Forecast Date)",
+                                     height=380, template="plotly_dark", yaxis_title="Growth Multiple")
+                st.plotly_chart(fig_wf, use_container_width=True)
+
+    # --- 3. データ保存 (計算結果は上で保存済み、図はPDF用。スナップショットは保存時の図をそのまま使う) ---
+    if not (st.session_state.from_snapshot and st.session_state.figs):
+        st.session_state.figs = figs_for_report
     st.session_state.analysis_done = True
 
 
@@ -505,7 +772,11 @@ if st.session_state.analysis_done:
                     if 'advisor_note' in locals() or 'advisor_note' in globals():
                         final_payload['advisor_note'] = advisor_note
                     
-                    if final_payload and st.session_state.figs:
+                    server_job = st.session_state.server_job
+                    if server_job and server_job['advisor_note'] == final_payload.get('advisor_note', server_job['advisor_note']):
+                        # ワーカーが図の描画 (kaleido) まで済ませた PDF を取得する
+                        pdf_data = AnalysisClient(os.environ["ANALYSIS_SERVER_URL"]).pdf(server_job['id'])
+                    elif final_payload and st.session_state.figs:
                         # pdf_generator.py の関数を呼び出し
                         pdf_data = create_pdf_report(final_payload, st.session_state.figs)
                         
@@ -531,5 +802,25 @@ if st.session_state.analysis_done:
                 type="primary"
             )
 
+    # 💾 スナップショット保存 (Parquet + JSON、クライアント別インデックスに登録)
+    st.markdown("---")
+    st.subheader("💾 Save Snapshot")
+    c1, c2, c3 = st.columns([1, 1, 1])
+    snap_client_name = c1.text_input("Client Name", value="default")
+    snap_label = c2.text_input("Label", value=", ".join(list(st.session_state.portfolio_data['weights'])[:4]))
+    with c3:
+        st.write("")
+        if st.button("💾 Save Snapshot", use_container_width=True):
+            try:
+                snap_meta = SNAPSHOTS.save(st.session_state.portfolio_data, st.session_state.payload, st.session_state.figs,
+                                           st.session_state.tables, client=snap_client_name, label=snap_label)
+                st.session_state.last_snapshot = snap_meta['snapshot_id']
+                st.success(f"✅ Saved ({snap_meta['snapshot_id']})")
+            except Exception as e:
+                st.error(f"Snapshot Error: {e}")
+        if st.session_state.get('last_snapshot'):
+            st.download_button("⬇️ Download Snapshot", data=SNAPSHOTS.read_bytes(st.session_state.last_snapshot),
+                               file_name=f"{st.session_state.last_snapshot}.fsnap.zip", mime="application/zip")
+
 else:
     st.info("ℹ️ To generate a PDF report, please run the simulation first.")
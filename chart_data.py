@@ -0,0 +1,192 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.express as px
+
+# =========================================================
+# 📉 Chart Payload Preparation (server-side binning & decimation)
+# =========================================================
+
+MAX_LINE_POINTS = 600
+
+# 🎨 Shared palette (dashboard and report figures)
+COLORS = {
+    'main': '#00FFFF',      # Neon Cyan
+    'benchmark': '#FF69B4', # Hot Pink
+    'principal': '#FFFFFF', # White
+    'median': '#32CD32',    # Lime Green
+    'mean': '#FFD700',      # Gold
+    'p10': '#FF6347',       # Pessimistic
+    'p90': '#00BFFF',       # Optimistic
+    'hist_bar': '#42A5F5',  # Mid Blue
+    'cost_net': '#FF6347',  # Tomato Red
+    'bg_fill': 'rgba(0, 255, 255, 0.1)'
+}
+
+
+def bin_histogram(values, bins=50, value_range=None, density=False):
+    """Pre-bin values; returns (bin centers, heights, bin widths)."""
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    counts, edges = np.histogram(values, bins=bins, range=value_range, density=density)
+    return (edges[:-1] + edges[1:]) / 2, counts, np.diff(edges)
+
+
+def histogram_bar(values, bins=50, value_range=None, density=False, **bar_kwargs):
+    """go.Bar equivalent of go.Histogram that ships only the bin heights."""
+    centers, heights, widths = bin_histogram(values, bins=bins, value_range=value_range, density=density)
+    return go.Bar(x=centers, y=heights, width=widths, **bar_kwargs)
+
+
+def _numeric_axis(index):
+    if isinstance(index, pd.DatetimeIndex):
+        return index.to_numpy(dtype='datetime64[ns]').astype(np.int64).astype(float)
+    try:
+        return np.asarray(index, dtype=float)
+    except (TypeError, ValueError):
+        return np.arange(len(index), dtype=float)
+
+
+def lttb_indices(x, y, n_out):
+    """Largest-Triangle-Three-Buckets: positions of the n_out most shape-preserving points."""
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    edges = np.append(edges, n)
+    idx = np.empty(n_out, dtype=int)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nlo, nhi = edges[i + 1], edges[i + 2]
+        avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        idx[i + 1] = a
+    return idx
+
+
+def minmax_indices(y, n_out):
+    """Min/max decimation: keep the extremes of n_out/2 equal buckets (plus the endpoints)."""
+    n = len(y)
+    if n_out >= n or n_out < 4:
+        return np.arange(n)
+    keep = [0, n - 1]
+    for bucket in np.array_split(np.arange(n), n_out // 2):
+        seg = y[bucket]
+        keep.extend([bucket[np.nanargmin(seg)], bucket[np.nanargmax(seg)]])
+    return np.unique(keep)
+
+
+def downsample_series(series, max_points=MAX_LINE_POINTS, method='lttb'):
+    """Decimate a line series for plotting; short series are returned unchanged."""
+    series = series.dropna()
+    if len(series) <= max_points:
+        return series
+    y = series.to_numpy(dtype=float)
+    if method == 'minmax':
+        idx = minmax_indices(y, max_points)
+    else:
+        idx = lttb_indices(_numeric_axis(series.index), y, max_points)
+    return series.iloc[idx]
+
+
+# =========================================================
+# 🖼️ Report Figures (built from analysis tables)
+# =========================================================
+# The dashboard shows these and create_pdf_report renders them, so a job
+# worker can produce the same charts without the app.
+
+def correlation_figure(corr_matrix):
+    if corr_matrix.empty:
+        return None
+    return px.imshow(corr_matrix, text_auto='.2f' if len(corr_matrix) <= 30 else False, aspect="auto",
+                     color_continuous_scale='RdBu_r', zmin=-1, zmax=1)
+
+
+def allocation_figure(weights):
+    return px.pie(values=list(weights.values()), names=list(weights.keys()), hole=0.4,
+                  color_discrete_sequence=px.colors.sequential.RdBu)
+
+
+def factor_beta_figure(params):
+    beta_df = params.drop('const') if 'const' in params else params
+    colors = ['#00CC96' if x > 0 else '#FF4B4B' for x in beta_df.values]
+    fig = go.Figure(go.Bar(
+        x=beta_df.values, y=beta_df.index, orientation='h',
+        marker_color=colors, text=[f"{x:.2f}" for x in beta_df.values], textposition='auto'
+    ))
+    fig.update_layout(title="Factor Beta Sensitivity", xaxis_title="Sensitivity", height=300)
+    return fig
+
+
+def history_figure(wealth, bench_wealth=None, bench_name="Benchmark"):
+    """Growth of 10,000 for the portfolio (and benchmark), with the principal line."""
+    cum_ret = wealth * 10000
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=[cum_ret.index[0], cum_ret.index[-1]], y=[10000, 10000], mode='lines', name='Principal (10,000)',
+                             line=dict(color=COLORS['principal'], width=1, dash='dot')))
+    if bench_wealth is not None and not bench_wealth.empty:
+        bench_cum = downsample_series(bench_wealth * 10000)
+        fig.add_trace(go.Scatter(x=bench_cum.index, y=bench_cum, mode='lines', name=f"Benchmark ({bench_name})",
+                                 line=dict(color=COLORS['benchmark'], width=1.5)))
+    cum_ret_plot = downsample_series(cum_ret)
+    fig.add_trace(go.Scatter(x=cum_ret_plot.index, y=cum_ret_plot, fill='tozeroy', fillcolor=COLORS['bg_fill'], mode='lines',
+                             name='My Portfolio', line=dict(color=COLORS['main'], width=2.5)))
+    return fig
+
+
+def stress_figure(stress_df):
+    """Scenario return and max drawdown bars; partial-coverage scenarios are marked with *, shocks as hypothetical."""
+    kinds = stress_df['Kind'] if 'Kind' in stress_df else pd.Series('Historical', index=stress_df.index)
+    labels = [f"{n} (hypothetical)" if k == 'Hypothetical' else f"{n} *" if c < 1 else n
+              for n, c, k in zip(stress_df.index, stress_df['Coverage'], kinds)]
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=labels, y=stress_df['Return'], name='Scenario Return', marker_color=COLORS['main']))
+    fig.add_trace(go.Bar(x=labels, y=stress_df['Max Drawdown'], name='Max Drawdown', marker_color=COLORS['p10']))
+    fig.update_layout(barmode='group', yaxis_tickformat='.0%', height=400)
+    return fig
+
+
+def attribution_figure(attrib):
+    colors = ['#FF4B4B' if x < 0 else '#00CC96' for x in attrib.values]
+    fig = go.Figure(go.Bar(
+        x=attrib.values, y=attrib.index, orientation='h', marker_color=colors,
+        text=[f"{x:.2%}" for x in attrib.values], textposition='auto'
+    ))
+    fig.update_layout(xaxis_title="Contribution", yaxis_title="Asset")
+    return fig
+
+
+def outcome_histogram_figure(mc_hist, p10, p50, p90):
+    """Final-value histogram from pre-binned counts (x, count, width) with P10/median/P90 markers."""
+    bin_x, counts, bin_w = mc_hist['x'], mc_hist['count'], mc_hist['width']
+    fig = go.Figure(go.Bar(x=bin_x, y=counts, width=bin_w, name='Freq', marker_color=COLORS['hist_bar'], opacity=0.85))
+    for val, color, dash, width in ((p10, COLORS['p10'], "dash", 2), (p50, COLORS['median'], "solid", 3),
+                                    (p90, COLORS['p90'], "dash", 2)):
+        fig.add_vline(x=val, line_width=width, line_dash=dash, line_color=color)
+    fig.update_layout(
+        xaxis_title="Final Value (JPY)", yaxis_title="Count", showlegend=False,
+        xaxis=dict(range=[0, float(bin_x.iloc[-1] + bin_w.iloc[-1] / 2)]), yaxis=dict(range=[0, counts.max() * 1.4])
+    )
+    return fig
+
+
+def report_figures(tables, weights, bench_name="Benchmark"):
+    """Every figure the PDF report uses, keyed as create_pdf_report expects."""
+    figs = {'pie': allocation_figure(weights)}
+    corr = correlation_figure(tables['correlation'])
+    if corr is not None:
+        figs['correlation'] = corr
+    if len(tables['factor_params']):
+        figs['factor_beta'] = factor_beta_figure(tables['factor_params'])
+    figs['history'] = history_figure(tables['wealth'], tables['benchmark_wealth'], bench_name)
+    if not tables['stress_test'].empty:
+        figs['stress'] = stress_figure(tables['stress_test'])
+    if not tables['attribution'].empty:
+        figs['attribution'] = attribution_figure(tables['attribution'])
+    p10, p50, p90 = tables['mc_stats'][['p10', 'p50', 'p90']].iloc[-1]
+    figs['mc'] = outcome_histogram_figure(tables['mc_hist'], p10, p50, p90)
+    return figs
@@ -0,0 +1,203 @@
+import os
+import sys
+import time
+import threading
+import functools
+from contextlib import contextmanager
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, writers fall back to last-replace-wins
+    fcntl = None
+
+# =========================================================
+# 🧠 Shared Data Cache (bounded, memory-accounted)
+# =========================================================
+
+DEFAULT_MAX_BYTES = int(os.environ.get("FACTOR_SIM_CACHE_MAX_MB", "512")) * 1024 * 1024
+DEFAULT_MAX_ENTRIES = int(os.environ.get("FACTOR_SIM_CACHE_MAX_ENTRIES", "256"))
+
+
+def estimate_nbytes(value):
+    """Approximate in-memory size of a cached value in bytes."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(deep=True, index=True)
+        return int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+    if isinstance(value, pd.Index):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(estimate_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_nbytes(k) + estimate_nbytes(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+def _freeze(value):
+    """Turn call arguments into a hashable cache key."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, set):
+        return tuple(sorted(_freeze(v) for v in value))
+    return value
+
+
+class BoundedCache:
+    """Thread-safe LRU + TTL cache with a byte budget, shared by all sessions in the process."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (value, nbytes, expires_at)
+        self._inflight = {}
+        self._lock = threading.RLock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _drop(self, key):
+        _, nbytes, _ = self._entries.pop(key)
+        self.current_bytes -= nbytes
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[2] < time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        nbytes = estimate_nbytes(value)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if nbytes > self.max_bytes:
+                return False
+            self._entries[key] = (value, nbytes, time.monotonic() + ttl)
+            self.current_bytes += nbytes
+            self._evict()
+            return True
+
+    def _evict(self):
+        # Expired entries go first, then least-recently-used until within budget
+        now = time.monotonic()
+        for key in [k for k, (_, _, exp) in self._entries.items() if exp < now]:
+            self._drop(key)
+            self.expirations += 1
+        while self._entries and (self.current_bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, namespace=None):
+        """Drop every entry, or only those of one memoized function."""
+        with self._lock:
+            keys = [k for k in self._entries if namespace is None or k[0] == namespace]
+            for key in keys:
+                self._drop(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def memoize(self, ttl):
+        """Decorator for engine methods; the first argument (`self`/`_self`) is not hashed.
+
+        None and empty pandas results (the fetchers' error path) are not cached, and
+        concurrent misses on the same key wait for a single computation.
+        Cached objects are shared between sessions and must be treated as read-only.
+        """
+        def decorator(func):
+            namespace = func.__qualname__
+
+            @functools.wraps(func)
+            def wrapper(owner, *args, **kwargs):
+                key = (namespace, _freeze(args), _freeze(kwargs))
+                value = self.get(key, _MISSING)
+                if value is not _MISSING:
+                    return value
+
+                with self._lock:
+                    gate = self._inflight.setdefault(key, threading.Lock())
+                with gate:
+                    with self._lock:
+                        entry = self._entries.get(key)
+                    if entry is not None and entry[2] >= time.monotonic():
+                        return entry[0]
+                    try:
+                        value = func(owner, *args, **kwargs)
+                        if value is not None and not (isinstance(value, (pd.DataFrame, pd.Series)) and value.empty):
+                            self.set(key, value, ttl)
+                        return value
+                    finally:
+                        with self._lock:
+                            self._inflight.pop(key, None)
+
+            def refresh(owner, *args, **kwargs):
+                """Recompute and replace the cached value in place (for background warmers)."""
+                key = (namespace, _freeze(args), _freeze(kwargs))
+                value = func(owner, *args, **kwargs)
+                if value is not None and not (isinstance(value, (pd.DataFrame, pd.Series)) and value.empty):
+                    self.set(key, value, ttl)
+                return value
+
+            wrapper.cache = self
+            wrapper.namespace = namespace
+            wrapper.refresh = refresh
+            return wrapper
+        return decorator
+
+
+_MISSING = object()
+
+# Process-wide instance: every Streamlit session and the engine share this budget
+SHARED_CACHE = BoundedCache()
+
+
+# =========================================================
+# 🔒 Cross-process file lock (JSON indexes on disk)
+# =========================================================
+
+@contextmanager
+def file_lock(path):
+    """Exclusive advisory lock on `<path>.lock` for a read-merge-write of `path`.
+
+    Serializes writers across processes (Streamlit, job workers) as well as
+    threads, since each call opens its own lock file descriptor.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(f"{path}.lock", "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
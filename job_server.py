@@ -0,0 +1,543 @@
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import argparse
+import threading
+import multiprocessing
+import urllib.error
+import urllib.request
+from io import StringIO
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+# =========================================================
+# 🛰️ Analysis Job Server (queue + process pool, stdlib HTTP)
+# =========================================================
+#   POST /jobs               -> 202 {"job_id", "status_url"}   (503 when the queue is full)
+#   GET  /jobs/<id>          -> status, progress (0-1), stage, error
+#   GET  /jobs/<id>/result   -> payload + result tables + portfolio data (409 until done)
+#   GET  /jobs/<id>/pdf      -> application/pdf (charts rendered in the worker)
+#   GET  /health             -> queue depth and worker count
+#
+# Job spec: {"weights": {"SPY": 40, ...}, "bench_ticker": "^GSPC", "region": "US",
+#            "auto_factor_model": true, "advisor_note": "...",
+#            "settings": {"cost_tier", "vol_model", "n_sims", "cash_plan", "mc_options", "bench_name"}}
+
+DEFAULT_HOST = os.environ.get("ANALYSIS_SERVER_HOST", "127.0.0.1")
+DEFAULT_PORT = int(os.environ.get("ANALYSIS_SERVER_PORT", "8765"))
+SIM_YEARS = 20
+INITIAL_INVESTMENT = 1000000
+
+
+# --- Wire format: pandas objects as orient='split' JSON ---
+
+def encode_data(value):
+    """JSON-safe copy of portfolio data (DataFrames/Series tagged for decode_data)."""
+    if isinstance(value, pd.DataFrame):
+        return {'__frame__': value.to_json(orient='split', date_format='iso', double_precision=15)}
+    if isinstance(value, pd.Series):
+        return {'__series__': value.to_json(orient='split', date_format='iso', double_precision=15)}
+    if isinstance(value, dict):
+        return {str(k): encode_data(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_data(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def decode_data(value):
+    if isinstance(value, dict):
+        if '__frame__' in value:
+            return pd.read_json(StringIO(value['__frame__']), orient='split')
+        if '__series__' in value:
+            return pd.read_json(StringIO(value['__series__']), orient='split', typ='series')
+        return {k: decode_data(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [decode_data(v) for v in value]
+    return value
+
+
+# --- Pipeline (runs inside worker processes) ---
+
+def compute_analysis(data, report=lambda fraction, stage: None):
+    """Every non-interactive dashboard calculation for one portfolio.
+
+    Returns (payload, tables): payload is the PDF payload plus a JSON-safe
+    'summary' of headline numbers; tables holds the DataFrames/Series the
+    dashboard draws from (MC percentiles and histogram, goal plan, SWR curve,
+    stress replay, correlation, factor fits, wealth, cost drag, attribution).
+    The app renders these as-is, whether they were computed in-process, by a
+    job worker or loaded from a snapshot.
+    """
+    from simulation_engine import PortfolioAnalyzer, PortfolioDiagnosticEngine, StressScenarioEngine
+    from chart_data import bin_histogram
+
+    analyzer = PortfolioAnalyzer()
+    port_ret = data['returns']
+    report(0.35, "Computing risk metrics")
+    risk = analyzer.calculate_risk_metrics(port_ret, risk_free=0.02)
+
+    # Factor model comparison on one common sample; the best adjusted R² wins
+    factor_sets = data.get('factor_sets') or {}
+    factor_models = analyzer.compare_factor_models(port_ret, factor_sets)
+    factor_model_label = data.get('factor_model', "Selected Region 3F")
+    factor_df = data['factors']
+    if not factor_models.empty:
+        factor_model_label = factor_models.attrs['best']
+        factor_df = factor_sets[factor_model_label]
+
+    panel = analyzer.build_panel(port_ret, data['components'], data['benchmark'], factor_df)
+    info_ratio, track_err = analyzer.calculate_information_ratio(port_ret, data['benchmark'], panel=panel)
+    params, r_sq = analyzer.perform_factor_regression(port_ret, factor_df, panel=panel)
+    factor_comment = PortfolioDiagnosticEngine.generate_factor_report(params) if params is not None else "No factor data available."
+    rolling_betas = analyzer.rolling_beta_analysis(port_ret, factor_df, panel=panel)
+
+    report(0.5, "Running Monte Carlo")
+    n_paths = data.get('n_sims', 7500)
+    requested_vol_model = data.get('vol_model', 'constant')
+    mc_opts = data.get('mc_options', {})
+    sampling = mc_opts.get('sampling', 'pseudo')
+    use_cv = mc_opts.get('control_variate', False)
+    if mc_opts.get('adaptive'):
+        df_stats, final_values, mc_conv = analyzer.run_adaptive_monte_carlo(
+            port_ret, n_years=SIM_YEARS, initial_investment=INITIAL_INVESTMENT, volatility_model=requested_vol_model,
+            sampling=sampling, control_variate=use_cv, target_rel_error=mc_opts.get('target_rel_error', 0.005),
+            max_simulations=n_paths)
+        n_paths = len(final_values)
+    else:
+        df_stats, final_values = analyzer.run_monte_carlo_simulation(
+            port_ret, n_years=SIM_YEARS, n_simulations=n_paths, initial_investment=INITIAL_INVESTMENT,
+            volatility_model=requested_vol_model, sampling=sampling, control_variate=use_cv)
+        # Errors of the estimator actually shown (control-variate weighted when enabled)
+        mc_conv = pd.DataFrame.from_dict(df_stats.attrs['percentile_errors'], orient='index')
+    vol_model = df_stats.attrs.get('volatility_model', requested_vol_model)  # after a failed GARCH/regime fit
+    mc_precision = " | ".join(f"{k.upper()} ±{row['std_error']:,.0f} ({row['rel_error']:.2%})" for k, row in mc_conv.iterrows())
+    # Final percentiles come from df_stats (control-variate weighted when enabled)
+    final_p10, final_median, final_p90 = df_stats[['p10', 'p50', 'p90']].iloc[-1]
+    bin_x, counts, bin_w = bin_histogram(final_values, bins=100, value_range=(0, np.percentile(final_values, 98)))
+
+    report(0.7, "Planning cash flows")
+    # One set of growth draws shared by the goal plan and the SWR search
+    cash_plan = data.get('cash_plan', {})
+    growth = analyzer.simulate_growth_factors(port_ret, SIM_YEARS * 12, n_paths, volatility_model=vol_model, sampling=sampling)
+    cash_flows = analyzer.build_cash_flows(SIM_YEARS * 12, cash_plan.get('monthly_contribution', 0.0),
+                                           cash_plan.get('contribution_months'), cash_plan.get('annual_withdrawal', 0.0),
+                                           cash_plan.get('withdrawal_start_month', 0))
+    goal_res = analyzer.run_goal_simulation(port_ret, cash_flows, n_years=SIM_YEARS, initial_investment=INITIAL_INVESTMENT,
+                                            goal_amount=cash_plan.get('goal_amount') or None, growth=growth)
+    # The SWR search only matters for plans that withdraw
+    swr_res = None
+    if cash_plan.get('annual_withdrawal', 0.0) > 0:
+        swr_res = analyzer.find_safe_withdrawal_rate(port_ret, n_years=SIM_YEARS, initial_investment=INITIAL_INVESTMENT,
+                                                     withdrawal_start_month=cash_plan.get('withdrawal_start_month', 0),
+                                                     monthly_contribution=cash_plan.get('monthly_contribution', 0.0),
+                                                     contribution_months=cash_plan.get('contribution_months'),
+                                                     growth=growth)
+    del growth
+    goal_summary = {
+        'Probability of Ruin': f"{goal_res['ruin_probability']:.1%}",
+        'Median Final Value (with Cash Flows)': f"{goal_res['df_stats']['p50'].iloc[-1]:,.0f} JPY",
+    }
+    swr_text = None
+    if swr_res is not None:
+        swr_text = f"{'≥ ' if swr_res['capped'] else ''}{swr_res['rate']:.2%}"
+        goal_summary['Safe Withdrawal Rate (Ruin <= 10%)'] = f"{swr_text} ({swr_res['annual_amount']:,.0f} JPY/yr)"
+    median_goal = np.nan
+    if 'goal_probability' in goal_res:
+        goal_summary['Goal Probability'] = f"{goal_res['goal_probability']:.1%}"
+        median_goal = goal_res['time_to_goal_percentiles'][1]
+        goal_summary['Median Time to Goal'] = f"{median_goal / 12:.1f} years" if not np.isnan(median_goal) else "Not reached"
+
+    report(0.8, "Replaying stress scenarios")
+    stress_engine = StressScenarioEngine(proxy_returns=data.get('stress_proxies'))
+    stress_df = stress_engine.to_frame(stress_engine.replay(data['components'], data['weights']))
+    stress_summary = StressScenarioEngine.summarize(stress_df)
+
+    # The heatmap covers the largest holdings only; an N x N table is neither drawable nor worth shipping
+    heatmap_assets = analyzer.largest_holdings(data['weights'], analyzer.HEATMAP_ASSETS)
+    corr_matrix = analyzer.calculate_correlation_matrix(data['components'], columns=heatmap_assets)
+    pca_ratio, _ = analyzer.perform_pca(data['components'])
+    diagnosis = PortfolioDiagnosticEngine.generate_report(data['weights'], pca_ratio, port_ret)
+    gross, net, cost_loss, cost_pct = analyzer.cost_drag_simulation(port_ret, data.get('cost_tier', 'Medium'))
+    attribution = analyzer.calculate_strict_attribution(data['components'], data['weights'])
+    # History lines share one sample: the portfolio/benchmark months (the analysis panel is also trimmed to factors)
+    wealth, bench_wealth = risk['wealth'], pd.Series(dtype=float)
+    hist_panel = analyzer.build_panel(port_ret, benchmark=data['benchmark'])
+    if hist_panel.bench is not None and not hist_panel.empty:
+        wealth = pd.Series(np.cumprod(1 + hist_panel.port), index=hist_panel.index)
+        bench_wealth = pd.Series(np.cumprod(1 + hist_panel.bench), index=hist_panel.index)
+
+    payload = {
+        'metrics': {
+            'CAGR': f"{risk['cagr']:.2%}",
+            'Volatility': f"{risk['volatility']:.2%}",
+            'Max Drawdown': f"{risk['max_drawdown']:.2%}",
+            'Sharpe Ratio': f"{risk['sharpe']:.2f}",
+            'Sortino Ratio': f"{risk['sortino']:.2f}",
+            'Calmar Ratio': f"{risk['calmar']:.2f}",
+            'VaR 95% (Monthly)': f"{risk['var']:.2%}",
+            'CVaR 95% (Monthly)': f"{risk['cvar']:.2%}",
+            'Max DD Duration': f"{int(risk['max_dd_duration'])} months",
+            'Information Ratio': f"{info_ratio:.2f}" if not np.isnan(info_ratio) else "N/A",
+            'Factor Model': factor_model_label,
+        },
+        'factor_comment': factor_comment,
+        'ai_diagnosis': {
+            'status': diagnosis['diversification_comment'],
+            'risk': diagnosis['risk_comment'],
+            'action': diagnosis['action_plan'],
+        },
+        'detailed_review': PortfolioDiagnosticEngine.generate_detailed_review(risk['sharpe'], risk['volatility'], risk['max_drawdown']),
+        'stress_test': stress_summary,
+        'goal_plan': goal_summary,
+        'mc_stats': f"Median Outlook: {final_median:,.0f} JPY | "
+                    f"Pessimistic (10%): {final_p10:,.0f} JPY | "
+                    f"Optimistic (90%): {final_p90:,.0f} JPY\n"
+                    f"Precision (1 s.e.): {mc_precision}",
+        'summary': {
+            'cagr': risk['cagr'], 'volatility': risk['volatility'], 'max_drawdown': risk['max_drawdown'],
+            'sharpe': risk['sharpe'], 'sortino': risk['sortino'], 'calmar': risk['calmar'], 'omega': risk['omega'],
+            'var': risk['var'], 'cvar': risk['cvar'], 'max_dd_duration': int(risk['max_dd_duration']),
+            'information_ratio': info_ratio, 'tracking_error': track_err,
+            'factor_model': factor_model_label, 'factor_model_auto': not factor_models.empty,
+            'r_squared': r_sq, 'pca_ratio': pca_ratio, 'portfolio_type': diagnosis['type'],
+            'n_paths': int(n_paths), 'vol_model': vol_model, 'vol_model_requested': requested_vol_model,
+            'mc_mean': float(np.mean(final_values)), 'mc_precision': mc_precision,
+            'mc_batches': mc_conv.attrs.get('n_batches'), 'mc_converged': mc_conv.attrs.get('converged'),
+            'ruin_probability': goal_res['ruin_probability'], 'goal_probability': goal_res.get('goal_probability'),
+            'median_time_to_goal': goal_summary.get('Median Time to Goal'),
+            'swr_rate': swr_res['rate'] if swr_res else None, 'swr_capped': bool(swr_res and swr_res['capped']), 'swr_text': swr_text,
+            'cost_loss': cost_loss, 'cost_pct': cost_pct,
+        },
+    }
+    tables = {
+        'mc_stats': df_stats,
+        'mc_hist': pd.DataFrame({'x': bin_x, 'count': counts, 'width': bin_w}),
+        'goal_stats': goal_res['df_stats'],
+        'swr_curve': swr_res['ruin_by_rate'] if swr_res is not None else pd.Series(dtype=float),
+        'stress_test': stress_df,
+        'correlation': corr_matrix,
+        'factor_models': factor_models,
+        'factor_params': params if params is not None else pd.Series(dtype=float),
+        'rolling_betas': rolling_betas,
+        'wealth': wealth,
+        'benchmark_wealth': bench_wealth,
+        'cost_drag': pd.DataFrame({'gross': gross, 'net': net}),
+        'attribution': attribution,
+    }
+    return payload, tables
+
+
+def run_analysis(spec, report=lambda fraction, stage: None):
+    """Fetch -> analytics -> PDF for one job spec; returns (result dict, pdf bytes)."""
+    from simulation_engine import MarketDataEngine
+    from pdf_generator import create_pdf_report
+    from chart_data import report_figures
+    from prefetch import USAGE_STATS
+
+    report(0.05, "Fetching market data")
+    engine = MarketDataEngine()
+    inputs, error = engine.load_portfolio_inputs(spec['weights'], spec.get('bench_ticker', '^GSPC'),
+                                                 spec.get('region', 'US'), spec.get('auto_factor_model', True))
+    if inputs is None:
+        raise ValueError(error)
+    USAGE_STATS.record(list(inputs['asset_info'].keys()), spec.get('bench_ticker', '^GSPC'))
+
+    data = {**inputs, **spec.get('settings', {})}
+    payload, tables = compute_analysis(data, report)
+    if spec.get('advisor_note'):
+        payload['advisor_note'] = spec['advisor_note']
+
+    report(0.9, "Rendering PDF")
+    # Figures are rendered here (kaleido) from the same builders the dashboard uses
+    figs = report_figures(tables, data['weights'], data.get('bench_name', spec.get('bench_ticker', '^GSPC')))
+    pdf_bytes = create_pdf_report(payload, figs)
+    return {'payload': payload, 'tables': encode_data(tables), 'portfolio_data': encode_data(data)}, bytes(pdf_bytes)
+
+
+def _run_job(job_id, spec, progress):
+    """Worker entry point; progress is a Manager dict shared with the server."""
+    def report(fraction, stage):
+        progress[job_id] = {'progress': fraction, 'stage': stage}
+    result, pdf_bytes = run_analysis(spec, report)
+    report(1.0, "Done")
+    return json.dumps(result), pdf_bytes
+
+
+# --- Server ---
+
+class AnalysisJobServer:
+    """Accepts jobs over HTTP and runs them on a process pool behind a bounded queue.
+
+    At most `workers` jobs run at once; up to `max_queue` more wait. Finished
+    jobs (and their results) are kept for the most recent `keep_finished`.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=None, max_queue=32, keep_finished=200):
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.keep_finished = keep_finished
+        self.jobs = OrderedDict()  # job_id -> record
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=max_queue)
+
+        # spawn: workers must not inherit the HTTP threads' locks
+        ctx = multiprocessing.get_context("spawn")
+        self.manager = ctx.Manager()
+        self.progress = self.manager.dict()
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+        self.dispatchers = [threading.Thread(target=self._dispatch, daemon=True) for _ in range(self.workers)]
+        for t in self.dispatchers:
+            t.start()
+
+        self.httpd = ThreadingHTTPServer((host, port), _JobRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.app = self
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def submit(self, spec):
+        """Queue a job; returns its id, or None when the queue is full."""
+        job_id = uuid.uuid4().hex[:12]
+        record = {'job_id': job_id, 'status': 'queued', 'submitted_at': time.time(), 'started_at': None,
+                  'finished_at': None, 'error': None, 'result': None, 'pdf': None, 'spec': spec}
+        with self.lock:
+            try:
+                self.queue.put_nowait(job_id)
+            except queue.Full:
+                return None
+            self.jobs[job_id] = record
+            self._trim()
+        return job_id
+
+    def _trim(self):
+        finished = [k for k, r in self.jobs.items() if r['status'] in ('done', 'failed')]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            self.jobs.pop(job_id)
+            self.progress.pop(job_id, None)
+
+    def _dispatch(self):
+        while True:
+            job_id = self.queue.get()
+            with self.lock:
+                record = self.jobs.get(job_id)
+                if record is None:
+                    continue
+                record['status'], record['started_at'] = 'running', time.time()
+            try:
+                result, pdf_bytes = self.pool.submit(_run_job, job_id, record['spec'], self.progress).result()
+                update = {'status': 'done', 'result': result, 'pdf': pdf_bytes}
+            except Exception as e:
+                update = {'status': 'failed', 'error': f"{type(e).__name__}: {e}"}
+            with self.lock:
+                record.update(update, finished_at=time.time())
+                self._trim()
+
+    def status(self, job_id):
+        with self.lock:
+            record = self.jobs.get(job_id)
+            if record is None:
+                return None
+            info = {k: record[k] for k in ('job_id', 'status', 'submitted_at', 'started_at', 'finished_at', 'error')}
+        info.update(self.progress.get(job_id, {'progress': 0.0, 'stage': 'Queued'}))
+        if info['status'] == 'queued':
+            with self.queue.mutex:
+                pending = list(self.queue.queue)
+            info['queue_position'] = pending.index(job_id) + 1 if job_id in pending else 0
+        return info
+
+    def record(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def health(self):
+        with self.lock:
+            running = sum(r['status'] == 'running' for r in self.jobs.values())
+        return {'status': 'ok', 'workers': self.workers, 'running': running,
+                'queued': self.queue.qsize(), 'max_queue': self.queue.maxsize}
+
+    def serve_forever(self):
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        self.httpd.server_close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.manager.shutdown()
+
+
+class _JobRequestHandler(BaseHTTPRequestHandler):
+    server_version = "FactorSimJobServer/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, code, body, content_type="application/json", headers=None):
+        data = body if isinstance(body, (bytes, bytearray)) else json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        app = self.server.app
+        if self.path.rstrip("/") != "/jobs":
+            return self._send(404, {'error': 'not found'})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            spec = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._send(400, {'error': 'invalid JSON'})
+        if not isinstance(spec, dict):
+            return self._send(400, {'error': 'job spec must be a JSON object'})
+        if not isinstance(spec.get('weights'), dict) or not spec['weights']:
+            return self._send(400, {'error': "'weights' must be a non-empty {ticker: weight} object"})
+
+        job_id = app.submit(spec)
+        if job_id is None:
+            return self._send(503, {'error': 'queue full'}, headers={"Retry-After": "5"})
+        self._send(202, {'job_id': job_id, 'status_url': f"/jobs/{job_id}"}, headers={"Location": f"/jobs/{job_id}"})
+
+    def do_GET(self):
+        app = self.server.app
+        parts = [p for p in self.path.split("?")[0].split("/") if p]
+        if parts == ['health']:
+            return self._send(200, app.health())
+        if len(parts) < 2 or parts[0] != 'jobs' or len(parts) > 3:
+            return self._send(404, {'error': 'not found'})
+
+        status = app.status(parts[1])
+        if status is None:
+            return self._send(404, {'error': 'unknown job'})
+        if len(parts) == 2:
+            return self._send(200, status)
+        if status['status'] != 'done':
+            return self._send(409, status)
+
+        record = app.record(parts[1])
+        if parts[2] == 'result':
+            return self._send(200, record['result'].encode("utf-8"))
+        if parts[2] == 'pdf':
+            return self._send(200, record['pdf'], content_type="application/pdf",
+                              headers={"Content-Disposition": f'attachment; filename="analysis_{parts[1]}.pdf"'})
+        self._send(404, {'error': 'not found'})
+
+
+# --- Client ---
+
+class AnalysisClient:
+    """Thin HTTP client for the job server (used by the app and batch scripts)."""
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, method, path, body=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                     headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def submit(self, spec):
+        code, body = self._request("POST", "/jobs", spec)
+        if code != 202:
+            raise RuntimeError(f"Job rejected ({code}): {json.loads(body).get('error')}")
+        return json.loads(body)['job_id']
+
+    def status(self, job_id):
+        code, body = self._request("GET", f"/jobs/{job_id}")
+        if code != 200:
+            raise RuntimeError(f"Unknown job {job_id}")
+        return json.loads(body)
+
+    def wait(self, job_id, poll_interval=0.5, timeout=None, on_progress=None):
+        """Poll until the job is done or failed; returns the final status."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            status = self.status(job_id)
+            if on_progress is not None:
+                on_progress(status)
+            if status['status'] in ('done', 'failed'):
+                return status
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Job {job_id} still {status['status']} after {timeout}s")
+            time.sleep(poll_interval)
+
+    def result(self, job_id):
+        """Payload, result tables and portfolio data with DataFrames/Series restored."""
+        code, body = self._request("GET", f"/jobs/{job_id}/result")
+        if code != 200:
+            raise RuntimeError(f"Result not available ({code}): {body.decode('utf-8', 'replace')}")
+        result = json.loads(body)
+        result['portfolio_data'] = decode_data(result['portfolio_data'])
+        result['tables'] = decode_data(result.get('tables', {}))
+        return result
+
+    def pdf(self, job_id):
+        code, body = self._request("GET", f"/jobs/{job_id}/pdf")
+        if code != 200:
+            raise RuntimeError(f"PDF not available ({code})")
+        return body
+
+
+# --- CLI ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Factor Simulator analysis job server")
+    sub = parser.add_subparsers(dest="command")
+
+    serve = sub.add_parser("serve", help="run the server (default)")
+    serve.add_argument("--host", default=DEFAULT_HOST)
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve.add_argument("--workers", type=int, default=None)
+    serve.add_argument("--max-queue", type=int, default=32)
+
+    submit = sub.add_parser("submit", help="submit a job spec (JSON file) and wait for it")
+    submit.add_argument("spec")
+    submit.add_argument("--url", default=os.environ.get("ANALYSIS_SERVER_URL", f"http://{DEFAULT_HOST}:{DEFAULT_PORT}"))
+    submit.add_argument("--pdf", help="write the report PDF to this path")
+
+    args = parser.parse_args(argv)
+    if args.command == "submit":
+        with open(args.spec, encoding="utf-8") as f:
+            spec = json.load(f)
+        client = AnalysisClient(args.url)
+        job_id = client.submit(spec)
+        status = client.wait(job_id, on_progress=lambda s: print(f"[{job_id}] {s['progress']:.0%} {s['stage']}", file=sys.stderr))
+        if status['status'] != 'done':
+            print(f"Job failed: {status['error']}", file=sys.stderr)
+            return 1
+        print(json.dumps(client.result(job_id)['payload'], indent=2, ensure_ascii=False))
+        if args.pdf:
+            with open(args.pdf, "wb") as f:
+                f.write(client.pdf(job_id))
+        return 0
+
+    server = AnalysisJobServer(getattr(args, 'host', DEFAULT_HOST), getattr(args, 'port', DEFAULT_PORT),
+                               workers=getattr(args, 'workers', None), max_queue=getattr(args, 'max_queue', 32))
+    print(f"Analysis job server on {server.url} ({server.workers} workers)", file=sys.stderr)
+    server.serve_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -97,11 +97,23 @@ def create_pdf_report(payload, figs):
         pdf.chapter_title("3. Key Performance Metrics")
         pdf.draw_table(payload['metrics'])
 
+        if payload.get('stress_test'):
+            pdf.check_space(40)
+            pdf.set_font('Arial', 'B', 10)
+            pdf.cell(0, 6, "Crisis Scenario Replay (Return / Max DD / Recovery):", 0, 1)
+            pdf.draw_table(payload['stress_test'])
+
+        if payload.get('goal_plan'):
+            pdf.check_space(40)
+            pdf.set_font('Arial', 'B', 10)
+            pdf.cell(0, 6, "Goal-Based Plan (Contributions & Withdrawals):", 0, 1)
+            pdf.draw_table(payload['goal_plan'])
+
     # 4. Visual Analysis (Graphs)
     if figs:
         pdf.add_page()
         pdf.chapter_title("4. Visual Analysis")
-        for key in ['pie', 'history', 'mc', 'correlation', 'factor_beta', 'attribution']:
+        for key in ['pie', 'history', 'stress', 'mc', 'correlation', 'factor_beta', 'attribution']:
             if key in figs:
                 try:
                     pdf.check_space(100)
@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from simulation_engine import MarketDataEngine
+from shared_returns import SharedReturnsHandle
+from data_cache import file_lock
+from ticker_index import TICKER_INDEX
+
+# =========================================================
+# 🔥 Background Warm-up (benchmarks, FX, factors, popular tickers)
+# =========================================================
+
+USAGE_PATH = os.environ.get("FACTOR_SIM_USAGE_STATS", os.path.join(tempfile.gettempdir(), "factor_sim_usage.json"))
+WARMUP_ENABLED = os.environ.get("FACTOR_SIM_WARMUP", "1") != "0"
+WARMUP_INTERVAL = int(os.environ.get("FACTOR_SIM_WARMUP_INTERVAL_MIN", "360")) * 60
+FACTOR_REGIONS = ('US', 'Japan', 'Global')
+FACTOR_MODELS = ('3F', '5F')
+# French factors are published with a lag; prices and FX should reach the current month
+FACTOR_MAX_LAG_MONTHS = 3
+
+logger = logging.getLogger(__name__)
+
+
+def _last_date(value):
+    """Last observation date of a refreshed cache value (frame, series or shared block), else None."""
+    if isinstance(value, SharedReturnsHandle):
+        return pd.Timestamp(value.dates[-1]) if value.dates else None
+    if isinstance(value, (pd.DataFrame, pd.Series)) and isinstance(value.index, pd.DatetimeIndex) and len(value.index):
+        return value.index.max()
+    return None
+
+
+class UsageStats:
+    """Persistent request counters per ticker, basket and benchmark; drives what gets warmed."""
+
+    def __init__(self, path=USAGE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def record(self, tickers, benchmark=None):
+        """Count one analysis request (tickers in request order form the basket key)."""
+        tickers = [str(t) for t in tickers]
+        if not tickers:
+            return
+        with self._lock, file_lock(self.path):  # other app/worker processes share the file
+            stats = self._read()
+            for section, keys in (('tickers', tickers), ('baskets', ["|".join(tickers)]),
+                                  ('benchmarks', [benchmark] if benchmark else [])):
+                counts = stats.setdefault(section, {})
+                for key in keys:
+                    counts[key] = counts.get(key, 0) + 1
+            stats['updated_at'] = time.time()
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(stats, f)
+            os.replace(tmp, self.path)
+
+    def top(self, section, n):
+        return [k for k, _ in Counter(self._read().get(section, {})).most_common(n)]
+
+    def top_tickers(self, n=20):
+        return self.top('tickers', n)
+
+    def top_baskets(self, n=5):
+        return [tuple(b.split("|")) for b in self.top('baskets', n)]
+
+
+class WarmupScheduler:
+    """Daemon thread that refreshes shared-cache entries before users ask for them.
+
+    Each cycle first updates the ticker index (so currencies are known), then
+    refreshes benchmarks, FX, all French factor sets, the most requested
+    baskets and every stale ticker-index record on at most `max_workers` threads. Values are recomputed and swapped
+    into the cache in place, so readers never see a cold entry. Every cycle uses
+    a new engine so the download window ends today, and a task only counts as
+    ok when its data reaches the current month (factors: within the publication lag).
+    """
+
+    def __init__(self, interval=WARMUP_INTERVAL, max_workers=4, top_tickers=20, top_baskets=5, usage=None):
+        self.interval = interval
+        self.max_workers = max_workers
+        self.n_tickers = top_tickers
+        self.n_baskets = top_baskets
+        self.usage = usage or USAGE_STATS
+        self.engine = None         # rebuilt per cycle (end_date = today)
+        self.results = {}          # task label -> {'ok', 'seconds', 'refreshed_at', 'error', 'last_date'}
+        self.last_cycle_at = None
+        self.running = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def _benchmarks(self):
+        listed = [t for region in MarketDataEngine.BENCHMARK_OPTIONS.values() for t in region.values()]
+        return list(dict.fromkeys(listed + self.usage.top('benchmarks', 5)))
+
+    def tasks(self):
+        """(label, callable, max lag in months) for one cycle, after the ticker index is current."""
+        engine = self.engine or MarketDataEngine()
+        benchmarks = self._benchmarks()
+        tickers = self.usage.top_tickers(self.n_tickers)
+        currencies = {TICKER_INDEX.quote_currency(t)[0] for t in benchmarks + tickers} | {'USD'}
+
+        jobs = [(f"Benchmark {t}", lambda t=t: MarketDataEngine.fetch_benchmark_data.refresh(engine, t), 0)
+                for t in benchmarks]
+        jobs += [(f"FX {c}/JPY", lambda c=c: MarketDataEngine._get_jpy_rate.refresh(engine, c), 0)
+                 for c in sorted(currencies - {'JPY'})]
+        jobs += [(f"Factors {r} {m}", lambda r=r, m=m: MarketDataEngine.fetch_french_factors.refresh(engine, r, m),
+                  FACTOR_MAX_LAG_MONTHS)
+                 for r in FACTOR_REGIONS for m in FACTOR_MODELS]
+        jobs += [(f"Basket {', '.join(b)}", lambda b=b: MarketDataEngine._shared_returns.refresh(engine, b), 0)
+                 for b in self.usage.top_baskets(self.n_baskets)]
+        # Symbols users no longer request would otherwise keep their old metadata forever
+        jobs.append(("Ticker index (stale records)", TICKER_INDEX.refresh_stale, None))
+        return jobs
+
+    def _run_task(self, label, func, max_lag_months=None):
+        start = time.time()
+        error = last = None
+        try:
+            value = func()
+            ok = value is not None and not getattr(value, 'empty', False)
+            last = _last_date(value)
+            if ok and max_lag_months is not None and last is not None:
+                # A refresh that stops short of the current month would push stale data to every reader
+                lag = (pd.Timestamp.today().to_period('M') - last.to_period('M')).n
+                if lag > max_lag_months:
+                    ok, error = False, f"data ends {last:%Y-%m} ({lag} months behind)"
+                    logger.warning("Warm-up task %s: %s", label, error)
+        except Exception as e:
+            # Background thread: log only (no Streamlit calls outside a script run)
+            logger.exception("Warm-up task failed: %s", label)
+            ok, error = False, f"{type(e).__name__}: {e}"
+        with self._lock:
+            self.results[label] = {'ok': ok, 'seconds': time.time() - start, 'refreshed_at': time.time(), 'error': error,
+                                   'last_date': None if last is None else f"{last:%Y-%m-%d}"}
+
+    def run_once(self):
+        """One full warm-up cycle (blocking)."""
+        with self._lock:
+            self.running = True
+        try:
+            self.engine = MarketDataEngine()  # today's end_date for every download in this cycle
+            self._run_task("Ticker index", lambda: TICKER_INDEX.ensure(self._benchmarks() + self.usage.top_tickers(self.n_tickers)))
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                list(pool.map(lambda job: self._run_task(*job), self.tasks()))
+        finally:
+            with self._lock:
+                self.running = False
+                self.last_cycle_at = time.time()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                # Keep the thread alive; the next cycle retries
+                logger.exception("Warm-up cycle failed")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="factor-sim-warmup", daemon=True)
+            self._thread.start()
+        return self
+
+    def trigger(self):
+        """Start the next cycle now instead of waiting for the interval."""
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def status(self):
+        with self._lock:
+            results = dict(self.results)
+            last = self.last_cycle_at
+            running = self.running
+        return {
+            'running': running,
+            'last_cycle_at': last,
+            'next_cycle_at': last + self.interval if last else None,
+            'ok': sum(r['ok'] for r in results.values()),
+            'total': len(results),
+            'tasks': results,
+        }
+
+
+USAGE_STATS = UsageStats()
@@ -0,0 +1,131 @@
+import os
+import glob
+import json
+import time
+import hashlib
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+# =========================================================
+# 🧊 Shared Returns Store (float32 memory-mapped blocks)
+# =========================================================
+
+STORE_DIR = os.environ.get("FACTOR_SIM_SHARED_DIR", os.path.join(tempfile.gettempdir(), "factor_sim_returns"))
+
+
+class SharedReturnsHandle:
+    """Picklable pointer to a published returns block; attach() maps it without copying."""
+
+    def __init__(self, key, version, data_path, shape, tickers, dates, refreshed_at):
+        self.key = key
+        self.version = version
+        self.data_path = data_path
+        self.shape = tuple(shape)
+        self.tickers = list(tickers)
+        self.dates = list(dates)
+        self.refreshed_at = refreshed_at
+
+    def attach(self):
+        """Read-only DataFrame view over the memory-mapped float32 block."""
+        block = np.memmap(self.data_path, dtype=np.float32, mode='r', shape=self.shape)
+        return pd.DataFrame(block, index=pd.DatetimeIndex(self.dates), columns=self.tickers, copy=False)
+
+    def to_dict(self):
+        return {
+            'key': self.key, 'version': self.version, 'data_path': self.data_path,
+            'shape': list(self.shape), 'tickers': self.tickers, 'dates': self.dates,
+            'refreshed_at': self.refreshed_at,
+        }
+
+
+class SharedReturnsStore:
+    """Publishes aligned return matrices once per host so sessions and workers share pages.
+
+    Each basket gets a `<key>.json` index (tickers, dates, version, refresh time)
+    next to a versioned `<key>-<version>.f32` block. Republishing writes a new
+    version and atomically swaps the index; readers pick it up on their next
+    lookup while existing mappings of the old block stay valid.
+    """
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        self._attached = {}  # key -> (version, DataFrame) for this process
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def basket_key(tickers, start_date):
+        raw = "|".join(sorted(str(t) for t in tickers)) + "@" + str(start_date)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+    def _index_path(self, key):
+        return os.path.join(self.root, f"{key}.json")
+
+    def publish(self, key, returns_df):
+        """Write `returns_df` as a new float32 version and return its handle."""
+        os.makedirs(self.root, exist_ok=True)
+        version = f"{time.time_ns():x}"
+        data_path = os.path.join(self.root, f"{key}-{version}.f32")
+        block = np.ascontiguousarray(returns_df.to_numpy(dtype=np.float32))
+
+        tmp_data = data_path + ".tmp"
+        block.tofile(tmp_data)
+        os.replace(tmp_data, data_path)
+
+        handle = SharedReturnsHandle(
+            key, version, data_path, block.shape,
+            [str(c) for c in returns_df.columns],
+            [d.isoformat() for d in pd.DatetimeIndex(returns_df.index)],
+            time.time(),
+        )
+        tmp_index = self._index_path(key) + ".tmp"
+        with open(tmp_index, "w", encoding="utf-8") as f:
+            json.dump(handle.to_dict(), f)
+        os.replace(tmp_index, self._index_path(key))
+
+        # Old versions: mapped readers keep their inode alive on POSIX
+        for stale in glob.glob(os.path.join(self.root, f"{key}-*.f32")):
+            if stale != data_path:
+                try:
+                    os.unlink(stale)
+                except OSError:
+                    pass
+        return handle
+
+    def lookup(self, key, max_age=None):
+        """Handle of the current on-disk version, or None if missing or older than max_age seconds."""
+        try:
+            with open(self._index_path(key), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(meta['data_path']):
+            return None
+        if max_age is not None and time.time() - meta['refreshed_at'] > max_age:
+            return None
+        return SharedReturnsHandle(**meta)
+
+    def attach(self, handle):
+        """Attach once per process and version; later calls reuse the same mapping."""
+        with self._lock:
+            cached = self._attached.get(handle.key)
+            if cached is not None and cached[0] == handle.version:
+                return cached[1]
+            frame = handle.attach()
+            self._attached[handle.key] = (handle.version, frame)
+            return frame
+
+    def invalidate(self, key):
+        """Remove a basket's index and blocks, forcing the next fetch to republish."""
+        with self._lock:
+            self._attached.pop(key, None)
+        for path in [self._index_path(key)] + glob.glob(os.path.join(self.root, f"{key}-*.f32")):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+SHARED_RETURNS = SharedReturnsStore()
@@ -1,4 +1,3 @@
-import streamlit as st
 import pandas as pd
 import numpy as np
 import yfinance as yf
@@ -6,77 +5,106 @@ import statsmodels.api as sm
 from statsmodels.regression.rolling import RollingOLS
 from sklearn.decomposition import PCA
 import pandas_datareader.data as web
+from scipy import optimize, stats
+from scipy.stats import qmc
+from scipy.signal import lfilter
 from datetime import datetime
+import logging
+import warnings
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from data_cache import SHARED_CACHE
+from shared_returns import SHARED_RETURNS, SharedReturnsHandle
+from ticker_index import TICKER_INDEX
+
+# Fetchers also run on warm-up threads and job workers, so they log instead of
+# calling Streamlit; the app reports failures from the returned values.
+logger = logging.getLogger(__name__)
 
 # =========================================================
 # 🛠️ Class Definitions (Brain: V17.2 - English Edition)
 # =========================================================
 
+def is_japan_ticker(ticker):
+    """True for JPY-denominated listings and indices (per the ticker index)."""
+    return TICKER_INDEX.quote_currency(ticker)[0] == 'JPY'
+
 class MarketDataEngine:
     """Manages market data, factors, and benchmarks."""
+
+    # Benchmarks offered per analysis region (also the warm-up set)
+    BENCHMARK_OPTIONS = {
+        'US': {'S&P 500 (^GSPC)': '^GSPC', 'NASDAQ 100 (^NDX)': '^NDX'},
+        'Japan': {'TOPIX (1306 ETF)': '1306.T', 'Nikkei 225 (^N225)': '^N225'},
+        'Global': {'VT (Total World)': 'VT', 'MSCI ACWI (Index)': 'ACWI'}
+    }
+
+    # Ken French library dataset per (region, model)
+    FACTOR_DATASETS = {
+        ('US', '3F'): 'F-F_Research_Data_Factors',
+        ('US', '5F'): 'F-F_Research_Data_5_Factors_2x3',
+        ('Japan', '3F'): 'Japan_3_Factors',
+        ('Japan', '5F'): 'Japan_5_Factors',
+        ('Global', '3F'): 'Global_3_Factors',
+        ('Global', '5F'): 'Global_5_Factors',
+    }
+
     def __init__(self):
         self.start_date = "2000-01-01"
         self.end_date = datetime.today().strftime('%Y-%m-%d')
-        self.usdjpy_cache = None
+
+    @staticmethod
+    def cache_stats():
+        """Hit/miss/eviction counters and memory use of the shared data cache."""
+        return SHARED_CACHE.stats()
 
     def validate_tickers(self, input_dict):
-        """Check if tickers exist."""
+        """Check tickers against the metadata index; only unknown or stale symbols hit the network."""
         valid_data = {}
         invalid_tickers = []
-        status_text = st.empty()
-        
+
+        records = TICKER_INDEX.ensure(list(input_dict.keys()))
         for ticker, weight in input_dict.items():
-            try:
-                # Check via yfinance
-                tick = yf.Ticker(ticker)
-                hist = tick.history(period="5d")
-                if not hist.empty:
-                    valid_data[ticker] = {'name': ticker, 'weight': weight}
-                    status_text.text(f"✅ OK: {ticker}")
-                else:
-                    invalid_tickers.append(ticker)
-            except:
+            record = records.get(str(ticker))
+            if record and record.get('exists'):
+                valid_data[ticker] = {'name': ticker, 'weight': weight,
+                                      'currency': record.get('currency'), 'exchange': record.get('exchange')}
+            else:
                 invalid_tickers.append(ticker)
-        
-        status_text.empty()
+
         return valid_data, invalid_tickers
 
-    def _get_usdjpy(self):
-        """Fetch JPY rate with cache."""
-        if self.usdjpy_cache is not None:
-            return self.usdjpy_cache
+    @SHARED_CACHE.memoize(ttl=3600*24)
+    def _get_jpy_rate(self, currency='USD'):
+        """Monthly JPY per unit of `currency` (USD via JPY=X, others via {CCY}JPY=X)."""
         try:
-            raw = yf.download("JPY=X", start=self.start_date, end=self.end_date, interval="1mo", auto_adjust=True, progress=False)
+            symbol = "JPY=X" if currency == 'USD' else f"{currency}JPY=X"
+            raw = yf.download(symbol, start=self.start_date, end=self.end_date, interval="1mo", auto_adjust=True, progress=False)
             
             if isinstance(raw, pd.DataFrame):
                 if 'Close' in raw.columns:
-                    usdjpy = raw['Close']
+                    rate = raw['Close']
                 else:
-                    usdjpy = raw.iloc[:, 0]
+                    rate = raw.iloc[:, 0]
             else:
-                usdjpy = raw
+                rate = raw
 
-            if isinstance(usdjpy, pd.DataFrame):
-                usdjpy = usdjpy.iloc[:, 0]
+            if isinstance(rate, pd.DataFrame):
+                rate = rate.iloc[:, 0]
 
-            usdjpy = usdjpy.resample('M').last().ffill()
-            if usdjpy.index.tz is not None: 
-                usdjpy.index = usdjpy.index.tz_localize(None)
+            rate = rate.resample('M').last().ffill()
+            if rate.index.tz is not None: 
+                rate.index = rate.index.tz_localize(None)
             
-            self.usdjpy_cache = usdjpy
-            return usdjpy
+            return rate
         except Exception:
             return pd.Series(dtype=float)
 
-    @st.cache_data(ttl=3600*24*7)
-    def fetch_french_factors(_self, region='US'):
-        """Fetch Fama-French Factors."""
+    @SHARED_CACHE.memoize(ttl=3600*24*7)
+    def fetch_french_factors(_self, region='US', model='3F'):
+        """Fetch Fama-French Factors ('3F' or '5F')."""
         try:
-            name = 'F-F_Research_Data_Factors'
-            if region == 'Japan': 
-                name = 'Japan_3_Factors'
-            elif region == 'Global': 
-                name = 'Global_3_Factors'
+            name = _self.FACTOR_DATASETS.get((region, model), 'F-F_Research_Data_Factors')
 
             ff_data = web.DataReader(name, 'famafrench', start=_self.start_date, end=_self.end_date)[0]
             ff_data = ff_data / 100.0
@@ -88,11 +116,84 @@ class MarketDataEngine:
             
             return ff_data
         except Exception as e:
-            print(f"Factor fetch error: {e}")
+            logger.warning("Factor fetch error (%s %s): %s", region, model, e)
+            return pd.DataFrame()
+
+    def fetch_factor_universe(self, regions=('US', 'Japan', 'Global'), models=('3F', '5F'), max_workers=6):
+        """Fetch every region/model factor set concurrently; returns {'US 3F': df, ...} without failed sets."""
+        keys = [(r, m) for r in regions for m in models]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            frames = list(pool.map(lambda key: self.fetch_french_factors(*key), keys))
+        return {f"{r} {m}": df for (r, m), df in zip(keys, frames) if df is not None and not df.empty}
+
+    def load_portfolio_inputs(self, weights_dict, bench_ticker, region='US', auto_factor_model=True):
+        """Everything one analysis needs, fetched in one call.
+
+        Returns (inputs, error): inputs holds returns, benchmark, components,
+        weights, factors, factor_sets, factor_model and asset_info; error is a
+        short message when no ticker validates or no prices could be fetched.
+        """
+        valid_assets, _ = self.validate_tickers(weights_dict)
+        if not valid_assets:
+            return None, "No valid tickers found."
+
+        # Kept as the shared float32 view; kernels upcast only what they touch (a column, a window, a chunk)
+        hist_returns = self.fetch_historical_prices(list(valid_assets.keys()))
+        if hist_returns.empty:
+            return None, "Failed to fetch price data."
+
+        weights_clean = {k: v['weight'] for k, v in valid_assets.items()}
+        port_series, final_weights = PortfolioAnalyzer.create_synthetic_history(hist_returns, weights_clean)
+
+        TICKER_INDEX.ensure([bench_ticker])
+        bench_series = self.fetch_benchmark_data(bench_ticker)
+
+        # Auto model selection fetches every region x 3F/5F concurrently
+        factor_sets = self.fetch_factor_universe() if auto_factor_model else {}
+        french_factors = self.fetch_french_factors(region, '3F')
+
+        # Index history for stress scenarios older than the price window
+        stress_proxies = self.fetch_proxy_returns(*StressScenarioEngine.proxy_requirements())
+
+        return {
+            'returns': port_series,
+            'benchmark': bench_series,
+            'components': hist_returns,
+            'weights': final_weights,
+            'factors': french_factors,
+            'factor_sets': factor_sets,
+            'factor_model': f"{region} 3F",
+            'asset_info': valid_assets,
+            'stress_proxies': stress_proxies,
+        }, None
+
+    def fetch_historical_prices(self, tickers):
+        """Fetch stock returns as a zero-copy view of the shared float32 block."""
+        block = self._shared_returns(tuple(tickers))
+        if block is None:
             return pd.DataFrame()
+        if isinstance(block, SharedReturnsHandle):
+            # Follow the on-disk index so another process's refresh is picked up
+            latest = SHARED_RETURNS.lookup(block.key) or block
+            return SHARED_RETURNS.attach(latest)
+        return block
+
+    @SHARED_CACHE.memoize(ttl=3600*24)
+    def _shared_returns(_self, tickers):
+        """Reuse a fresh on-disk block for the basket, or download and publish one."""
+        key = SHARED_RETURNS.basket_key(tickers, _self.start_date)
+        handle = SHARED_RETURNS.lookup(key, max_age=3600*24)
+        if handle is not None:
+            return handle
+        returns = _self._download_returns(list(tickers))
+        if returns.empty:
+            return None
+        try:
+            return SHARED_RETURNS.publish(key, returns)
+        except OSError:
+            return returns
 
-    @st.cache_data(ttl=3600*24)
-    def fetch_historical_prices(_self, tickers):
+    def _download_returns(_self, tickers):
         """Fetch stock prices."""
         try:
             raw_data = yf.download(tickers, start=_self.start_date, end=_self.end_date, interval="1mo", auto_adjust=True, progress=False)
@@ -124,17 +225,9 @@ class MarketDataEngine:
             if data.index.tz is not None:
                 data.index = data.index.tz_localize(None)
 
-            usdjpy = _self._get_usdjpy()
-            if not usdjpy.empty:
-                usdjpy = usdjpy.reindex(data.index, method='ffill')
-                data_jpy = data.copy()
-                for col in data.columns:
-                    # Do not convert Japanese assets or indices
-                    is_japan = str(col).endswith(".T") or str(col) in ["^N225", "^TPX", "1306.T"]
-                    if not is_japan:
-                        data_jpy[col] = data[col] * usdjpy
-            else:
-                data_jpy = data
+            data_jpy = data.copy()
+            for col in data.columns:
+                data_jpy[col] = _self._to_jpy(data[col], col)
 
             returns = data_jpy.pct_change().dropna(how='all').dropna()
             
@@ -144,11 +237,44 @@ class MarketDataEngine:
             
             return returns
         except Exception as e:
-            st.error(f"Data Fetch Error: {e}")
+            logger.warning("Data fetch error (%s): %s", ", ".join(tickers), e)
             return pd.DataFrame()
 
-    @st.cache_data(ttl=3600*24)
-    def fetch_benchmark_data(_self, ticker, is_jpy_asset=False):
+    @SHARED_CACHE.memoize(ttl=3600*24*7)
+    def fetch_proxy_returns(_self, tickers, start):
+        """Monthly index returns from `start` for stress proxies, in local currency.
+
+        The FX feed does not reach back to the proxy windows, so these are not
+        converted to JPY.
+        """
+        try:
+            raw_data = yf.download(list(tickers), start=start, end=_self.end_date, interval="1mo", auto_adjust=True, progress=False)
+            data = raw_data['Close'] if 'Close' in raw_data.columns.get_level_values(0) else raw_data
+            if isinstance(data, pd.Series):
+                data = data.to_frame(tickers[0])
+            data = data.resample('M').last()
+            if data.index.tz is not None:
+                data.index = data.index.tz_localize(None)
+            return data.pct_change(fill_method=None).iloc[1:].dropna(how='all')
+        except Exception as e:
+            logger.warning("Proxy index fetch error (%s): %s", ", ".join(tickers), e)
+            return pd.DataFrame()
+
+    def _to_jpy(self, prices, ticker):
+        """Convert a monthly price series to JPY using the ticker's listed currency.
+
+        Left unconverted when the FX series is unavailable.
+        """
+        currency, multiplier = TICKER_INDEX.quote_currency(ticker)
+        if currency == 'JPY':
+            return prices * multiplier
+        rate = self._get_jpy_rate(currency)
+        if rate.empty:
+            return prices
+        return prices * multiplier * rate.reindex(prices.index, method='ffill')
+
+    @SHARED_CACHE.memoize(ttl=3600*24)
+    def fetch_benchmark_data(_self, ticker):
         """Fetch benchmark."""
         try:
             raw_data = yf.download(ticker, start=_self.start_date, end=_self.end_date, interval="1mo", auto_adjust=True, progress=False)
@@ -171,18 +297,131 @@ class MarketDataEngine:
             if data.index.tz is not None:
                 data.index = data.index.tz_localize(None)
 
-            if not is_jpy_asset:
-                usdjpy = _self._get_usdjpy()
-                if not usdjpy.empty:
-                    usdjpy = usdjpy.reindex(data.index, method='ffill')
-                    data = data * usdjpy
-            
+            data = _self._to_jpy(data, ticker)
             return data.pct_change().dropna()
         except:
             return pd.Series(dtype=float)
 
+class AlignedPanel:
+    """One monthly sample shared by every analytic.
+
+    Rows are keyed by an integer month (year * 12 + month - 1) and hold only
+    months present in every supplied source. Portfolio, components,
+    benchmark and factors are stored as C-contiguous float arrays; components
+    keep float32 when the source is the shared float32 block, and consumers
+    upcast the rows they use.
+    """
+
+    def __init__(self, port_ret, components=None, benchmark=None, factors=None):
+        sources = {'y': port_ret.to_frame('y')}
+        if components is not None and not components.empty:
+            sources['components'] = components
+        if benchmark is not None and not benchmark.empty:
+            sources['bench'] = benchmark.to_frame('bench')
+        if factors is not None and not factors.empty:
+            sources['factors'] = factors
+
+        keyed = [df.set_axis(self.month_key(df.index), axis=0) for df in sources.values()]
+        keyed = [df[~df.index.duplicated(keep='last')] for df in keyed]
+        merged = pd.concat(keyed, axis=1, join='inner', keys=list(sources.keys())).dropna()
+
+        self.months = merged.index.to_numpy(dtype=np.int64)
+        self.index = pd.DatetimeIndex(port_ret.index[np.isin(self.month_key(port_ret.index), self.months)]).unique()
+        block = lambda name, dtype=float: np.ascontiguousarray(merged[name].to_numpy(dtype=dtype)) if name in sources else None
+        self.port = block('y')[:, 0] if len(sources) else np.empty(0)
+        self.components = block('components', np.result_type(np.float32, *components.dtypes) if 'components' in sources else float)
+        self.component_names = list(components.columns) if 'components' in sources else []
+        self.bench = block('bench')[:, 0] if 'bench' in sources else None
+        self.factors = block('factors')
+        self.factor_names = list(factors.columns) if 'factors' in sources else []
+
+    @staticmethod
+    def month_key(index):
+        index = pd.DatetimeIndex(index)
+        return index.year.to_numpy(dtype=np.int64) * 12 + index.month.to_numpy(dtype=np.int64) - 1
+
+    def __len__(self):
+        return len(self.months)
+
+    @property
+    def empty(self):
+        return len(self.months) == 0
+
+    def factor_matrix(self, names):
+        """Contiguous (T x k) slice of the requested factor columns."""
+        cols = [self.factor_names.index(n) for n in names if n in self.factor_names]
+        return np.ascontiguousarray(self.factors[:, cols]), [self.factor_names[c] for c in cols]
+
+class CovarianceAccumulator:
+    """Streaming covariance of a (T x N) returns matrix, one row chunk at a time.
+
+    Reads memory-mapped blocks directly: only `chunk_rows` rows are converted
+    to float64 at once, so the footprint is the N x N cross-product plus one
+    chunk. Raw moments are kept (rows can be appended later) together with the
+    row-norm sums that Ledoit-Wolf shrinkage needs, so no second pass is made.
+    Missing returns count as 0.
+    """
+
+    def __init__(self, n_features, chunk_rows=256):
+        self.chunk_rows = chunk_rows
+        self.n = 0
+        self.sum = np.zeros(n_features)
+        self.xtx = np.zeros((n_features, n_features))
+        self.sq_sum = 0.0                    # sum_t |x_t|^2
+        self.sq2_sum = 0.0                   # sum_t |x_t|^4
+        self.sq_x = np.zeros(n_features)     # sum_t |x_t|^2 x_t
+
+    def update(self, block):
+        block = block.to_numpy() if isinstance(block, pd.DataFrame) else block
+        for start in range(0, len(block), self.chunk_rows):
+            C = np.nan_to_num(np.asarray(block[start:start + self.chunk_rows], dtype=np.float64))
+            sq = np.einsum('ij,ij->i', C, C)
+            self.n += len(C)
+            self.sum += C.sum(axis=0)
+            self.xtx += C.T @ C
+            self.sq_sum += sq.sum()
+            self.sq2_sum += sq @ sq
+            self.sq_x += sq @ C
+        return self
+
+    @property
+    def mean(self):
+        return self.sum / self.n
+
+    def covariance(self, ddof=1):
+        m = self.mean
+        return (self.xtx - self.n * np.outer(m, m)) / (self.n - ddof)
+
+    def ledoit_wolf(self):
+        """(shrunk covariance, shrinkage) towards mu * I, matching sklearn's ledoit_wolf."""
+        n, p = self.n, len(self.sum)
+        m = self.mean
+        S = self.covariance(ddof=0)
+        mu = np.trace(S) / p
+        # sum_t |x_t - m|^4 expanded in the accumulated raw moments
+        c = m @ m
+        b2 = m @ self.xtx @ m
+        sum_b = m @ self.sum
+        beta_ = (self.sq2_sum + 4 * b2 + n * c ** 2 - 4 * (m @ self.sq_x)
+                 + 2 * c * self.sq_sum - 4 * c * sum_b)
+        delta_ = (S ** 2).sum()
+        beta = (beta_ / n - delta_) / (p * n)
+        delta = (delta_ - 2 * mu * np.trace(S) + p * mu ** 2) / p
+        beta = min(beta, delta)
+        shrinkage = 0.0 if beta == 0 else beta / delta
+        shrunk = (1 - shrinkage) * S
+        shrunk.flat[::p + 1] += shrinkage * mu
+        return shrunk, shrinkage
+
 class PortfolioAnalyzer:
-    
+
+    # Annual management cost by tier
+    COST_MAP = {'Low': 0.001, 'Medium': 0.006, 'High': 0.020}
+    # Above this many assets, PCA / correlation use the chunked, shrunk path
+    LARGE_UNIVERSE = 500
+    # Correlation heatmaps show at most this many (largest) holdings
+    HEATMAP_ASSETS = 40
+
     @staticmethod
     def create_synthetic_history(returns_df, weights_dict):
         valid_tickers = [t for t in weights_dict.keys() if t in returns_df.columns]
@@ -193,137 +432,820 @@ class PortfolioAnalyzer:
         total_weight = sum(filtered_weights.values())
         norm_weights = {k: v/total_weight for k, v in filtered_weights.items()}
         
-        weighted_returns = pd.DataFrame()
+        # One float64 column at a time, so a float32 (shared) matrix is never copied whole
+        port = np.zeros(len(returns_df))
         for ticker, w in norm_weights.items():
-            weighted_returns[ticker] = returns_df[ticker] * w
+            port += np.nan_to_num(returns_df[ticker].to_numpy(dtype=np.float64)) * w
             
-        port_ret = weighted_returns.sum(axis=1)
+        port_ret = pd.Series(port, index=returns_df.index)
         return port_ret, norm_weights
 
     @staticmethod
-    def calculate_correlation_matrix(returns_df):
+    def largest_holdings(weights, n):
+        """The `n` tickers with the largest weights."""
+        return sorted(weights, key=weights.get, reverse=True)[:n]
+
+    @staticmethod
+    def calculate_correlation_matrix(returns_df, columns=None):
+        """Correlation matrix, optionally only between `columns`.
+
+        Above LARGE_UNIVERSE the Ledoit-Wolf shrinkage is still estimated over
+        every asset; only the requested block is returned.
+        """
         if returns_df.empty:
             return pd.DataFrame()
-        return returns_df.corr()
+        keep = returns_df.columns if columns is None else returns_df.columns[returns_df.columns.isin(columns)]
+        if returns_df.shape[1] > PortfolioAnalyzer.LARGE_UNIVERSE:
+            cov, _ = CovarianceAccumulator(returns_df.shape[1]).update(returns_df).ledoit_wolf()
+            pos = returns_df.columns.get_indexer(keep)
+            cov = cov[np.ix_(pos, pos)]
+            sd = np.sqrt(np.diag(cov))
+            return pd.DataFrame(cov / np.outer(sd, sd), index=keep, columns=keep)
+        return returns_df[keep].corr()
 
     @staticmethod
-    def perform_factor_regression(port_ret, factor_df):
-        if port_ret.empty or factor_df.empty:
-            return None, None
+    def dynamic_correlation(returns_df, window=36, method='rolling', halflife=12):
+        """Time-varying correlation matrices without a per-window .corr().
 
-        df_y = port_ret.to_frame(name='y')
-        df_y['period'] = df_y.index.to_period('M') 
-        df_x = factor_df.copy()
-        df_x['period'] = df_x.index.to_period('M') 
-        
-        merged = pd.merge(df_y, df_x, on='period', how='inner').dropna()
-        if merged.empty: return None, None
+        'rolling': window sums from prefix sums of x and x x' (O(N²) per step).
+        'ewma': exponentially weighted mean and second moment via a first-order
+        recursion (lfilter), bias-corrected for the finite history.
+        Returns (dates, array of shape T x N x N); the first window-1 months are dropped.
+        """
+        clean = returns_df.dropna()
+        X = clean.to_numpy(dtype=float)
+        T, N = X.shape
+        if N < 2 or T < window:
+            return pd.DatetimeIndex([]), np.empty((0, N, N))
+
+        outer = X[:, :, None] * X[:, None, :]
+        if method == 'ewma':
+            lam = 0.5 ** (1.0 / halflife)
+            weight = 1 - lam ** np.arange(1, T + 1)
+            mean = lfilter([1 - lam], [1, -lam], X, axis=0) / weight[:, None]
+            second = lfilter([1 - lam], [1, -lam], outer, axis=0) / weight[:, None, None]
+            cov = second - mean[:, :, None] * mean[:, None, :]
+        else:
+            s1 = np.cumsum(np.vstack([np.zeros((1, N)), X]), axis=0)
+            s2 = np.cumsum(np.concatenate([np.zeros((1, N, N)), outer]), axis=0)
+            S = s1[window:] - s1[:-window]
+            P = s2[window:] - s2[:-window]
+            cov = np.concatenate([np.full((window - 1, N, N), np.nan),
+                                  (P - S[:, :, None] * S[:, None, :] / window) / (window - 1)])
+
+        sd = np.sqrt(np.clip(np.einsum('tii->ti', cov), 0, None))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = np.clip(cov / (sd[:, :, None] * sd[:, None, :]), -1, 1)
+        return clean.index[window - 1:], corr[window - 1:]
+
+    @staticmethod
+    def average_pairwise_correlation(corr):
+        """Mean off-diagonal correlation for each matrix of a (T x N x N) stack."""
+        N = corr.shape[-1]
+        return (np.nansum(corr, axis=(1, 2)) - N) / (N * (N - 1))
+
+    @staticmethod
+    def build_panel(port_ret, components=None, benchmark=None, factors=None):
+        """Align all analysis inputs once; pass the result to every panel-aware method."""
+        return AlignedPanel(port_ret, components, benchmark, factors)
+
+    @staticmethod
+    def perform_factor_regression(port_ret, factor_df, panel=None):
+        if panel is None:
+            if port_ret.empty or factor_df.empty:
+                return None, None
+            panel = AlignedPanel(port_ret, factors=factor_df)
+        if panel.empty or panel.factors is None: return None, None
         
-        y = merged['y']
-        X_cols = [c for c in merged.columns if c in ['Mkt-RF', 'SMB', 'HML']]
-        X = merged[X_cols]
-        X = sm.add_constant(X)
+        X, X_cols = panel.factor_matrix([c for c in panel.factor_names if c != 'RF'])
+        X = sm.add_constant(X, has_constant='add')
 
         try:
-            model = sm.OLS(y, X)
+            model = sm.OLS(panel.port, X)
             results = model.fit()
-            return results.params, results.rsquared
+            return pd.Series(results.params, index=['const'] + X_cols), results.rsquared
         except:
             return None, None
 
     @staticmethod
-    def run_monte_carlo_simulation(port_ret, n_years=20, n_simulations=7500, initial_investment=1000000):
+    def compare_factor_models(port_ret, factor_sets):
+        """Regress the portfolio on every factor set over one common sample.
+
+        factor_sets: {label: French factor frame}. All sets are aligned on the
+        months they share, so R² values are comparable. Returns a DataFrame per
+        model (n_months, r_squared, adj_r_squared, annualized alpha, betas) with
+        attrs['best'] = label with the highest adjusted R².
+        """
+        if port_ret.empty or not factor_sets:
+            return pd.DataFrame()
+        labels = list(factor_sets)
+        combined = pd.concat([factor_sets[l].add_prefix(f"{l}|") for l in labels], axis=1, join='inner')
+        panel = AlignedPanel(port_ret, factors=combined)
+        if len(panel) < 24:
+            return pd.DataFrame()
+
+        y = panel.port
+        n = len(y)
+        sst = ((y - y.mean()) ** 2).sum()
+        rows = {}
+        for label in labels:
+            cols = [c for c in panel.factor_names if c.startswith(f"{label}|") and not c.endswith("|RF")]
+            F, names = panel.factor_matrix(cols)
+            X = np.column_stack([np.ones(n), F])
+            coef, ssr = np.linalg.lstsq(X, y, rcond=None)[:2]
+            ssr = ssr[0] if len(ssr) else ((y - X @ coef) ** 2).sum()
+            k = F.shape[1]
+            r2 = 1 - ssr / sst
+            row = {'n_months': n, 'r_squared': r2, 'adj_r_squared': 1 - (1 - r2) * (n - 1) / (n - k - 1),
+                   'alpha': coef[0] * 12}
+            row.update({name.split("|", 1)[1]: b for name, b in zip(names, coef[1:])})
+            rows[label] = row
+
+        table = pd.DataFrame.from_dict(rows, orient='index')
+        table.attrs['best'] = table['adj_r_squared'].idxmax()
+        return table
+
+    @staticmethod
+    def fit_garch(port_ret):
+        """Fit GARCH(1,1) to demeaned monthly returns by Gaussian quasi-MLE (None if it does not converge)."""
+        r = np.asarray(port_ret, dtype=float)
+        eps2 = (r - r.mean()) ** 2
+        var0 = eps2.mean()
+
+        def variance_path(params):
+            omega, alpha, beta = params
+            x = omega + alpha * np.concatenate([[var0], eps2[:-1]])
+            return lfilter([1.0], [1.0, -beta], x, zi=[beta * var0])[0]
+
+        def neg_loglik(params):
+            if params[1] + params[2] >= 0.999:
+                return 1e10
+            h = np.maximum(variance_path(params), 1e-12)
+            return 0.5 * np.sum(np.log(h) + eps2 / h)
+
+        start = [var0 * 0.1, 0.1, 0.8]
+        bounds = [(1e-10, var0 * 10), (0.0, 0.5), (0.0, 0.999)]
+        res = optimize.minimize(neg_loglik, start, method='L-BFGS-B', bounds=bounds)
+        if not res.success:
+            return None
+        omega, alpha, beta = res.x
+        return {
+            'mu': r.mean(), 'omega': omega, 'alpha': alpha, 'beta': beta,
+            'last_variance': variance_path((omega, alpha, beta))[-1],
+            'last_shock2': eps2[-1],
+        }
+
+    @staticmethod
+    def fit_regime_switching(port_ret):
+        """Fit a two-state Markov-switching mean/variance model (statsmodels); None if the fit fails."""
+        r = np.asarray(port_ret, dtype=float)
+        try:
+            res = sm.tsa.MarkovRegression(r, k_regimes=2, switching_variance=True).fit(disp=False)
+            p = dict(zip(res.model.param_names, np.asarray(res.params)))
+            p00, p10 = p['p[0->0]'], p['p[1->0]']
+            return {
+                'mu': np.array([p['const[0]'], p['const[1]']]),
+                'sigma': np.sqrt([p['sigma2[0]'], p['sigma2[1]']]),
+                'transition': np.array([[p00, 1 - p00], [p10, 1 - p10]]),
+                'start_prob': np.asarray(res.smoothed_marginal_probabilities)[-1],
+            }
+        except Exception:
+            return None
+
+    @staticmethod
+    def draw_innovations(n_months, n_simulations, sampling='pseudo', df_t=6, rng=None):
+        """Raw Student-t innovations shaped (n_months x n_simulations).
+
+        'pseudo': plain draws; 'antithetic': +/- pairs in adjacent columns;
+        'sobol': scrambled Sobol points mapped through the t inverse CDF
+        (float32, since the whole matrix has to exist at once).
+        """
+        rng = np.random.default_rng(rng)
+        if sampling == 'antithetic':
+            half = rng.standard_t(df_t, (n_months, (n_simulations + 1) // 2))
+            Z = np.empty((n_months, 2 * half.shape[1]))
+            Z[:, 0::2] = half
+            Z[:, 1::2] = -half
+            return Z[:, :n_simulations]
+        if sampling == 'sobol':
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')  # non power-of-two sample sizes
+                u = qmc.Sobol(d=n_months, scramble=True, seed=rng).random(n_simulations)
+            Z = np.empty((n_months, n_simulations), dtype=np.float32)
+            for start in range(0, n_months, 12):  # month blocks keep inverse-CDF temporaries small
+                Z[start:start + 12] = stats.t.ppf(np.clip(u[:, start:start + 12], 1e-12, 1 - 1e-12), df_t).T
+            return Z
+        return rng.standard_t(df_t, (n_months, n_simulations))
+
+    @staticmethod
+    def _control_variate_weights(C):
+        """Regression weights that make the weighted mean of each control row exactly 0."""
+        n = C.shape[-1]
+        dev = C - C.mean(axis=-1, keepdims=True)
+        ss = (dev ** 2).sum(axis=-1, keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            adj = np.where(ss > 0, C.mean(axis=-1, keepdims=True) * dev / ss, 0.0)
+        return 1.0 / n - adj
+
+    @staticmethod
+    def _weighted_percentiles(values, weights, percentiles=(10, 50, 90)):
+        """Row-wise percentiles of a weighted empirical distribution."""
+        values, weights = np.atleast_2d(values), np.atleast_2d(weights)
+        order = np.argsort(values, axis=1)
+        v = np.take_along_axis(values, order, axis=1)
+        cw = np.cumsum(np.take_along_axis(weights, order, axis=1), axis=1)
+        rows = np.arange(v.shape[0])
+        out = [v[rows, np.minimum((cw < p / 100).sum(axis=1), v.shape[1] - 1)] for p in percentiles]
+        return np.stack(out, axis=1)
+
+    @staticmethod
+    def _fit_vol_model(port_ret, volatility_model):
+        """(model actually used, fitted parameters); a failed GARCH/regime fit falls back to constant."""
+        fitters = {'garch': PortfolioAnalyzer.fit_garch, 'regime': PortfolioAnalyzer.fit_regime_switching}
+        if volatility_model in fitters:
+            fitted = fitters[volatility_model](port_ret)
+            if fitted is not None:
+                return volatility_model, fitted
+        return 'constant', {'mu': port_ret.mean(), 'sigma': port_ret.std()}
+
+    @staticmethod
+    def _iter_growth(model, params, n_months, n_simulations, rng, sampling='pseudo', df_t=6, innovations=None):
+        """Yield (unit-variance shock, gross growth factor) per month with all paths advanced in lockstep.
+
+        Pseudo and antithetic draws are generated month by month, so memory
+        stays O(paths); only Sobol needs the full draw matrix.
+        """
+        Z = innovations
+        if Z is None and sampling == 'sobol':
+            Z = PortfolioAnalyzer.draw_innovations(n_months, n_simulations, sampling, df_t, rng)
+        if Z is not None:
+            draw = lambda t: Z[t]
+        elif sampling == 'antithetic':
+            draw = lambda t: PortfolioAnalyzer.draw_innovations(1, n_simulations, sampling, df_t, rng)[0]
+        else:
+            draw = lambda t: rng.standard_t(df_t, n_simulations)
+
+        # Every model uses unit-variance shocks so sigma means the same thing across models
+        scale = np.sqrt((df_t - 2) / df_t)
+        if model == 'constant':
+            drift = params['mu'] - 0.5 * params['sigma']**2
+            for t in range(n_months):
+                z = draw(t) * scale
+                yield z, np.exp(drift + params['sigma'] * z)
+            return
+
+        if model == 'garch':
+            h = np.full(n_simulations, params['omega'] + params['alpha'] * params['last_shock2'] + params['beta'] * params['last_variance'])
+        else:
+            state = (rng.random(n_simulations) > params['start_prob'][0]).astype(int)
+
+        for t in range(n_months):
+            z = draw(t) * scale
+            if model == 'garch':
+                eps = np.sqrt(h) * z
+                growth = np.exp(params['mu'] - 0.5 * h + eps)
+                h = params['omega'] + params['alpha'] * eps ** 2 + params['beta'] * h
+            else:
+                state = (rng.random(n_simulations) > params['transition'][state, 0]).astype(int)
+                sigma = params['sigma'][state]
+                growth = np.exp(params['mu'][state] - 0.5 * sigma ** 2 + sigma * z)
+            yield z, growth
+
+    @staticmethod
+    def simulate_growth_factors(port_ret, n_months, n_simulations=7500, volatility_model='constant',
+                                sampling='pseudo', seed=None):
+        """(n_months x n_simulations) gross monthly growth factors (float32), reusable across scenarios."""
+        rng = np.random.default_rng(seed)
+        model, params = PortfolioAnalyzer._fit_vol_model(port_ret, volatility_model)
+        growth = np.empty((n_months, n_simulations), dtype=np.float32)
+        for t, (_, g) in enumerate(PortfolioAnalyzer._iter_growth(model, params, n_months, n_simulations, rng, sampling)):
+            growth[t] = g
+        return growth
+
+    @staticmethod
+    def _simulate_batch(model, params, n_months, n_simulations, initial_investment, rng,
+                        sampling='pseudo', control_variate=False, df_t=6, innovations=None):
+        """One batch of paths; returns (per-month p10/p50/p90 array, final values, controls).
+
+        `controls` are the cumulative shocks behind the control-variate
+        weights (None without control variates).
+
+        `innovations` (raw t draws, n_months x n_simulations) replaces fresh
+        draws so several runs can share common random numbers.
+        """
+        percentiles = [10, 50, 90]
+
+        # All models advance paths in lockstep, keeping only the wealth vector (no months x paths arrays)
+        wealth = np.full(n_simulations, float(initial_investment))
+        cum_z = np.zeros(n_simulations)
+        stats_data = np.empty((n_months + 1, 3))
+        stats_data[0] = initial_investment
+
+        steps = PortfolioAnalyzer._iter_growth(model, params, n_months, n_simulations, rng, sampling, df_t, innovations)
+        for t, (z, growth) in enumerate(steps, start=1):
+            wealth *= growth
+            if control_variate:
+                cum_z += z
+                weights = PortfolioAnalyzer._control_variate_weights(cum_z)
+                stats_data[t] = PortfolioAnalyzer._weighted_percentiles(wealth, weights, percentiles)[0]
+            else:
+                stats_data[t] = np.percentile(wealth, percentiles)
+
+        return stats_data, wealth, (cum_z if control_variate else None)
+
+    @staticmethod
+    def run_monte_carlo_simulation(port_ret, n_years=20, n_simulations=7500, initial_investment=1000000,
+                                   volatility_model='constant', seed=None, sampling='pseudo', control_variate=False,
+                                   innovations=None):
+        """Student-t Monte Carlo of portfolio value.
+
+        volatility_model: 'constant' (fixed sigma), 'garch' (GARCH(1,1) fitted
+        to port_ret) or 'regime' (two-state Markov switching).
+        sampling: 'pseudo', 'antithetic' or 'sobol'; control_variate re-weights
+        paths so the cumulative shocks have their known mean of zero.
+        innovations: optional shared draws from draw_innovations (common random numbers).
+        Returns (df_stats with p10/p50/p90 per month, final_values per path);
+        df_stats.attrs['volatility_model'] is the model actually simulated and
+        df_stats.attrs['percentile_errors'] the final-percentile batch errors
+        ({'p10': {'estimate', 'std_error', 'rel_error'}, ...}) of the same
+        (control-variate weighted or plain) estimator.
+        """
         if port_ret.empty:
             return None, None
 
-        mu_monthly = port_ret.mean()
-        sigma_monthly = port_ret.std()
-        
         n_months = n_years * 12
-        drift = (mu_monthly - 0.5 * sigma_monthly**2)
-        
-        df_t = 6
-        Z = np.random.standard_t(df_t, (n_months, n_simulations))
-        
-        daily_returns = np.exp(drift + sigma_monthly * Z)
-        
-        price_paths = np.zeros((n_months + 1, n_simulations))
-        price_paths[0] = initial_investment
-        price_paths[1:] = initial_investment * np.cumprod(daily_returns, axis=0)
-        
+        if innovations is not None:
+            innovations = innovations[:n_months]
+            n_simulations = innovations.shape[1]
+        rng = np.random.default_rng(seed)
+        model, params = PortfolioAnalyzer._fit_vol_model(port_ret, volatility_model)
+        stats_data, final_values, controls = PortfolioAnalyzer._simulate_batch(
+            model, params, n_months, n_simulations, initial_investment, rng, sampling, control_variate,
+            innovations=innovations)
+
         last_date = port_ret.index[-1]
         future_dates = pd.date_range(start=last_date, periods=n_months + 1, freq='M')
-        
-        percentiles = [10, 50, 90]
-        stats_data = np.percentile(price_paths, percentiles, axis=1)
-        df_stats = pd.DataFrame(stats_data.T, index=future_dates, columns=['p10', 'p50', 'p90'])
-        
-        final_values = price_paths[-1, :]
-        
+        df_stats = pd.DataFrame(stats_data, index=future_dates, columns=['p10', 'p50', 'p90'])
+        df_stats.attrs['volatility_model'] = model
+        # Plain dict: DataFrame-valued attrs break pandas' attrs comparison on concat
+        df_stats.attrs['percentile_errors'] = PortfolioAnalyzer.estimate_percentile_errors(
+            final_values, controls=controls).to_dict('index')
+
         return df_stats, final_values
 
+    @staticmethod
+    def estimate_percentile_errors(final_values, percentiles=(10, 50, 90), n_batches=20, controls=None):
+        """Batch-means standard error of final-value percentiles.
+
+        Batches are contiguous and even-sized so antithetic pairs stay together;
+        for a single Sobol sequence the estimate is conservative. With
+        `controls` (cumulative shocks per path) every batch is re-weighted by
+        its own control-variate regression, matching the weighted percentiles.
+        """
+        values = np.asarray(final_values, dtype=float)
+        size = (len(values) // n_batches) // 2 * 2
+        if size < 2:
+            return pd.DataFrame()
+        batches = values[:size * n_batches].reshape(n_batches, size)
+        if controls is None:
+            batch_est = np.percentile(batches, percentiles, axis=1)
+            estimate = np.percentile(values, percentiles)
+        else:
+            C = np.asarray(controls, dtype=float)
+            batch_C = C[:size * n_batches].reshape(n_batches, size)
+            batch_est = PortfolioAnalyzer._weighted_percentiles(
+                batches, PortfolioAnalyzer._control_variate_weights(batch_C), percentiles).T
+            estimate = PortfolioAnalyzer._weighted_percentiles(
+                values, PortfolioAnalyzer._control_variate_weights(C), percentiles)[0]
+        std_error = batch_est.std(axis=1, ddof=1) / np.sqrt(n_batches)
+        return pd.DataFrame({'estimate': estimate, 'std_error': std_error, 'rel_error': std_error / np.abs(estimate)},
+                            index=[f"p{p}" for p in percentiles])
+
+    @staticmethod
+    def run_adaptive_monte_carlo(port_ret, n_years=20, initial_investment=1000000, volatility_model='constant',
+                                 sampling='sobol', control_variate=False, target_rel_error=0.005,
+                                 batch_size=2048, min_batches=8, max_simulations=200000, seed=None):
+        """Add independent batches until every final percentile reaches the target relative error.
+
+        Each batch is an independent replicate (its own scramble for Sobol), so
+        the batch-means standard error is valid for all sampling schemes.
+        The batch size shrinks so `min_batches` fit under `max_simulations`,
+        and the last batch is cut so the total never exceeds it.
+        Returns (df_stats, final_values, convergence DataFrame).
+        """
+        if port_ret.empty:
+            return None, None, pd.DataFrame()
+
+        n_months = n_years * 12
+        rng = np.random.default_rng(seed)
+        model, params = PortfolioAnalyzer._fit_vol_model(port_ret, volatility_model)
+        # Even sizes keep antithetic pairs inside one batch
+        batch_size = max(2, min(batch_size, max_simulations // min_batches) // 2 * 2)
+
+        def batch_errors():
+            est = np.stack([b[-1] for b in batch_stats])
+            center = np.average(est, axis=0, weights=sizes)
+            std_error = est.std(axis=0, ddof=1) / np.sqrt(len(est)) if len(est) > 1 else np.full(3, np.nan)
+            return center, std_error, std_error / np.abs(center)
+
+        batch_stats, finals, sizes = [], [], []
+        while sum(sizes) < max_simulations:
+            size = min(batch_size, max_simulations - sum(sizes))
+            stats_data, final_values, _ = PortfolioAnalyzer._simulate_batch(
+                model, params, n_months, size, initial_investment, rng, sampling, control_variate)
+            batch_stats.append(stats_data)
+            finals.append(final_values)
+            sizes.append(size)
+            if len(sizes) >= min_batches and batch_errors()[2].max() <= target_rel_error:
+                break
+        center, std_error, rel_error = batch_errors()
+
+        last_date = port_ret.index[-1]
+        future_dates = pd.date_range(start=last_date, periods=n_months + 1, freq='M')
+        df_stats = pd.DataFrame(np.average(batch_stats, axis=0, weights=sizes), index=future_dates, columns=['p10', 'p50', 'p90'])
+        df_stats.attrs['volatility_model'] = model
+        convergence = pd.DataFrame({
+            'estimate': center, 'std_error': std_error, 'rel_error': rel_error,
+        }, index=['p10', 'p50', 'p90'])
+        convergence.attrs.update({
+            'n_simulations': int(sum(sizes)), 'n_batches': len(sizes),
+            'converged': bool(len(sizes) >= min_batches and rel_error.max() <= target_rel_error),
+        })
+        return df_stats, np.concatenate(finals), convergence
+
+    @staticmethod
+    def _walk_forward_chunk(drift, sigma, realized, horizon, n_simulations, df_t, band_levels, seed):
+        """Simulated h-month log growth for a block of origins; returns (PIT, band quantiles)."""
+        rng = np.random.default_rng(seed)
+        # Constant model: log growth over h months = h*drift + sigma * (sum of h unit-variance t draws)
+        shock_sum = rng.standard_t(df_t, (len(drift), n_simulations, horizon)).sum(axis=2) * np.sqrt((df_t - 2) / df_t)
+        sim = horizon * drift[:, None] + sigma[:, None] * shock_sum
+        pit = (sim <= realized[:, None]).mean(axis=1)
+        bands = np.percentile(sim, band_levels, axis=1).T
+        return pit, bands
+
+    @staticmethod
+    def walk_forward_calibration(port_ret, horizon=12, window=60, n_simulations=2000, step=1, df_t=6,
+                                 coverage_levels=(0.5, 0.8, 0.9), seed=0, chunk_size=32, max_workers=None):
+        """Out-of-sample check of the constant-volatility Student-t forecast bands.
+
+        At every origin the model is fitted on the trailing `window` months
+        (rolling mean/std from cumulative sums), `horizon`-month paths are
+        simulated, and the realized outcome is located in that distribution.
+        Origins are processed in chunks on a thread pool, each chunk drawing
+        its own seeded shocks. Overlapping horizons make consecutive PITs
+        dependent, so the KS p-value is optimistic for step < horizon.
+        Returns {'origins', 'coverage', 'ks_stat', 'ks_pvalue', 'pit'} or None.
+        """
+        r = port_ret.dropna()
+        values = r.to_numpy(dtype=float)
+        n = len(values)
+        origins = np.arange(window, n - horizon + 1, step)
+        if window < 12 or len(origins) < 10:
+            return None
+
+        # Trailing moments for every origin at once (ddof=1, as in Series.std)
+        c1 = np.concatenate([[0.0], np.cumsum(values)])
+        c2 = np.concatenate([[0.0], np.cumsum(values ** 2)])
+        s1 = c1[origins] - c1[origins - window]
+        s2 = c2[origins] - c2[origins - window]
+        mu = s1 / window
+        sigma = np.sqrt(np.maximum((s2 - window * mu ** 2) / (window - 1), 0.0))
+        drift = mu - 0.5 * sigma ** 2
+
+        cl = np.concatenate([[0.0], np.cumsum(np.log1p(values))])
+        realized = cl[origins + horizon] - cl[origins]
+
+        band_levels = sorted({50.0} | {q for c in coverage_levels for q in (50 - 50 * c, 50 + 50 * c)})
+        seeds = np.random.SeedSequence(seed).spawn(int(np.ceil(len(origins) / chunk_size)))
+        blocks = [slice(i, i + chunk_size) for i in range(0, len(origins), chunk_size)]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(
+                lambda job: PortfolioAnalyzer._walk_forward_chunk(
+                    drift[job[0]], sigma[job[0]], realized[job[0]], horizon, n_simulations, df_t, band_levels, job[1]),
+                zip(blocks, seeds)))
+        pit = np.concatenate([p for p, _ in results])
+        bands = np.vstack([b for _, b in results])
+
+        origin_df = pd.DataFrame({'mu': mu, 'sigma': sigma, 'realized': np.exp(realized), 'pit': pit},
+                                 index=r.index[origins - 1])
+        for j, q in enumerate(band_levels):
+            origin_df[f"p{q:g}"] = np.exp(bands[:, j])
+
+        rows = []
+        for c in coverage_levels:
+            lo, hi = band_levels.index(50 - 50 * c), band_levels.index(50 + 50 * c)
+            inside = (realized >= bands[:, lo]) & (realized <= bands[:, hi])
+            rows.append({'nominal': c, 'observed': inside.mean(), 'below': (realized < bands[:, lo]).mean(),
+                         'above': (realized > bands[:, hi]).mean()})
+        coverage = pd.DataFrame(rows, index=[f"P{50 - 50 * c:g}-P{50 + 50 * c:g}" for c in coverage_levels])
+        coverage.attrs.update({'n_origins': len(origins), 'horizon': horizon, 'window': window})
+
+        ks = stats.kstest(pit, 'uniform')
+        return {'origins': origin_df, 'coverage': coverage, 'ks_stat': float(ks.statistic),
+                'ks_pvalue': float(ks.pvalue), 'pit': pit}
+
+    @staticmethod
+    def build_cash_flows(n_months, monthly_contribution=0.0, contribution_months=None,
+                         annual_withdrawal=0.0, withdrawal_start_month=0):
+        """Monthly cash-flow schedule: contributions (+) then withdrawals (-)."""
+        months = np.arange(n_months)
+        contribution_months = n_months if contribution_months is None else contribution_months
+        flows = np.where(months < contribution_months, monthly_contribution, 0.0)
+        flows = flows - np.where(months >= withdrawal_start_month, annual_withdrawal / 12, 0.0)
+        return flows
+
+    @staticmethod
+    def _cashflow_paths(growth, initial_investment, cash_flows, keep_path=True):
+        """W_t = max(W_{t-1} * G_t + CF_t, 0) for every path (and every schedule row) at once.
+
+        cash_flows is (n_months,) or (n_schedules x n_months); ruin is absorbing.
+        Returns (wealth per month incl. t=0, or only the final wealth when
+        keep_path is False; month of ruin or -1).
+        """
+        cash_flows = np.atleast_2d(cash_flows)
+        n_months, n_paths = growth.shape
+        wealth = np.full((cash_flows.shape[0], n_paths), float(initial_investment))
+        ruin_month = np.full(wealth.shape, -1)
+        path = np.empty((n_months + 1,) + wealth.shape, dtype=np.float32) if keep_path else None
+        if keep_path:
+            path[0] = wealth
+        for t in range(n_months):
+            alive = ruin_month < 0
+            wealth = np.where(alive, wealth * growth[t] + cash_flows[:, t:t + 1], 0.0)
+            newly_ruined = alive & (wealth <= 0)
+            ruin_month[newly_ruined] = t + 1
+            wealth[newly_ruined] = 0.0
+            if keep_path:
+                path[t + 1] = wealth
+        return (path if keep_path else wealth), ruin_month
+
+    @staticmethod
+    def run_goal_simulation(port_ret, cash_flows, n_years=20, initial_investment=1000000, goal_amount=None,
+                            n_simulations=7500, volatility_model='constant', sampling='pseudo', seed=None, growth=None):
+        """Monte Carlo with a cash-flow schedule: percentiles, ruin probability and time to goal.
+
+        Pass `growth` (from simulate_growth_factors) to reuse one set of draws.
+        """
+        if port_ret.empty:
+            return None
+
+        n_months = n_years * 12
+        if growth is None:
+            growth = PortfolioAnalyzer.simulate_growth_factors(port_ret, n_months, n_simulations, volatility_model, sampling, seed)
+        path, ruin_month = PortfolioAnalyzer._cashflow_paths(growth, initial_investment, np.asarray(cash_flows)[:n_months])
+        path, ruin_month = path[:, 0, :], ruin_month[0]
+
+        future_dates = pd.date_range(start=port_ret.index[-1], periods=n_months + 1, freq='M')
+        df_stats = pd.DataFrame(np.percentile(path, [10, 50, 90], axis=1).T, index=future_dates, columns=['p10', 'p50', 'p90'])
+        ruined = ruin_month > 0
+        ruin_curve = pd.Series([(ruined & (ruin_month <= t)).mean() for t in range(n_months + 1)], index=future_dates)
+
+        result = {
+            'df_stats': df_stats,
+            'final_values': path[-1],
+            'ruin_probability': ruined.mean(),
+            'ruin_curve': ruin_curve,
+            'median_ruin_month': np.median(ruin_month[ruined]) if ruined.any() else np.nan,
+        }
+        if goal_amount:
+            hit = path[1:] >= goal_amount
+            reached = hit.any(axis=0)
+            months_to_goal = np.where(reached, hit.argmax(axis=0) + 1, np.nan)
+            result.update({
+                'goal_probability': reached.mean(),
+                'time_to_goal': months_to_goal,
+                'time_to_goal_percentiles': np.nanpercentile(months_to_goal, [10, 50, 90]) if reached.any() else np.full(3, np.nan),
+            })
+        return result
+
+    @staticmethod
+    def critical_withdrawal_rates(growth, initial_investment, withdrawal_start_month=0,
+                                  monthly_contribution=0.0, contribution_months=None):
+        """Per path, the lowest annual withdrawal rate (fraction of initial_investment) that ends in ruin.
+
+        Until ruin, wealth is affine in the rate: W_t(r) = A_t - r * I * B_t,
+        with A_t the wealth path without withdrawals and B_t the compounded
+        withdrawals per unit of annual amount. Ruin at rate r therefore means
+        r >= min_t A_t / (I * B_t), so one pass over the months prices every
+        rate at once. Paths that never withdraw get +inf.
+        """
+        n_months, n_paths = growth.shape
+        contribution_months = withdrawal_start_month if contribution_months is None else contribution_months
+        flows = PortfolioAnalyzer.build_cash_flows(n_months, monthly_contribution, contribution_months)
+        a = np.full(n_paths, float(initial_investment))
+        b = np.zeros(n_paths)
+        critical = np.full(n_paths, np.inf)
+        for t in range(n_months):
+            g = growth[t].astype(np.float64)
+            a = a * g + flows[t]
+            b = b * g + (1 / 12 if t >= withdrawal_start_month else 0.0)
+            if t >= withdrawal_start_month:
+                np.minimum(critical, a / (initial_investment * b), out=critical)
+        return critical
+
+    @staticmethod
+    def find_safe_withdrawal_rate(port_ret, n_years=30, initial_investment=1000000, withdrawal_start_month=0,
+                                  monthly_contribution=0.0, contribution_months=None, max_ruin_prob=0.10,
+                                  n_simulations=7500, volatility_model='constant', sampling='pseudo', seed=None,
+                                  growth=None, rate_grid=None, max_rate=1.0):
+        """Highest annual withdrawal (as a fraction of initial_investment) with ruin probability <= max_ruin_prob.
+
+        The safe rate is the max_ruin_prob quantile of the per-path critical
+        rates (critical_withdrawal_rates): exactly that share of paths is
+        ruined at any higher rate. 'capped' is True when the rate exceeds
+        `max_rate` (the result is then max_rate, a lower bound).
+        'ruin_by_rate' is the ruin curve on `rate_grid` (default 0-20%, widened
+        to cover the safe rate). contribution_months defaults to the
+        withdrawal start.
+        """
+        if port_ret.empty:
+            return None
+
+        n_months = n_years * 12
+        if growth is None:
+            growth = PortfolioAnalyzer.simulate_growth_factors(port_ret, n_months, n_simulations, volatility_model, sampling, seed)
+        critical = np.sort(PortfolioAnalyzer.critical_withdrawal_rates(
+            growth, initial_investment, withdrawal_start_month, monthly_contribution, contribution_months))
+
+        # Up to k ruined paths are allowed; ruin crosses the limit at the (k+1)-th smallest critical rate
+        # (taken a hair below it, so rounding in the month-by-month recurrence cannot tip one more path)
+        k = int(np.floor(max_ruin_prob * len(critical) + 1e-9))
+        rate = critical[k] * (1 - 1e-9) if k < len(critical) else np.inf
+        capped = bool(rate > max_rate)
+        rate = float(min(rate, max_rate))
+
+        if rate_grid is None:
+            rate_grid = np.linspace(0.0, min(max(0.20, 1.5 * rate), max_rate), 81)
+        rate_grid = np.asarray(rate_grid, dtype=float)
+        probs = np.searchsorted(critical, rate_grid, side='right') / len(critical)
+
+        return {
+            'rate': rate,
+            'annual_amount': rate * initial_investment,
+            'ruin_by_rate': pd.Series(probs, index=rate_grid),
+            'capped': capped,
+        }
+
+    @staticmethod
+    def calculate_risk_metrics(returns, periods_per_year=12, risk_free=0.02, threshold=0.0, var_level=0.95):
+        """Compute all headline risk metrics in one vectorized pass.
+
+        `returns` is a 1-D series/array or a 2-D (periods x portfolios) batch.
+        1-D input yields scalars; 2-D input yields one value per column
+        (a pd.Series when a DataFrame is passed). 'wealth' is the shared
+        cumulative growth path so callers never recompute the cumprod.
+        """
+        index = getattr(returns, 'index', None)
+        columns = getattr(returns, 'columns', None)
+        r = np.asarray(returns, dtype=float)
+        is_batch = r.ndim == 2
+        if not is_batch:
+            r = r.reshape(-1, 1)
+
+        n = r.shape[0]
+        keys = ['cagr', 'volatility', 'sharpe', 'sortino', 'max_drawdown', 'max_dd_duration',
+                'calmar', 'omega', 'skew', 'kurtosis', 'var', 'cvar', 'total_return']
+        if n == 0:
+            out = {k: np.full(r.shape[1], np.nan) for k in keys}
+            out['wealth'] = np.empty((0, r.shape[1]))
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                # Wealth path and drawdowns (the single cumprod)
+                wealth = np.cumprod(1 + r, axis=0)
+                peak = np.maximum.accumulate(wealth, axis=0)
+                drawdown = wealth / peak - 1
+                max_dd = drawdown.min(axis=0)
+
+                # Longest run below the previous peak, in periods
+                steps = np.arange(n)[:, None]
+                last_peak = np.maximum.accumulate(np.where(drawdown < 0, -1, steps), axis=0)
+                dd_duration = np.where(last_peak < 0, steps + 1, steps - last_peak).max(axis=0)
+
+                # Moments (pandas-compatible sample std / skew / excess kurtosis)
+                mean = r.mean(axis=0)
+                dev = r - mean
+                m2 = (dev ** 2).mean(axis=0)
+                m3 = (dev ** 3).mean(axis=0)
+                m4 = (dev ** 4).mean(axis=0)
+                std = np.sqrt(m2 * n / (n - 1)) if n > 1 else np.full_like(mean, np.nan)
+                skew = np.sqrt(n * (n - 1)) / (n - 2) * m3 / m2 ** 1.5 if n > 2 else np.full_like(mean, np.nan)
+                kurt = ((n + 1) * (m4 / m2 ** 2 - 3) + 6) * (n - 1) / ((n - 2) * (n - 3)) if n > 3 else np.full_like(mean, np.nan)
+
+                total_return = wealth[-1] - 1
+                cagr = wealth[-1] ** (periods_per_year / n) - 1
+                vol = std * np.sqrt(periods_per_year)
+
+                excess = r - threshold
+                downside_dev = np.sqrt((np.minimum(excess, 0) ** 2).mean(axis=0)) * np.sqrt(periods_per_year)
+                sum_gains = np.maximum(excess, 0).sum(axis=0)
+                sum_losses = np.maximum(-excess, 0).sum(axis=0)
+                omega = np.where(sum_losses == 0, np.inf, sum_gains / sum_losses)
+
+                # Historical VaR / CVaR (reported as positive loss fractions)
+                q = np.quantile(r, 1 - var_level, axis=0)
+                tail = r <= q
+                cvar = -(np.where(tail, r, 0).sum(axis=0) / tail.sum(axis=0))
+
+                calmar = np.where((max_dd == 0) | (n < 12), np.nan, cagr / np.abs(max_dd))
+
+            out = {
+                'cagr': cagr,
+                'volatility': vol,
+                'sharpe': (cagr - risk_free) / vol,
+                'sortino': (cagr - risk_free) / downside_dev,
+                'max_drawdown': max_dd,
+                'max_dd_duration': dd_duration,
+                'calmar': calmar,
+                'omega': omega,
+                'skew': skew,
+                'kurtosis': kurt,
+                'var': -q,
+                'cvar': cvar,
+                'total_return': total_return,
+                'wealth': wealth,
+            }
+
+        if not is_batch:
+            wealth = out.pop('wealth')[:, 0]
+            out = {k: v[0].item() for k, v in out.items()}
+            out['wealth'] = pd.Series(wealth, index=index) if index is not None else wealth
+        elif columns is not None:
+            wealth = out.pop('wealth')
+            out = {k: pd.Series(v, index=columns) for k, v in out.items()}
+            out['wealth'] = pd.DataFrame(wealth, index=index, columns=columns)
+        return out
+
     @staticmethod
     def calculate_calmar_ratio(port_ret):
         if port_ret.empty: return np.nan
-        cum_ret = (1 + port_ret).cumprod()
-        if len(port_ret) < 12: return np.nan
-        cagr = (cum_ret.iloc[-1])**(12/len(port_ret)) - 1
-        max_dd = (cum_ret / cum_ret.cummax() - 1).min()
-        if max_dd == 0: return np.nan
-        return cagr / abs(max_dd)
+        return PortfolioAnalyzer.calculate_risk_metrics(port_ret)['calmar']
 
     @staticmethod
     def calculate_omega_ratio(port_ret, threshold=0.0):
         if port_ret.empty: return np.nan
-        gains = port_ret[port_ret > threshold] - threshold
-        losses = threshold - port_ret[port_ret < threshold]
-        sum_gains = gains.sum()
-        sum_losses = losses.sum()
-        if sum_losses == 0: return np.inf
-        return sum_gains / sum_losses
+        return PortfolioAnalyzer.calculate_risk_metrics(port_ret, threshold=threshold)['omega']
 
     @staticmethod
-    def calculate_information_ratio(port_ret, bench_ret):
-        if port_ret.empty or bench_ret.empty: return np.nan, np.nan
+    def calculate_information_ratio(port_ret, bench_ret, panel=None):
+        if panel is None:
+            if port_ret.empty or bench_ret.empty: return np.nan, np.nan
+            panel = AlignedPanel(port_ret, benchmark=bench_ret)
+        if panel.bench is None or len(panel) < 12: return np.nan, np.nan
         
-        p_df = port_ret.to_frame(name='p')
-        b_df = bench_ret.to_frame(name='b')
-        p_df['period'] = p_df.index.to_period('M')
-        b_df['period'] = b_df.index.to_period('M')
-        
-        merged = pd.merge(p_df, b_df, on='period', how='inner').dropna()
-        
-        if len(merged) < 12: return np.nan, np.nan
-        
-        active_ret = merged['p'] - merged['b']
+        active_ret = panel.port - panel.bench
         mean_active = active_ret.mean() * 12
-        tracking_error = active_ret.std() * np.sqrt(12)
+        tracking_error = active_ret.std(ddof=1) * np.sqrt(12)
         if tracking_error == 0: return np.nan, 0.0
         return mean_active / tracking_error, tracking_error
 
+    @staticmethod
+    def randomized_eigh(cov, n_components=2, n_oversamples=10, n_iter=7, seed=0):
+        """Top eigenpairs of a symmetric PSD matrix by randomized subspace iteration."""
+        rng = np.random.default_rng(seed)
+        k = min(n_components + n_oversamples, cov.shape[0])
+        Q, _ = np.linalg.qr(cov @ rng.standard_normal((cov.shape[0], k)))
+        for _ in range(n_iter):
+            Q, _ = np.linalg.qr(cov @ Q)
+        vals, vecs = np.linalg.eigh(Q.T @ cov @ Q)
+        order = np.argsort(vals)[::-1][:n_components]
+        return vals[order], Q @ vecs[:, order]
+
+    @staticmethod
+    def large_universe_pca(returns, n_components=5, shrink=True, chunk_rows=256):
+        """PCA for thousands of assets: chunked covariance (memmap-friendly), optional
+        Ledoit-Wolf shrinkage and randomized eigendecomposition.
+
+        Returns {'explained_variance_ratio', 'eigenvalues', 'components' (k x N), 'shrinkage'}.
+        """
+        values = returns.to_numpy() if isinstance(returns, pd.DataFrame) else returns
+        acc = CovarianceAccumulator(values.shape[1], chunk_rows).update(values)
+        cov, shrinkage = acc.ledoit_wolf() if shrink else (acc.covariance(), 0.0)
+        vals, vecs = PortfolioAnalyzer.randomized_eigh(cov, n_components)
+        return {'explained_variance_ratio': vals / np.trace(cov), 'eigenvalues': vals,
+                'components': vecs.T, 'shrinkage': shrinkage}
+
     @staticmethod
     def perform_pca(returns_df):
         if returns_df.shape[1] < 2: return 1.0, None
+        if returns_df.shape[1] > PortfolioAnalyzer.LARGE_UNIVERSE:
+            result = PortfolioAnalyzer.large_universe_pca(returns_df, n_components=2)
+            return result['explained_variance_ratio'][0], result
         pca = PCA(n_components=2)
-        pca.fit(returns_df)
+        pca.fit(returns_df.to_numpy(dtype=np.float64))
         return pca.explained_variance_ratio_[0], pca
 
     @staticmethod
-    def rolling_beta_analysis(port_ret, factor_df, window=24):
-        if factor_df is None or factor_df.empty or port_ret.empty:
-            return pd.DataFrame()
-
-        df_y = port_ret.to_frame(name='y')
-        df_y['period'] = df_y.index.to_period('M') 
-        df_x = factor_df.copy()
-        df_x['period'] = df_x.index.to_period('M') 
-        
-        merged = pd.merge(df_y, df_x, on='period', how='inner').dropna()
-        if merged.empty: return pd.DataFrame()
+    def rolling_beta_analysis(port_ret, factor_df, window=24, panel=None):
+        if panel is None:
+            if factor_df is None or factor_df.empty or port_ret.empty:
+                return pd.DataFrame()
+            panel = AlignedPanel(port_ret, factors=factor_df)
+        if panel.empty or panel.factors is None: return pd.DataFrame()
         
-        y = merged['y']
-        X_cols = [c for c in merged.columns if c not in ['y', 'period']]
-        X = merged[X_cols]
+        y = pd.Series(panel.port, index=panel.index)
+        F, names = panel.factor_matrix([c for c in panel.factor_names if c != 'RF'])
+        X = pd.DataFrame(F, index=panel.index, columns=names)
         
         data_len = len(y)
         if data_len < window:
@@ -345,8 +1267,7 @@ class PortfolioAnalyzer:
     @staticmethod
     def cost_drag_simulation(port_ret, cost_tier):
         if port_ret.empty: return pd.Series(), pd.Series(), 0, 0
-        cost_map = {'Low': 0.001, 'Medium': 0.006, 'High': 0.020}
-        annual_cost = cost_map.get(cost_tier, 0.006)
+        annual_cost = PortfolioAnalyzer.COST_MAP.get(cost_tier, 0.006)
         monthly_cost = (1 + annual_cost)**(1/12) - 1
         net_ret = port_ret - monthly_cost
         gross_cum = (1 + port_ret).cumprod()
@@ -363,7 +1284,7 @@ class PortfolioAnalyzer:
         total_w = w_series[available_assets].sum()
         initial_w = w_series[available_assets] / total_w
         
-        r_df = returns_df[available_assets].copy()
+        r_df = returns_df[available_assets].astype(np.float64)
         
         cum_r_index = (1 + r_df).cumprod()
         asset_values = cum_r_index.multiply(initial_w, axis=1)
@@ -388,6 +1309,489 @@ class PortfolioAnalyzer:
         
         return final_attribution.sort_values(ascending=True)
 
+class FactorSimulationEngine:
+    """Monte Carlo on k common factors plus idiosyncratic noise instead of an N x N asset covariance.
+
+    fit() regresses every asset's excess return on the French factors in one
+    least-squares call. simulate() draws only the k factors and a single
+    portfolio residual, because independent residuals aggregate to one normal
+    with variance sum(w_i^2 * s_i^2). Cost scales with k, not N^2.
+    """
+
+    def __init__(self):
+        self.tickers = []
+        self.factor_names = []
+        self.n_months = 0
+
+    def fit(self, components, factor_df, panel=None):
+        """Per-asset alpha, betas and residual vol; factor means/covariance from the same months."""
+        if panel is None:
+            if components.empty or factor_df.empty:
+                return None
+            panel = AlignedPanel(components.mean(axis=1), components, factors=factor_df)
+        if panel.empty or panel.components is None or panel.factors is None:
+            return None
+
+        names = [c for c in panel.factor_names if c != 'RF']
+        F, self.factor_names = panel.factor_matrix(names)
+        rf = panel.factor_matrix(['RF'])[0][:, 0] if 'RF' in panel.factor_names else np.zeros(len(panel))
+        Y = panel.components - rf[:, None]
+        X = np.column_stack([np.ones(len(panel)), F])
+        n, k = X.shape
+        if n <= k + 2:
+            return None
+
+        coef = np.linalg.lstsq(X, Y, rcond=None)[0]
+        resid = Y - X @ coef
+        self.tickers = list(panel.component_names)
+        self.n_months = n
+        self.alpha = coef[0]
+        self.betas = coef[1:].T                                  # (N x k)
+        self.resid_vol = np.sqrt((resid ** 2).sum(axis=0) / (n - k))
+        self.r_squared = 1 - (resid ** 2).sum(axis=0) / ((Y - Y.mean(axis=0)) ** 2).sum(axis=0)
+        self.factor_mu = F.mean(axis=0)
+        self.factor_cov = np.atleast_2d(np.cov(F, rowvar=False))
+        self.rf = rf.mean()
+        return self
+
+    def asset_table(self):
+        """Fitted loadings per asset (annualized alpha and residual vol)."""
+        table = pd.DataFrame(self.betas, index=self.tickers, columns=self.factor_names)
+        table.insert(0, 'alpha', self.alpha * 12)
+        table['resid_vol'] = self.resid_vol * np.sqrt(12)
+        table['r_squared'] = self.r_squared
+        return table
+
+    def portfolio_exposures(self, weights):
+        """(alpha, factor betas, residual variance) of a weight dict, normalized over fitted tickers."""
+        w = np.array([weights.get(t, 0.0) for t in self.tickers], dtype=float)
+        w = w / w.sum()
+        return w @ self.alpha, w @ self.betas, (w ** 2) @ (self.resid_vol ** 2)
+
+    def decomposition(self, weights):
+        """Annual return and variance share by source (Euler split of the portfolio variance)."""
+        alpha, beta, resid_var = self.portfolio_exposures(weights)
+        factor_var = beta * (self.factor_cov @ beta)
+        total_var = factor_var.sum() + resid_var
+        rows = {name: [beta[j], 12 * beta[j] * self.factor_mu[j], factor_var[j] / total_var]
+                for j, name in enumerate(self.factor_names)}
+        rows['Alpha'] = [np.nan, 12 * alpha, 0.0]
+        rows['Risk-free'] = [np.nan, 12 * self.rf, 0.0]
+        rows['Residual'] = [np.nan, 0.0, resid_var / total_var]
+        return pd.DataFrame.from_dict(rows, orient='index', columns=['exposure', 'ann_return', 'risk_share'])
+
+    def simulate(self, weights, n_years=20, n_simulations=7500, initial_investment=1000000, df_t=6, seed=None,
+                 last_date=None):
+        """Student-t factor paths mapped to portfolio value.
+
+        Factor shocks are unit-variance t draws correlated by the Cholesky factor
+        of the factor covariance; the residual is Gaussian. Paths advance month
+        by month, keeping only the (n_simulations x k) state.
+        Returns (df_stats with p10/p50/p90 per month, final_values, terminal
+        log-growth contribution per factor as an (n_simulations x k) array).
+        """
+        if not self.tickers:
+            return None, None, None
+        rng = np.random.default_rng(seed)
+        n_months = n_years * 12
+        alpha, beta, resid_var = self.portfolio_exposures(weights)
+        k = len(self.factor_names)
+        chol = np.linalg.cholesky(self.factor_cov + 1e-12 * np.eye(k))
+        scale = np.sqrt((df_t - 2) / df_t)
+        drift = self.rf + alpha + beta @ self.factor_mu - 0.5 * (beta @ self.factor_cov @ beta + resid_var)
+
+        log_wealth = np.zeros(n_simulations)
+        contrib = np.zeros((n_simulations, k))
+        stats_data = np.empty((n_months + 1, 3))
+        stats_data[0] = initial_investment
+        for t in range(1, n_months + 1):
+            f_shock = (rng.standard_t(df_t, (n_simulations, k)) * scale) @ chol.T
+            eps = rng.standard_normal(n_simulations) * np.sqrt(resid_var)
+            contrib += f_shock * beta
+            log_wealth += drift + f_shock @ beta + eps
+            stats_data[t] = initial_investment * np.exp(np.percentile(log_wealth, [10, 50, 90]))
+
+        contrib += n_months * beta * self.factor_mu
+        final_values = initial_investment * np.exp(log_wealth)
+        start = last_date if last_date is not None else pd.Timestamp.today().normalize()
+        future_dates = pd.date_range(start=start, periods=n_months + 1, freq='M')
+        df_stats = pd.DataFrame(stats_data, index=future_dates, columns=['p10', 'p50', 'p90'])
+        return df_stats, final_values, contrib
+
+class StressScenarioEngine:
+    """Replays named crisis windows and hypothetical shocks against a returns matrix."""
+
+    # Windows are inclusive return months. Asset groups are 'JP' (JPY-denominated),
+    # 'default' (everything else) or an exact ticker. Proxy scenarios replay an
+    # index per group over the window (and after it, for recovery); shock
+    # scenarios spread a total move per group geometrically over `months` and are
+    # the fallback when a proxy scenario has no index history.
+    SCENARIOS = {
+        'Dot-com Bust (2000-02)': {'start': '2000-09', 'end': '2002-09'},
+        'GFC (2007-09)': {'start': '2007-11', 'end': '2009-02'},
+        'COVID Crash (2020)': {'start': '2020-02', 'end': '2020-03'},
+        '2022 Rate Shock': {'start': '2022-01', 'end': '2022-10'},
+        '1990s JPY Crash (Proxy)': {'start': '1990-01', 'end': '1992-07',
+                                    'proxies': {'JP': '^N225', 'default': '^GSPC'},
+                                    'shocks': {'JP': -0.40, 'default': -0.20}, 'months': 12},
+    }
+
+    def __init__(self, scenarios=None, proxy_returns=None):
+        self.scenarios = dict(self.SCENARIOS if scenarios is None else scenarios)
+        self.proxy_returns = proxy_returns if proxy_returns is not None else pd.DataFrame()
+
+    @classmethod
+    def proxy_requirements(cls):
+        """(proxy tickers, fetch start) covering every default proxy scenario."""
+        specs = [spec for spec in cls.SCENARIOS.values() if 'proxies' in spec]
+        tickers = sorted({t for spec in specs for t in spec['proxies'].values()})
+        start = min(pd.Period(spec['start'], freq='M') for spec in specs) - 1
+        return tuple(tickers), start.start_time.strftime('%Y-%m-%d')
+
+    def add_scenario(self, name, start=None, end=None, shocks=None, months=1, proxies=None):
+        """Register a date window (start/end, optionally replayed on `proxies`) or a shock vector scenario."""
+        if start is not None and end is not None:
+            self.scenarios[name] = {'start': start, 'end': end}
+            if proxies is not None:
+                self.scenarios[name]['proxies'] = dict(proxies)
+            if shocks is not None:
+                self.scenarios[name].update(shocks=dict(shocks), months=int(months))
+        elif shocks is not None:
+            self.scenarios[name] = {'shocks': dict(shocks), 'months': int(months)}
+        else:
+            raise ValueError("Scenario needs either start/end or shocks.")
+
+    @staticmethod
+    def _group(ticker, mapping):
+        """Key of `mapping` that applies to a ticker: itself, 'JP' or 'default'."""
+        if ticker in mapping:
+            return ticker
+        return 'JP' if is_japan_ticker(ticker) and 'JP' in mapping else 'default'
+
+    def _proxy_matrix(self, spec, components):
+        """Proxy index returns laid out per asset column, or None when any proxy is missing."""
+        proxies = spec['proxies']
+        symbols = [proxies.get(self._group(t, proxies)) for t in components.columns]
+        if any(s is None or s not in self.proxy_returns.columns for s in symbols):
+            return None
+        history = self.proxy_returns[symbols].dropna()
+        history.columns = components.columns
+        return history
+
+    @staticmethod
+    def _weight_matrix(weights, tickers):
+        """Normalize a weight dict, vector or (K x N) batch to rows summing to 1."""
+        if isinstance(weights, dict):
+            W = np.array([[weights.get(t, 0.0) for t in tickers]], dtype=float)
+        else:
+            W = np.atleast_2d(np.asarray(weights, dtype=float))
+        totals = W.sum(axis=1, keepdims=True)
+        totals[totals == 0] = 1.0
+        return W / totals
+
+    def _scenario_returns(self, spec, components):
+        """Return (window returns, post-window returns, coverage, kind).
+
+        Coverage is the share of the scenario's months found in the history
+        replayed; windows that only partly overlap it are replayed on the
+        overlapping months. Kind is 'Historical', 'Proxy' or 'Hypothetical'
+        (a shock, which has no post-window path to recover on).
+        """
+        history, kind = components, 'Historical'
+        if 'proxies' in spec:
+            history, kind = self._proxy_matrix(spec, components), 'Proxy'
+        if history is None or 'start' not in spec:
+            if 'shocks' not in spec:
+                return None, None, 0.0, kind
+            shocks = spec['shocks']
+            months = max(1, spec.get('months', 1))
+            total = np.array([shocks.get(self._group(t, shocks), 0.0) for t in components.columns])
+            monthly = (1 + total) ** (1 / months) - 1
+            return np.tile(monthly, (months, 1)), np.empty((0, components.shape[1])), 1.0, 'Hypothetical'
+
+        window = history.loc[spec['start']:spec['end']]
+        if window.empty:
+            return None, None, 0.0, kind
+        tail = history.loc[history.index > window.index[-1]]
+        expected = len(pd.period_range(spec['start'], spec['end'], freq='M'))
+        return window.to_numpy(dtype=float), tail.to_numpy(dtype=float), min(len(window) / expected, 1.0), kind
+
+    def replay(self, components, weights, names=None):
+        """Replay scenarios for one portfolio or a (K x N) batch of weight vectors.
+
+        Returns arrays shaped (scenarios x portfolios): 'total_return',
+        'max_drawdown', 'recovery_months' (NaN if not yet recovered, or for a
+        hypothetical shock) and 'contribution' (scenarios x portfolios x assets,
+        Carino-linked so each row sums to the scenario return), plus 'coverage'
+        and 'kind' per scenario.
+        """
+        names = list(self.scenarios) if names is None else list(names)
+        tickers = list(components.columns)
+        W = self._weight_matrix(weights, tickers)
+        S, K, N = len(names), W.shape[0], len(tickers)
+
+        total_return = np.full((S, K), np.nan)
+        max_dd = np.full((S, K), np.nan)
+        recovery = np.full((S, K), np.nan)
+        contribution = np.full((S, K, N), np.nan)
+        coverage = np.zeros(S)
+        kind = np.empty(S, dtype=object)
+        cols = np.arange(K)
+
+        for s, name in enumerate(names):
+            R, tail, coverage[s], kind[s] = self._scenario_returns(self.scenarios[name], components)
+            if R is None:
+                continue
+
+            port = R @ W.T  # (L x K)
+            path = np.vstack([np.ones((1, K)), np.cumprod(1 + port, axis=0)])
+            peak = np.maximum.accumulate(path, axis=0)
+            dd = path / peak - 1
+            trough = dd.argmin(axis=0)
+            total_return[s] = path[-1] - 1
+            max_dd[s] = dd[trough, cols]
+
+            # Recovery: first month after the trough back at the pre-trough peak
+            if len(tail):
+                path = np.vstack([path, path[-1] * np.cumprod(1 + tail @ W.T, axis=0)])
+            steps = np.arange(path.shape[0])[:, None]
+            recovered = (steps > trough) & (path >= peak[trough, cols])
+            recovery[s] = np.where(recovered.any(axis=0), recovered.argmax(axis=0) - trough, np.nan)
+            recovery[s, max_dd[s] == 0] = 0
+            if kind[s] == 'Hypothetical':
+                recovery[s] = np.nan
+
+            # Carino-smoothed loss contribution per asset
+            with np.errstate(divide='ignore', invalid='ignore'):
+                kt = np.where(port == 0, 1.0, np.log1p(port) / port)
+                k = np.where(total_return[s] == 0, 1.0, np.log1p(total_return[s]) / total_return[s])
+            contribution[s] = np.einsum('lk,ln,kn->kn', kt, R, W) / k[:, None]
+
+        return {
+            'names': names,
+            'tickers': tickers,
+            'total_return': total_return,
+            'max_drawdown': max_dd,
+            'recovery_months': recovery,
+            'contribution': contribution,
+            'coverage': coverage,
+            'kind': kind,
+        }
+
+    @staticmethod
+    def to_frame(result, portfolio=0):
+        """Tabulate one portfolio of a replay result (rows = scenarios)."""
+        df = pd.DataFrame({
+            'Return': result['total_return'][:, portfolio],
+            'Max Drawdown': result['max_drawdown'][:, portfolio],
+            'Recovery (Months)': result['recovery_months'][:, portfolio],
+            'Coverage': result['coverage'],
+            'Kind': result['kind'],
+        }, index=result['names'])
+        contrib = pd.DataFrame(result['contribution'][:, portfolio, :], index=result['names'], columns=result['tickers'])
+        return pd.concat([df, contrib], axis=1).dropna(subset=['Return'])
+
+    @staticmethod
+    def summarize(stress_df):
+        """One-line text per scenario for reports; partial windows and hypothetical shocks are marked."""
+        summary = {}
+        for name, row in stress_df.iterrows():
+            hypothetical = row.get('Kind') == 'Hypothetical'
+            if hypothetical:
+                recovery = "recovery N/A (hypothetical shock)"
+            elif np.isnan(row['Recovery (Months)']):
+                recovery = "not recovered"
+            else:
+                recovery = f"{row['Recovery (Months)']:.0f}m"
+            text = f"{row['Return']:.1%} / DD {row['Max Drawdown']:.1%} / {recovery}"
+            if row.get('Kind') == 'Proxy':
+                text += " (index proxy)"
+            if row['Coverage'] < 1:
+                text += f" (partial: {row['Coverage']:.0%} of window)"
+            summary[name] = text
+        return summary
+
+class SufficientStatistics:
+    """Running cross-products for one basket, so metrics for any weight vector need no pass over history.
+
+    Holds asset sums and R'R, benchmark sums and R'b, and [1, F]'[1, F] / [1, F]'R
+    for the factor regression (RF is not a regressor, as in
+    perform_factor_regression). update() folds in only months newer than the
+    last one seen, and starts over when the layout changes or the panel's
+    values for already-seen months no longer match the stored sums. Instances are shared process-wide via for_basket() and live
+    in SHARED_CACHE, so idle baskets are evicted with the rest of the cache.
+    """
+
+    TTL = 3600 * 24
+    _registry_lock = threading.Lock()
+
+    @classmethod
+    def for_basket(cls, key, panel=None):
+        """Shared instance for `key`, updated with `panel` when given."""
+        cache_key = (f"{cls.__qualname__}.for_basket", key, ())
+        with cls._registry_lock:
+            stats = SHARED_CACHE.get(cache_key)
+            if stats is None:
+                stats = cls()
+                SHARED_CACHE.set(cache_key, stats, cls.TTL)
+        if panel is not None and stats.update(panel):
+            SHARED_CACHE.set(cache_key, stats, cls.TTL)  # re-account the grown arrays
+        return stats
+
+    def __sizeof__(self):
+        arrays = [self.sum_r, self.rr, self.rb, self.xx, self.xr]
+        return object.__sizeof__(self) + sum(a.nbytes for a in arrays if a is not None)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset(None)
+
+    def _reset(self, layout):
+        self.layout = layout
+        self.n = 0
+        self.first_month = None
+        self.last_month = None
+        self.tickers, has_bench, self.factor_names = (list(layout[0]), layout[1], [f for f in layout[2] if f != 'RF']) if layout else ([], False, [])
+        n_assets, k = len(self.tickers), len(self.factor_names) + 1
+        self.sum_r = np.zeros(n_assets)
+        self.rr = np.zeros((n_assets, n_assets))
+        self.sum_b = 0.0 if has_bench else None
+        self.bb = 0.0
+        self.rb = np.zeros(n_assets)
+        self.xx = np.zeros((k, k)) if self.factor_names else None
+        self.xr = np.zeros((k, n_assets)) if self.factor_names else None
+
+    def update(self, panel):
+        """Fold in the panel's months newer than the last update; returns the number added."""
+        layout = (tuple(panel.component_names), panel.bench is not None, tuple(panel.factor_names))
+        with self._lock:
+            if layout != self.layout or (self.n and not self._matches_seen(panel)):
+                self._reset(layout)
+            new = panel.months > self.last_month if self.n else np.ones(len(panel), dtype=bool)
+            if not new.any():
+                return 0
+
+            R = panel.components[new].astype(np.float64)
+            self.sum_r += R.sum(axis=0)
+            self.rr += R.T @ R
+            if self.sum_b is not None:
+                b = panel.bench[new]
+                self.sum_b += b.sum()
+                self.bb += b @ b
+                self.rb += R.T @ b
+            if self.xx is not None:
+                X = np.column_stack([np.ones(len(R)), panel.factor_matrix(self.factor_names)[0][new]])
+                self.xx += X.T @ X
+                self.xr += X.T @ R
+
+            self.n += int(new.sum())
+            self.first_month = int(panel.months[0]) if self.first_month is None else self.first_month
+            self.last_month = int(panel.months[new][-1])
+            return int(new.sum())
+
+    def _matches_seen(self, panel):
+        """True if the panel holds the same months and values that were already folded in."""
+        seen = (panel.months >= self.first_month) & (panel.months <= self.last_month)
+        if not len(panel) or panel.months[0] != self.first_month or int(seen.sum()) != self.n:
+            return False
+        # Column sums are a cheap fingerprint: a different benchmark or factor set under the same key changes them
+        checks = [(panel.components[seen].sum(axis=0, dtype=np.float64), self.sum_r)]
+        if self.sum_b is not None:
+            checks.append((panel.bench[seen].sum(), self.sum_b))
+        if self.xx is not None:
+            checks.append((panel.factor_matrix(self.factor_names)[0][seen].sum(axis=0), self.xx[0, 1:]))
+        return all(np.allclose(a, b, rtol=1e-9, atol=1e-12) for a, b in checks)
+
+    def portfolio_metrics(self, weights, risk_free=0.02, periods_per_year=12):
+        """Arithmetic vol / Sharpe, tracking error / IR and factor betas for a weight dict or vector."""
+        with self._lock:
+            if self.n < 2:
+                return None
+            if isinstance(weights, dict):
+                w = np.array([weights.get(t, 0.0) for t in self.tickers], dtype=float)
+            else:
+                w = np.asarray(weights, dtype=float)
+            w = w / w.sum()
+            n = self.n
+
+            mu = self.sum_r / n
+            cov = (self.rr - n * np.outer(mu, mu)) / (n - 1)
+            mean_p = w @ mu
+            vol = np.sqrt(max(w @ cov @ w, 0.0) * periods_per_year)
+            out = {
+                'n_months': n,
+                'mean': mean_p * periods_per_year,
+                'volatility': vol,
+                'sharpe': (mean_p * periods_per_year - risk_free) / vol if vol > 0 else np.nan,
+            }
+
+            if self.sum_b is not None:
+                mu_b = self.sum_b / n
+                var_b = (self.bb - n * mu_b ** 2) / (n - 1)
+                cov_rb = (self.rb - n * mu * mu_b) / (n - 1)
+                te = np.sqrt(max(w @ cov @ w - 2 * w @ cov_rb + var_b, 0.0) * periods_per_year)
+                out['tracking_error'] = te
+                out['information_ratio'] = (mean_p - mu_b) * periods_per_year / te if te > 0 else np.nan
+
+            if self.xx is not None:
+                xy = self.xr @ w
+                beta = np.linalg.solve(self.xx, xy)
+                yy = w @ self.rr @ w
+                sst = yy - n * mean_p ** 2
+                out['betas'] = pd.Series(beta, index=['const'] + self.factor_names)
+                out['r_squared'] = 1 - (yy - beta @ xy) / sst if sst > 0 else np.nan
+            return out
+
+class ParameterSweepEngine:
+    """What-if grids (horizon x cost tier x weight tweak) on one shared set of random draws."""
+
+    @staticmethod
+    def tweak_weights(weights, ticker, delta):
+        """Move `delta` of total weight into `ticker` (negative = out), scaling the others pro rata."""
+        total = sum(weights.values())
+        w = {k: v / total for k, v in weights.items()}
+        target = min(max(w.get(ticker, 0.0) + delta, 0.0), 1.0)
+        rest = 1.0 - w.get(ticker, 0.0)
+        scale = (1.0 - target) / rest if rest > 0 else 0.0
+        out = {k: v * scale for k, v in w.items() if k != ticker}
+        out[ticker] = target
+        return out
+
+    @staticmethod
+    def run_sweep(returns_df, weights, horizons=(10, 15, 20), cost_tiers=('Low', 'Medium', 'High'),
+                  weight_tweaks=None, n_simulations=5000, initial_investment=1000000,
+                  volatility_model='constant', sampling='pseudo', seed=0):
+        """Tidy results table with one row per (tweak, cost tier, horizon).
+
+        Every cell uses the same innovations, so differences between cells
+        come from the parameters rather than simulation noise. One
+        run_monte_carlo_simulation per (tweak, tier) covers all horizons
+        because shorter horizons read a prefix of the same draws.
+        """
+        weight_tweaks = {'Current': weights} if weight_tweaks is None else weight_tweaks
+        max_months = max(horizons) * 12
+        Z = PortfolioAnalyzer.draw_innovations(max_months, n_simulations, sampling, rng=seed)
+
+        rows = []
+        for label, w in weight_tweaks.items():
+            port_ret, _ = PortfolioAnalyzer.create_synthetic_history(returns_df, w)
+            if port_ret.empty:
+                continue
+            for tier in cost_tiers:
+                gross_cum, net_cum, drag, annual_cost = PortfolioAnalyzer.cost_drag_simulation(port_ret, tier)
+                monthly_cost = (1 + annual_cost)**(1/12) - 1
+                df_stats, _ = PortfolioAnalyzer.run_monte_carlo_simulation(
+                    port_ret - monthly_cost, n_years=max(horizons), initial_investment=initial_investment,
+                    volatility_model=volatility_model, seed=seed, innovations=Z)
+                for h in horizons:
+                    at = df_stats.iloc[h * 12]
+                    rows.append({
+                        'tweak': label, 'cost_tier': tier, 'horizon_years': h,
+                        'p10': at['p10'], 'p50': at['p50'], 'p90': at['p90'],
+                        'hist_net_growth': net_cum.iloc[-1], 'hist_cost_drag': drag,
+                    })
+        return pd.DataFrame(rows)
+
 class PortfolioDiagnosticEngine:
     @staticmethod
     def generate_report(weights_dict, pca_ratio, port_ret, benchmark_ret=None):
@@ -425,16 +1829,44 @@ class PortfolioDiagnosticEngine:
         return report
 
     @staticmethod
-    def get_skew_kurt_desc(port_ret):
+    def get_skew_kurt_desc(port_ret, metrics=None):
         if port_ret.empty: return "Insufficient data."
-        skew = port_ret.skew()
-        kurt = port_ret.kurt()
+        if metrics is None:
+            metrics = PortfolioAnalyzer.calculate_risk_metrics(port_ret)
+        skew = metrics['skew']
+        kurt = metrics['kurtosis']
         desc = []
         if skew < -0.5: desc.append("⚠️ Negative Skew: Risk of sudden large losses.")
         elif skew > 0.5: desc.append("✅ Positive Skew: Potential for large upside.")
         if kurt > 2.0: desc.append("⚠️ Fat Tails: Extreme events are more likely than normal.")
         return " ".join(desc) if desc else "Distribution is statistically normal."
 
+    @staticmethod
+    def generate_detailed_review(sharpe_ratio, vol, max_dd):
+        """Plain-language review of efficiency, stability and drawdown."""
+        detailed_review = []
+
+        # 効率性評価
+        if sharpe_ratio > 1.0:
+            detailed_review.append(f"✅ Efficiency: The portfolio demonstrates excellent risk-adjusted returns (Sharpe: {sharpe_ratio:.2f}). You are getting well-compensated for the risk taken.")
+        elif sharpe_ratio > 0.6:
+            detailed_review.append(f"ℹ️ Efficiency: The portfolio has a balanced risk/return profile (Sharpe: {sharpe_ratio:.2f}), typical for a diversified equity strategy.")
+        else:
+            detailed_review.append(f"⚠️ Efficiency: Risk-adjusted returns are lower than ideal (Sharpe: {sharpe_ratio:.2f}). Consider increasing diversification or reducing volatile assets.")
+
+        # ボラティリティ評価
+        if vol < 0.12:
+            detailed_review.append(f"🛡️ Stability: Volatility is low ({vol:.2%}), suggesting a defensive posture suitable for capital preservation.")
+        elif vol < 0.18:
+            detailed_review.append(f"⚖️ Stability: Volatility is moderate ({vol:.2%}), aligning with standard market fluctuations.")
+        else:
+            detailed_review.append(f"🔥 Stability: Volatility is high ({vol:.2%}). Ensure your risk tolerance matches this potential variance.")
+
+        # ドローダウン評価
+        detailed_review.append(f"📉 Stress Test: The historical maximum drawdown was {max_dd:.2%}. In future bear markets, expect temporary declines of similar magnitude.")
+
+        return "\n".join(detailed_review)
+
     @staticmethod
     def generate_factor_report(params):
         """Translate Factor Analysis."""
@@ -458,7 +1890,15 @@ class PortfolioDiagnosticEngine:
         elif smb < -0.15:
             comments.append("🐘 **Large-Cap Bias:** Stable, established companies.")
         
-        # 3. Mkt-RF
+        # 3. RMW / CMA (5-factor models)
+        if params.get('RMW', 0) > 0.15:
+            comments.append("💎 **Quality Tilt:** Exposed to highly profitable companies.")
+        if params.get('CMA', 0) > 0.15:
+            comments.append("🏗️ **Conservative Investment:** Leans toward firms with low asset growth.")
+        elif params.get('CMA', 0) < -0.15:
+            comments.append("📈 **Aggressive Investment:** Leans toward fast-expanding firms.")
+
+        # 4. Mkt-RF
         mkt = params.get('Mkt-RF', 1.0)
         if mkt > 1.1:
             comments.append("🎢 **High Beta:** Aggressive risk-taking profile.")
@@ -0,0 +1,222 @@
+import os
+import io
+import re
+import json
+import time
+import uuid
+import zipfile
+import threading
+
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+
+from data_cache import file_lock
+
+# =========================================================
+# 💾 Analysis Snapshots (Parquet tables + JSON metadata in one file)
+# =========================================================
+#   <root>/<client>/<snapshot_id>.fsnap.zip
+#       meta.json                  format version, settings, weights, payload
+#       tables/<name>.parquet      returns, benchmark, components, factors, MC summary, ...
+#       tables/factor_sets/<label>.parquet
+#       figs/<key>.json            plotly figures for create_pdf_report
+#   <root>/index.json              {client: [snapshot summaries, newest first]}
+
+SNAPSHOT_DIR = os.environ.get("FACTOR_SIM_SNAPSHOT_DIR", os.path.join(os.path.expanduser("~"), ".factor_sim", "snapshots"))
+FORMAT_VERSION = 1
+
+# portfolio_data entries stored as tables; everything else JSON-serializable goes to meta.json
+TABLE_KEYS = ('returns', 'benchmark', 'components', 'factors')
+
+
+def _slug(text):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', str(text)).strip('_') or 'default'
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return str(value)
+    raise TypeError(f"Not JSON serializable: {type(value).__name__}")
+
+
+def _to_parquet(obj):
+    frame = obj.to_frame('value') if isinstance(obj, pd.Series) else obj
+    frame = frame.rename(columns=str)
+    buf = io.BytesIO()
+    frame.to_parquet(buf, index=True)
+    return buf.getvalue()
+
+
+def _from_parquet(data, series=False):
+    frame = pd.read_parquet(io.BytesIO(data))
+    return frame['value'].rename(None) if series else frame
+
+
+def pack_snapshot(portfolio_data, payload, figs=None, tables=None, client='default', label=None):
+    """Serialize one analysis into snapshot bytes; returns (bytes, meta)."""
+    snapshot_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'snapshot_id': snapshot_id,
+        'client': client,
+        'label': label or ", ".join(list(portfolio_data.get('weights', {}))[:5]),
+        'created_at': time.time(),
+        'settings': {k: v for k, v in portfolio_data.items()
+                     if k not in TABLE_KEYS and k != 'factor_sets'},
+        'series': [k for k in TABLE_KEYS if isinstance(portfolio_data.get(k), pd.Series)],
+        'tables': [],
+        'table_series': [],
+        'factor_sets': list((portfolio_data.get('factor_sets') or {}).keys()),
+        'figs': [],
+        'payload': payload or {},
+    }
+
+    buf = io.BytesIO()
+    # Parquet pages are already compressed; store them as-is
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_STORED) as zf:
+        for key in TABLE_KEYS:
+            obj = portfolio_data.get(key)
+            if isinstance(obj, (pd.DataFrame, pd.Series)):
+                zf.writestr(f"tables/{key}.parquet", _to_parquet(obj))
+        for i, (name, frame) in enumerate((portfolio_data.get('factor_sets') or {}).items()):
+            zf.writestr(f"tables/factor_sets/{i}.parquet", _to_parquet(frame))
+        for name, obj in (tables or {}).items():
+            # Empty results are kept too: the dashboard renders straight from this set
+            if isinstance(obj, (pd.DataFrame, pd.Series)):
+                zf.writestr(f"tables/extra_{_slug(name)}.parquet", _to_parquet(obj))
+                meta['tables'].append(name)
+                if isinstance(obj, pd.Series):
+                    meta['table_series'].append(name)
+        for key, fig in (figs or {}).items():
+            if fig is not None:
+                zf.writestr(f"figs/{_slug(key)}.json", fig.to_json())
+                meta['figs'].append(key)
+        zf.writestr("meta.json", json.dumps(meta, default=_json_default, ensure_ascii=False))
+    return buf.getvalue(), meta
+
+
+def unpack_snapshot(data):
+    """Inverse of pack_snapshot: returns (portfolio_data, payload, figs, tables, meta)."""
+    source = io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
+    with zipfile.ZipFile(source) as zf:
+        meta = json.loads(zf.read("meta.json"))
+        if meta.get('format_version', 0) > FORMAT_VERSION:
+            raise ValueError(f"Snapshot format {meta['format_version']} is newer than supported ({FORMAT_VERSION}).")
+        names = set(zf.namelist())
+
+        portfolio_data = dict(meta['settings'])
+        for key in TABLE_KEYS:
+            if f"tables/{key}.parquet" in names:
+                portfolio_data[key] = _from_parquet(zf.read(f"tables/{key}.parquet"), series=key in meta['series'])
+        portfolio_data['factor_sets'] = {
+            label: _from_parquet(zf.read(f"tables/factor_sets/{i}.parquet")) for i, label in enumerate(meta['factor_sets'])
+        }
+        tables = {name: _from_parquet(zf.read(f"tables/extra_{_slug(name)}.parquet"), series=name in meta.get('table_series', ()))
+                  for name in meta['tables']}
+        figs = {key: pio.from_json(zf.read(f"figs/{_slug(key)}.json").decode("utf-8")) for key in meta['figs']}
+    return portfolio_data, meta['payload'], figs, tables, meta
+
+
+class SnapshotStore:
+    """Saved analyses on disk, listed per client through a compact JSON index.
+
+    Index updates are read-merge-write under a sidecar file lock, so several
+    app or worker processes can save to the same root.
+    """
+
+    def __init__(self, root=SNAPSHOT_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.root, "index.json")
+
+    def _read_index(self):
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp, self.index_path)
+
+    def save(self, portfolio_data, payload, figs=None, tables=None, client='default', label=None):
+        """Write a snapshot and register it in the index; returns its meta."""
+        data, meta = pack_snapshot(portfolio_data, payload, figs, tables, client, label)
+        folder = os.path.join(self.root, _slug(client))
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{meta['snapshot_id']}.fsnap.zip")
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        entry = {
+            'snapshot_id': meta['snapshot_id'], 'label': meta['label'], 'created_at': meta['created_at'],
+            'path': os.path.relpath(path, self.root), 'size': len(data),
+            'tickers': list(portfolio_data.get('weights', {}).keys()),
+            'metrics': {k: v for k, v in (payload or {}).get('metrics', {}).items() if k in ('CAGR', 'Volatility', 'Sharpe Ratio')},
+        }
+        with self._lock, file_lock(self.index_path):
+            index = self._read_index()
+            index.setdefault(client, []).insert(0, entry)
+            self._write_index(index)
+        return meta
+
+    def clients(self):
+        return sorted(self._read_index().keys())
+
+    def list(self, client=None):
+        """Index entries as a DataFrame (one client or all), newest first."""
+        index = self._read_index()
+        rows = [dict(e, client=c) for c, entries in index.items() if client is None or c == client for e in entries]
+        if not rows:
+            return pd.DataFrame()
+        frame = pd.DataFrame(rows).sort_values('created_at', ascending=False)
+        frame['created'] = pd.to_datetime(frame['created_at'], unit='s').dt.strftime('%Y-%m-%d %H:%M')
+        return frame.set_index('snapshot_id')
+
+    def _entry(self, snapshot_id):
+        for client, entries in self._read_index().items():
+            for e in entries:
+                if e['snapshot_id'] == snapshot_id:
+                    return client, e
+        return None, None
+
+    def read_bytes(self, snapshot_id):
+        _, entry = self._entry(snapshot_id)
+        if entry is None:
+            raise KeyError(snapshot_id)
+        with open(os.path.join(self.root, entry['path']), "rb") as f:
+            return f.read()
+
+    def load(self, snapshot_id):
+        """(portfolio_data, payload, figs, tables, meta) of a saved snapshot."""
+        return unpack_snapshot(self.read_bytes(snapshot_id))
+
+    def delete(self, snapshot_id):
+        with self._lock, file_lock(self.index_path):
+            index = self._read_index()
+            for client, entries in index.items():
+                for e in entries:
+                    if e['snapshot_id'] == snapshot_id:
+                        try:
+                            os.unlink(os.path.join(self.root, e['path']))
+                        except OSError:
+                            pass
+                        entries.remove(e)
+                        self._write_index({c: v for c, v in index.items() if v})
+                        return True
+        return False
+
+
+SNAPSHOTS = SnapshotStore()
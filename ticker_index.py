@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import yfinance as yf
+
+from data_cache import file_lock
+
+# =========================================================
+# 🗂️ Ticker Metadata Index (existence, currency, listing range)
+# =========================================================
+
+INDEX_PATH = os.environ.get("FACTOR_SIM_TICKER_INDEX", os.path.join(tempfile.gettempdir(), "factor_sim_ticker_index.json"))
+MAX_AGE = 3600 * 24 * 7          # positive records
+NEGATIVE_MAX_AGE = 3600 * 24     # "does not exist" records
+
+# Fallback when a symbol has no record yet (offline): Yahoo suffix -> quote currency
+SUFFIX_CURRENCY = {
+    '.T': 'JPY', '.L': 'GBp', '.HK': 'HKD', '.TO': 'CAD', '.V': 'CAD', '.AX': 'AUD', '.SW': 'CHF',
+    '.PA': 'EUR', '.DE': 'EUR', '.F': 'EUR', '.AS': 'EUR', '.MI': 'EUR', '.MC': 'EUR', '.BR': 'EUR',
+    '.KS': 'KRW', '.KQ': 'KRW', '.SI': 'SGD', '.NS': 'INR', '.BO': 'INR', '.SS': 'CNY', '.SZ': 'CNY',
+    '.TW': 'TWD', '.ST': 'SEK', '.OL': 'NOK', '.CO': 'DKK', '.SA': 'BRL', '.MX': 'MXN',
+}
+JPY_INDEX_TICKERS = ["^N225", "^TPX", "1306.T"]
+
+# Sub-unit quotes (pence, cents, agorot): (ISO currency, multiplier)
+MINOR_UNITS = {'GBp': ('GBP', 0.01), 'GBX': ('GBP', 0.01), 'ZAc': ('ZAR', 0.01), 'ILA': ('ILS', 0.01)}
+
+
+def guess_currency(ticker):
+    """Suffix heuristic, used only until the index has a record for the symbol."""
+    ticker = str(ticker)
+    if ticker in JPY_INDEX_TICKERS:
+        return 'JPY'
+    for suffix, currency in SUFFIX_CURRENCY.items():
+        if ticker.endswith(suffix):
+            return currency
+    return 'USD'
+
+
+def _fetch_record(ticker):
+    """One short monthly history request yields existence, quote metadata and the listing range.
+
+    A year of bars is enough to tell a live symbol from a dead one (analyses
+    need prices up to today); the listing start comes from the chart
+    metadata's firstTradeDate rather than from downloading the full history.
+    """
+    tick = yf.Ticker(ticker)
+    hist = tick.history(period="1y", interval="1mo", auto_adjust=True)
+    if hist is None or hist.empty:
+        return {'exists': False}
+    meta = tick.get_history_metadata() or {}
+    index = hist.index.tz_localize(None) if hist.index.tz is not None else hist.index
+    first = meta.get('firstTradeDate')
+    if isinstance(first, (int, float)):
+        first = pd.to_datetime(first, unit='s')
+    return {
+        'exists': True,
+        'currency': meta.get('currency') or guess_currency(ticker),
+        'exchange': meta.get('fullExchangeName') or meta.get('exchangeName'),
+        'quote_type': meta.get('instrumentType'),
+        'first_date': pd.Timestamp(first).strftime('%Y-%m-%d') if first is not None else None,
+        'last_date': index[-1].strftime('%Y-%m-%d'),
+    }
+
+
+class TickerIndex:
+    """Persistent {ticker: metadata} index shared by sessions and worker processes.
+
+    Records carry exists, currency, exchange, quote_type, first_date,
+    last_date and refreshed_at. Lookups are dictionary reads; refresh() fetches
+    only the requested symbols, concurrently, and merges them into the JSON
+    file under a sidecar file lock (then an atomic replace), so concurrent
+    writers in other processes do not clobber each other.
+    """
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self._records = {}
+        self._mtime = None
+        self._lock = threading.RLock()
+
+    def _reload(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self._records = json.load(f)
+            self._mtime = mtime
+        except (OSError, ValueError):
+            pass
+
+    def _save(self, updates):
+        with self._lock, file_lock(self.path):
+            self._mtime = None
+            self._reload()  # merge with what other processes wrote meanwhile
+            self._records.update(updates)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._records, f)
+            os.replace(tmp, self.path)
+            self._mtime = os.path.getmtime(self.path)
+
+    def get(self, ticker):
+        with self._lock:
+            self._reload()
+            return self._records.get(str(ticker))
+
+    def is_fresh(self, record, max_age=MAX_AGE):
+        if record is None:
+            return False
+        limit = max_age if record.get('exists') else min(max_age, NEGATIVE_MAX_AGE)
+        return time.time() - record.get('refreshed_at', 0) <= limit
+
+    def refresh(self, tickers, max_workers=8):
+        """Fetch metadata for `tickers` concurrently and persist it; returns {ticker: record}.
+
+        Symbols that error out are skipped. "Does not exist" is only recorded when
+        at least one symbol in the batch resolved, so a network outage is not
+        cached as a batch of missing tickers.
+        """
+        tickers = list(dict.fromkeys(str(t) for t in tickers))
+        if not tickers:
+            return {}
+
+        def fetch(ticker):
+            try:
+                return ticker, _fetch_record(ticker)
+            except Exception:
+                return ticker, None
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(tickers))) as pool:
+            results = dict(pool.map(fetch, tickers))
+
+        now = time.time()
+        resolved = any(r and r['exists'] for r in results.values())
+        updates = {t: {**r, 'refreshed_at': now} for t, r in results.items() if r and (r['exists'] or resolved)}
+        if updates:
+            self._save(updates)
+        return updates
+
+    def ensure(self, tickers, max_age=MAX_AGE):
+        """Records for `tickers`, refreshing only unknown or stale ones."""
+        with self._lock:
+            self._reload()
+            records = {str(t): self._records.get(str(t)) for t in tickers}
+        stale = [t for t, r in records.items() if not self.is_fresh(r, max_age)]
+        if stale:
+            records.update(self.refresh(stale))
+        return records
+
+    def refresh_stale(self, max_age=MAX_AGE, max_workers=8):
+        """Bulk re-check of every indexed symbol older than max_age."""
+        with self._lock:
+            self._reload()
+            stale = [t for t, r in self._records.items() if not self.is_fresh(r, max_age)]
+        return self.refresh(stale, max_workers=max_workers)
+
+    def currency(self, ticker):
+        """Quote currency as listed (may be a sub-unit such as 'GBp')."""
+        record = self.get(ticker)
+        if record and record.get('exists') and record.get('currency'):
+            return record['currency']
+        return guess_currency(ticker)
+
+    def quote_currency(self, ticker):
+        """(ISO currency, multiplier to that currency), e.g. ('GBP', 0.01) for pence quotes."""
+        currency = self.currency(ticker)
+        return MINOR_UNITS.get(currency, (currency.upper(), 1.0))
+
+    def to_frame(self):
+        with self._lock:
+            self._reload()
+            return pd.DataFrame.from_dict(self._records, orient='index')
+
+    def __len__(self):
+        with self._lock:
+            self._reload()
+            return len(self._records)
+
+
+TICKER_INDEX = TickerIndex()